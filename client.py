@@ -5,7 +5,11 @@ import requests
 import argparse
 import json
 import ast
+import hashlib
+import tempfile
+import threading
 from time import sleep
+from concurrent.futures import ThreadPoolExecutor
 from requests_toolbelt import MultipartEncoder, MultipartEncoderMonitor
 
 __version__ = '0.0.8'
@@ -13,6 +17,10 @@ __version__ = '0.0.8'
 debug = os.getenv('DEBUG', 'false').lower() == 'true'
 default_url = 'http://127.0.0.1:8001'
 verify_ssl = True
+# Minimal size of each range of a parallel download
+parallel_min_part_size = 8 * 1024 * 1024
+# Inputs larger than this are uploaded by chunks, in parallel, with an upload session
+chunked_upload_threshold = 64 * 1024 * 1024
 # Set up logging
 import logging
 
@@ -109,16 +117,88 @@ def get_processes(url, token=None):
 
 
 # Returns a list of all jobs status
-def get_jobs(url, token=None):
-    return api_call(f'{url}/jobs', token)
+def get_jobs(url, token=None, status=None, limit=100, process=None, queue=None):
+    jobs = []
+    cursor = 0
+    while True:
+        params = {'limit': limit, 'cursor': cursor}
+        if status:
+            params['status'] = status
+        if process:
+            params['process'] = process
+        if queue:
+            params['queue'] = queue
+        res = requests.get(f'{url}/jobs', params=params, headers=get_headers(token), verify=verify_ssl)
+        res.raise_for_status()
+        res_dict = res.json()
+        jobs += res_dict['jobs']
+        cursor = res_dict.get('cursor', 0)
+        if not cursor:
+            break
+    return {'jobs': jobs}
+
+
+def follow_job_events(url, job_id, token=None):
+    """
+    Yield the job details pushed by the API server-sent events stream until the final state
+    Returns None if the API does not provide the events stream (older API)
+    """
+    res = requests.get(f'{url}/jobs/{job_id}/events', headers=get_headers(token), verify=verify_ssl, stream=True)
+    if res.status_code in (404, 405):
+        res.close()
+        return None
+    res.raise_for_status()
+
+    def events():
+        with res:
+            event, data = None, []
+            for line in res.iter_lines(decode_unicode=True):
+                if line is None:
+                    continue
+                if line == '':
+                    # end of event
+                    if event == 'error':
+                        raise RuntimeError(f"Job events stream error: {' '.join(data)}")
+                    if data:
+                        yield json.loads('\n'.join(data))
+                    event, data = None, []
+                elif line.startswith(':'):
+                    # keepalive comment
+                    continue
+                elif line.startswith('event:'):
+                    event = line[len('event:'):].strip()
+                elif line.startswith('data:'):
+                    data.append(line[len('data:'):].strip())
+    return events()
 
 
 def get_job_status(url, job_id, watch=False, batch=False, token=None, max_retry=None):
     headers = get_headers(token)
+    stream = get_stream(batch)
+    # max_retry limits the number of polls, it is not compatible with the events stream
+    events = follow_job_events(url, job_id, token) if watch and max_retry is None else None
+    if events is not None:
+        res_dict = None
+        try:
+            for res_dict in events:
+                print_followed_status(res_dict, stream)
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Job events stream interrupted: {e}")
+        if res_dict is None or res_dict['status'] not in ['SUCCESS', 'FAILURE', 'REVOKED']:
+            # The stream has been interrupted, read the current status
+            res_dict = get_job_details(url, job_id, token)
+        # print the final status
+        print_followed_status(res_dict, stream)
+        print("", file=stream)
+
+        # check if error
+        if res_dict['error'] is not None:
+            print(f"Error: {res_dict['error']}", file=stream)
+        return res_dict
+
     res = requests.get(f'{url}/jobs/{job_id}/details', headers=headers, verify=verify_ssl)
     res.raise_for_status()
     res_dict = res.json()
-    stream = get_stream(batch)
     if res.status_code not in (200, 202):
         print("Error: ", res.status_code, file=stream)
         if batch:
@@ -160,27 +240,119 @@ def get_job_outputs(url, job_id, token=None):
     return api_call(f'{url}/jobs/{job_id}/outputs', token)
 
 
-def download_job_output(url, job_id, filepath, destination, token=None):
-    headers = get_headers(token)
-    res = requests.get(f'{url}/jobs/{job_id}/outputs/{filepath}', headers=headers, verify=verify_ssl)
-    res.raise_for_status()
+def print_download_progress(file_size, total_size, bar_length=30):
+    if total_size > 0:
+        progress = 100 * file_size / total_size
+        filled_length = int(bar_length * file_size // total_size)
+        bar = '█' * filled_length + '-' * (bar_length - filled_length)
+        sys.stdout.write(f'\rDownloading: [{bar}] {progress:.1f}% ')
+    else:
+        # Streamed file, the size is unknown
+        sys.stdout.write(f'\rDownloading: {format_filesize(file_size)} ')
+    sys.stdout.flush()
+
+
+def download_file_ranges(url, part_path, headers, etag, total_size, parallel):
+    # Each thread fetches a range of the file and writes it at its offset
+    part_size = max(-(-total_size // parallel), 1)
+    lock = threading.Lock()
+    downloaded = [0]
+
+    def download_range(start, end):
+        range_headers = {**headers, 'Range': f'bytes={start}-{end}', 'If-Range': etag}
+        with requests.get(url, headers=range_headers, verify=verify_ssl, stream=True) as res:
+            res.raise_for_status()
+            if res.status_code != 206:
+                raise requests.HTTPError(f"File '{url}' changed during the download", response=res)
+            with open(part_path, 'r+b') as f:
+                f.seek(start)
+                for chunk in res.iter_content(chunk_size=1048576):
+                    f.write(chunk)
+                    with lock:
+                        downloaded[0] += len(chunk)
+                        print_download_progress(downloaded[0], total_size)
+
+    with open(part_path, 'wb') as f:
+        f.truncate(total_size)
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        futures = [executor.submit(download_range, start, min(start + part_size, total_size) - 1)
+                   for start in range(0, total_size, part_size)]
+        for future in futures:
+            future.result()
+    return downloaded[0]
 
+
+def download_file(url, destination, headers, parallel=1):
+    """
+    Download a file, the download is resumed after an interruption and may be split in parallel range requests
+    The data is written to <destination>.part, with the file ETag in <destination>.part.etag: the next call resumes
+    the download (Range + If-Range) if the file did not change on the server, or restarts it otherwise.
+    With parallel > 1, a large file is fetched with N concurrent range requests.
+    :return: the response of the first request and the downloaded file size (0 if the request failed)
+    """
+    part_path = f"{destination}.part"
+    etag_path = f"{part_path}.etag"
+    request_headers = dict(headers)
+    offset = 0
+    if os.path.exists(part_path) and os.path.exists(etag_path):
+        with open(etag_path) as f:
+            etag = f.read().strip()
+        offset = os.path.getsize(part_path)
+        if etag and offset > 0:
+            print(f"Resuming the download of '{destination}' from {format_filesize(offset)}")
+            request_headers['Range'] = f'bytes={offset}-'
+            request_headers['If-Range'] = etag
+
+    res = requests.get(url, headers=request_headers, verify=verify_ssl, stream=True)
+    if res.status_code == 416 and offset > 0:
+        # The partial file does not match the file anymore
+        res.close()
+        os.remove(etag_path)
+        os.remove(part_path)
+        return download_file(url, destination, headers, parallel)
+    if res.status_code not in (200, 206):
+        return res, 0
     if res.status_code == 200:
-        total_size = int(res.headers.get('content-length', 0))
-        file_size = 0
-        bar_length = 30
-        with open(destination, 'wb') as f:
+        # New file, or a server without range support
+        offset = 0
+
+    total_size = offset + int(res.headers.get('content-length', 0))
+    etag = res.headers.get('etag')
+    if (parallel > 1 and res.status_code == 200 and etag is not None and not etag.startswith('W/')
+            and res.headers.get('accept-ranges') == 'bytes' and total_size >= parallel_min_part_size * 2):
+        res.close()
+        if os.path.exists(etag_path):
+            os.remove(etag_path)
+        parallel = min(parallel, total_size // parallel_min_part_size)
+        file_size = download_file_ranges(url, part_path, headers, etag, total_size, parallel)
+    else:
+        # Keep the ETag to resume the download if it is interrupted
+        if etag is not None and not etag.startswith('W/'):
+            with open(etag_path, 'w') as f:
+                f.write(etag)
+        elif os.path.exists(etag_path):
+            os.remove(etag_path)
+        file_size = offset
+        with open(part_path, 'ab' if offset else 'wb') as f:
             for chunk in res.iter_content(chunk_size=1048576):
                 if chunk:
                     f.write(chunk)
                     file_size += len(chunk)
-                    progress = 100 * file_size / total_size
-                    filled_length = int(bar_length * file_size // total_size)
-                    bar = '█' * filled_length + '-' * (bar_length - filled_length)
-                    sys.stdout.write(f'\rDownloading: [{bar}] {progress:.1f}% ')
-                    sys.stdout.flush()
+                    print_download_progress(file_size, total_size)
+
+    os.replace(part_path, destination)
+    if os.path.exists(etag_path):
+        os.remove(etag_path)
+    return res, file_size
+
 
-            print(f"Job [ {job_id} ] output '{filepath}' downloaded to '{destination}' ({format_filesize(file_size)})")
+def download_job_output(url, job_id, filepath, destination, token=None, parallel=1):
+    headers = get_headers(token)
+    res, file_size = download_file(f'{url}/jobs/{job_id}/outputs/{filepath}', destination, headers, parallel)
+    res.raise_for_status()
+
+    if res.status_code in (200, 206):
+        print(f"Job [ {job_id} ] output '{filepath}' downloaded to '{destination}' ({format_filesize(file_size)})")
         return True
     else:
         print("Error: ", res.status_code)
@@ -188,45 +360,32 @@ def download_job_output(url, job_id, filepath, destination, token=None):
         return False
 
 
-def download_job_archive(url, job_id, destination, token=None):
+def download_job_archive(url, job_id, destination, token=None, parallel=1):
     headers = get_headers(token)
     retry = 0
+    # create destination folder if it does not exist
+    if not os.path.exists(os.path.realpath(os.path.dirname(destination))):
+        os.makedirs(os.path.dirname(destination))
     print("Requesting job output file download...", end="", flush=True)
-    res = requests.get(f'{url}/jobs/{job_id}/outputs/archive', headers=headers, verify=verify_ssl)
     while retry < 30:
-        res = requests.get(f'{url}/jobs/{job_id}/outputs/archive', headers=headers, verify=verify_ssl)
+        # The API streams the archive as soon as possible, older APIs return 425 until the archive is packaged.
+        # Only a packaged archive can be resumed or downloaded in parallel.
+        res, file_size = download_file(f'{url}/jobs/{job_id}/outputs/archive', destination, headers, parallel)
         if res.status_code == 425:
             retry+=1
             print(".", flush=True, end="")
             sleep(1)
             continue
-        elif res.status_code == 200:
-            print(" ready.", flush=True)
+        elif res.status_code in (200, 206):
             break
         else:
             res.raise_for_status()
 
-    # create destination folder if it does not exist
-    if not os.path.exists(os.path.realpath(os.path.dirname(destination))):
-        os.makedirs(os.path.dirname(destination))
-    total_size = int(res.headers.get('content-length', 0))
-    if res.status_code == 200:
-        file_size = 0
+    if res.status_code in (200, 206):
         bar_length = 30
-        with open(destination, 'wb') as f:
-            for chunk in res.iter_content(chunk_size=1048576):
-                if chunk:
-                    f.write(chunk)
-                    progress = 100 * file_size / total_size
-                    filled_length = int(bar_length * file_size // total_size)
-                    bar = '█' * filled_length + '-' * (bar_length - filled_length)
-                    sys.stdout.write(f'\rDownloading: [{bar}] {progress:.1f}% ')
-                    sys.stdout.flush()
-                    file_size += len(chunk)
-            progress = 100
-            bar = '█' * bar_length
-            sys.stdout.write(f'\rDownloading: [{bar}] {progress:.1f}% ')
-            print(f"\nJob [ {job_id} ] outputs downloaded to '{destination}' ({format_filesize(file_size)})")
+        bar = '█' * bar_length
+        sys.stdout.write(f'\rDownloading: [{bar}] {100:.1f}% ')
+        print(f"\nJob [ {job_id} ] outputs downloaded to '{destination}' ({format_filesize(file_size)})")
         return res
     elif res.status_code == 425:
         print("The outputs packaging task job is running")
@@ -236,6 +395,87 @@ def download_job_archive(url, job_id, destination, token=None):
         print(res.text)
         return res
 
+# Returns the sha256 of a file object and rewinds it
+def get_file_sha256(file):
+    sha256 = hashlib.sha256()
+    while content := file.read(10 * 1024 * 1024):
+        sha256.update(content)
+    file.seek(0)
+    return sha256.hexdigest()
+
+
+# Returns True if the API already stores this content (older APIs always answer 404)
+def is_blob_uploaded(url, sha256, token=None):
+    res = requests.head(f'{url}/blobs/{sha256}', headers=get_headers(token), verify=verify_ssl)
+    return res.status_code == 200
+
+
+def upload_file_in_chunks(url, file, sha256, token=None, parallel=4, retry=3):
+    """
+    Upload a file by chunks with parallel requests to an upload session, then commit it with its sha256
+    The session id is kept in a temporary file (per content) to resume an interrupted upload: only the missing
+    chunks are sent again.
+    :return: the sha256 of the stored file, None if the API does not support the upload sessions
+    """
+    headers = get_headers(token)
+    state_path = os.path.join(tempfile.gettempdir(), f"pixyz-upload-{sha256}.json")
+    size = os.fstat(file.fileno()).st_size
+    session = None
+    if os.path.exists(state_path):
+        with open(state_path) as f:
+            state = json.load(f)
+        res = requests.get(f"{url}/uploads/{state['id']}", headers=headers, verify=verify_ssl)
+        if state.get('url') == url and res.status_code == 200:
+            session = res.json()
+            print(f"Resuming the upload of '{file.name}' ({len(session['received'])}/{session['chunks']} chunks)")
+    if session is None:
+        res = requests.post(f"{url}/uploads", json={'size': size}, headers=headers, verify=verify_ssl)
+        if res.status_code in (404, 405):
+            return None
+        res.raise_for_status()
+        session = res.json()
+        with open(state_path, 'w') as f:
+            json.dump({'id': session['id'], 'url': url}, f)
+
+    missing = sorted(set(range(session['chunks'])) - set(session['received']))
+    lock = threading.Lock()
+    uploaded = [session['chunk_size'] * len(session['received'])]
+
+    def upload_chunk(index):
+        with open(file.name, 'rb') as f:
+            f.seek(index * session['chunk_size'])
+            data = f.read(session['chunk_size'])
+        for attempt in range(retry):
+            try:
+                res = requests.put(f"{url}/uploads/{session['id']}/chunks/{index}", data=data, verify=verify_ssl,
+                                   headers={**headers, 'Content-Type': 'application/octet-stream'})
+                res.raise_for_status()
+                break
+            except requests.RequestException:
+                if attempt == retry - 1:
+                    raise
+                sleep(1)
+        with lock:
+            uploaded[0] += len(data)
+            progress = 100 * min(uploaded[0], size) / size
+            bar_length = 30
+            filled_length = int(bar_length * min(uploaded[0], size) // size)
+            bar = '█' * filled_length + '-' * (bar_length - filled_length)
+            sys.stdout.write(f'\rUploading: [{bar}] {progress:.1f}% ')
+            sys.stdout.flush()
+
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        for future in [executor.submit(upload_chunk, index) for index in missing]:
+            future.result()
+
+    res = requests.post(f"{url}/uploads/{session['id']}/commit", json={'sha256': sha256}, headers=headers,
+                        verify=verify_ssl)
+    res.raise_for_status()
+    os.remove(state_path)
+    print("")
+    return res.json()['sha256']
+
+
 # Note: script_file and input_file are file objects
 def post_job(args, process='custom'):
     # Track upload progress with callback function
@@ -256,6 +496,7 @@ def post_job(args, process='custom'):
         'url': default_url,
         'entrypoint': 'main',
         'queue': None,
+        'priority': None,
         'limit': 3600,
         'input': None,
         'script': None,
@@ -265,7 +506,8 @@ def post_job(args, process='custom'):
         'result': False,
         'token': None,
         'alias': None,
-        'max_retry': None
+        'max_retry': None,
+        'upload_parallel': 4
     }
 
     default_args.update(**vars(args))
@@ -275,12 +517,26 @@ def post_job(args, process='custom'):
     config = {
         'entrypoint': args.entrypoint,
         'queue': args.queue,
+        'priority': args.priority,
         'time_limit': int(args.limit)
     }
 
+    # skip the upload of a content already stored by the API
+    input_sha256 = None
+    input_uploaded = False
+    if args.input is not None:
+        input_sha256 = get_file_sha256(args.input)
+        input_uploaded = is_blob_uploaded(args.url, input_sha256, args.token)
+        # a large input is uploaded by parallel chunks before the job creation
+        if not input_uploaded and os.fstat(args.input.fileno()).st_size >= chunked_upload_threshold:
+            input_uploaded = upload_file_in_chunks(args.url, args.input, input_sha256, args.token,
+                                                   args.upload_parallel) is not None
+        if not input_uploaded:
+            input_sha256 = None
+
     # create API form files
     form_files = {
-        'file': (os.path.basename(args.input.name), args.input, 'application/octet-stream') if args.input is not None else None,
+        'file': (os.path.basename(args.input.name), args.input, 'application/octet-stream') if args.input is not None and input_sha256 is None else None,
         'script': (os.path.basename(args.script.name), args.script, 'text/plain') if process == 'custom' and args.script is not None else None
     }
 
@@ -294,6 +550,9 @@ def post_job(args, process='custom'):
         'config': json.dumps(config),
         'name': args.alias
     }
+    if input_sha256 is not None:
+        form_data['file_sha256'] = input_sha256
+        form_data['file_name'] = os.path.basename(args.input.name)
     fields = {**form_data, **form_files}
     monitor = MultipartEncoderMonitor.from_fields(fields=fields, callback=progress_callback)
 
@@ -305,7 +564,7 @@ def post_job(args, process='custom'):
         else:
             print(f"- process:  '{process}'")
         if args.input is not None:
-            print(f"-  input file:  '{args.input.name}'")
+            print(f"-  input file:  '{args.input.name}'" + (" (already uploaded)" if input_sha256 is not None else ""))
         if form_data['params'] is not None:
             print("- script params: ", form_data['params'])
         print("- worker config: ", form_data['config'])
@@ -324,11 +583,15 @@ def post_job(args, process='custom'):
         headers = {}
 
     headers['Content-Type'] = monitor.content_type
-    if not args.batch and (args.script is not None or args.input is not None):
+    if not args.batch and (args.script is not None or form_files['file'] is not None):
         print("Uploading...", end="")
     res = requests.post(f'{args.url}/jobs', data=monitor, headers=headers, verify=verify_ssl,
                         stream=True, allow_redirects=True)
     print("\n")
+    if res.status_code == 429:
+        # The queue is full, the job is not created (the uploaded input is kept by the API and reused on retry)
+        print(f"Error: the queue is full, retry in {res.headers.get('Retry-After', '?')} seconds", file=sys.stderr)
+        return None
     res.raise_for_status()
     json_res = res.json()
     job_uuid = json_res['uuid'] if 'uuid' in json_res else None
@@ -536,6 +799,9 @@ def main():
     ## TEST CMD: ## python3 client.py jobs
     parser_jobs = subparsers.add_parser('jobs', help='List all jobs status')
     parser_jobs.add_argument('-t', '--token', type=str, help='API bearer token', default=None, required=True)
+    parser_jobs.add_argument('-s', '--status', type=str, nargs='+', help='Only list the jobs in these states (ex: RUNNING PENDING)', default=None)
+    parser_jobs.add_argument('-p', '--process', type=str, help='Only list the jobs of this process', default=None)
+    parser_jobs.add_argument('-q', '--queue', type=str, help='Only list the jobs sent to this queue', default=None)
 
     # Command Job status:
     ## TEST CMD: ## python3 client.py status -j 23d0ce51-ec6b-46cd-849a-99c72908ca9c -w
@@ -564,6 +830,8 @@ def main():
     parser_download.add_argument('-f', '--file', type=str, help='The job output file path')
     parser_download.add_argument('-o', '--output', type=str, help='Filename where to store the result file')
     parser_download.add_argument('-t', '--token', type=str, help='API bearer token', required=True)
+    parser_download.add_argument('-p', '--parallel', type=int, default=1,
+                                 help='Number of parallel range requests for a large file')
 
     # Command Download outputs archive:
     ## TEST CMD: ## python3 client.py download_all -j 23d0ce51-ec6b-46cd-849a-99c72908ca9c -o ./output_folder/archive.zip
@@ -571,6 +839,8 @@ def main():
     parser_download_archive.add_argument('-j', '--jobid', type=str, help='The job unique id', required=True)
     parser_download_archive.add_argument('-o', '--output', type=str, help='Filename where to store the result archive')
     parser_download_archive.add_argument('-t', '--token', type=str, help='API bearer token', required=True)
+    parser_download_archive.add_argument('-p', '--parallel', type=int, default=1,
+                                         help='Number of parallel range requests for a large packaged archive')
 
     # Command exec:
     ### TEST CMD: ## python3 client.py exec -s ~/projects/lab/pixyz-scheduler/scripts/process/convert_file.py -i ~/projects/lab/pixyz-webapi/data_engine/data/cad/buggy.3dxml -p '{"hello": "world"}' -l 3600 -w
@@ -580,11 +850,13 @@ def main():
     parser_exec.add_argument('-p', '--params', type=str, help='The parameters', default="{}")
     parser_exec.add_argument('-e', '--entrypoint', help='The function name to execute in the script', default='main')
     parser_exec.add_argument('-q', '--queue', type=str, help='Scheduler queue name', default=None)
+    parser_exec.add_argument('--priority', type=str, help='Job priority: high, normal, low or 0 (first served) to 9', default=None)
     parser_exec.add_argument('-l', '--limit', type=int, help='timeout limit in seconds', default=3600)
     parser_exec.add_argument('-w', '--watch', action='store_true', help='Follow the job status evolution', default=False)
     parser_exec.add_argument('-a', '--alias', type=str, help='Custom job name alias', default=None)
     parser_exec.add_argument('-r', '--result', action='store_true', help='Display the result when job done, require -w or --watch', default=False)
     parser_exec.add_argument('-t', '--token', type=str, help='API bearer token', required=True) # TODO: only for admin routes ????
+    parser_exec.add_argument('--upload-parallel', type=int, help='Number of parallel chunk uploads for a large input', default=4)
     parser_exec.add_argument('-b', '--batch', action='store_true', help='Return only the ID not without verbose mode', default=False)
 
 
@@ -596,12 +868,14 @@ def main():
     parser_process.add_argument('-p', '--params', type=str, help='The parameters', default="{}")
     parser_process.add_argument('-e', '--entrypoint', help='The function name to execute in the script', default='main')
     parser_process.add_argument('-q', '--queue', type=str, help='Scheduler queue name', default=None)
+    parser_process.add_argument('--priority', type=str, help='Job priority: high, normal, low or 0 (first served) to 9', default=None)
     parser_process.add_argument('-l', '--limit', type=int, help='timeout limit in seconds', default=3600)
     parser_process.add_argument('-w', '--watch', action='store_true', help='Follow the job status evolution', default=False)
     parser_process.add_argument('-r', '--result', action='store_true',
                              help='Display the result when job done, require -w or --watch', default=False)
     parser_process.add_argument('-a', '--alias', type=str, help='Custom job name alias', default=None)
     parser_process.add_argument('-t', '--token', type=str, help='API bearer token', required=True) # TODO: only for admin routes ????
+    parser_process.add_argument('--upload-parallel', type=int, help='Number of parallel chunk uploads for a large input', default=4)
 
 
     # Command convert:
@@ -611,9 +885,11 @@ def main():
     parser_convert.add_argument('-p', '--params', type=str, help='{"filename": "my_output", "extension": "glb"}', default="{}")
     parser_convert.add_argument('-o', '--output', type=str, help='Local output file path', default=None)
     parser_convert.add_argument('-q', '--queue', type=str, help='Scheduler queue name', default=None)
+    parser_convert.add_argument('--priority', type=str, help='Job priority: high, normal, low or 0 (first served) to 9', default=None)
     parser_convert.add_argument('-l', '--limit', type=int, help='timeout limit in seconds', default=3600)
     parser_convert.add_argument('-a', '--alias', type=str, help='Custom job name alias', default=None)
     parser_convert.add_argument('-t', '--token', type=str, help='API bearer token', required=True) # TODO: only for admin routes ????
+    parser_convert.add_argument('--upload-parallel', type=int, help='Number of parallel chunk uploads for a large input', default=4)
 
     # Command thumbnails:
     ## TEST CMD: ## python3 client.py thumbnails -i ~/projects/lab/pixyz-webapi/data_engine/data/cad/buggy.3dxml -p '{"width": 1024, "height": 768}' -o ./output_folder -l 3600
@@ -622,9 +898,11 @@ def main():
     parser_thumbnails.add_argument('-p', '--params', type=str, help='{"width": 1024, "height": 768}', default="{}")
     parser_thumbnails.add_argument('-o', '--output', type=str, help='Local output folder path', default=None)
     parser_thumbnails.add_argument('-q', '--queue', type=str, help='Scheduler queue name', default=None)
+    parser_thumbnails.add_argument('--priority', type=str, help='Job priority: high, normal, low or 0 (first served) to 9', default=None)
     parser_thumbnails.add_argument('-l', '--limit', type=int, help='timeout limit in seconds', default=3600)
     parser_thumbnails.add_argument('-a', '--alias', type=str, help='Custom job name alias', default=None)
     parser_thumbnails.add_argument('-t', '--token', type=str, help='API bearer token', required=True) # TODO: only for admin routes ????
+    parser_thumbnails.add_argument('--upload-parallel', type=int, help='Number of parallel chunk uploads for a large input', default=4)
 
     # Command metadata:
     ## TEST CMD: ## python3 client.py metadata -i ~/projects/lab/pixyz-webapi/data_engine/data/cad/buggy.3dxml -o local_metadata.json -l 3600
@@ -632,9 +910,11 @@ def main():
     parser_metadata.add_argument('-i', '--input', type=argparse.FileType('rb'), help='The local input file path', default=None, required=True)
     parser_metadata.add_argument('-o', '--output', type=str, help='Write metadata.json', default=None)
     parser_metadata.add_argument('-q', '--queue', type=str, help='Scheduler queue name', default=None)
+    parser_metadata.add_argument('--priority', type=str, help='Job priority: high, normal, low or 0 (first served) to 9', default=None)
     parser_metadata.add_argument('-l', '--limit', type=int, help='timeout limit in seconds', default=3600)
     parser_metadata.add_argument('-a', '--alias', type=str, help='Custom job name alias', default=None)
     parser_metadata.add_argument('-t', '--token', type=str, help='API bearer token', required=True) # TODO: only for admin routes ????
+    parser_metadata.add_argument('--upload-parallel', type=int, help='Number of parallel chunk uploads for a large input', default=4)
 
     # Parse the command-line arguments
     args = parser.parse_args()
@@ -680,7 +960,7 @@ def main():
             print(f"'{args.name}' process documentation not found")
     
     elif args.command == 'jobs':
-        res = get_jobs(args.url, args.token)
+        res = get_jobs(args.url, args.token, args.status, process=args.process, queue=args.queue)
         print(json.dumps(res, indent=4))
     
     elif args.command == 'status':
@@ -700,11 +980,11 @@ def main():
     
     elif args.command == 'download':
 
-        download_job_output(args.url, args.jobid, args.file, args.output, args.token)
+        download_job_output(args.url, args.jobid, args.file, args.output, args.token, args.parallel)
     
     elif args.command == 'download_all':
 
-        download_job_archive(args.url, args.jobid, args.output, args.token)
+        download_job_archive(args.url, args.jobid, args.output, args.token, args.parallel)
 
     elif args.command == 'exec':
 
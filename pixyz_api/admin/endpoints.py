@@ -1,8 +1,11 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 from . import *
+from fastapi.concurrency import run_in_threadpool
 
 router = APIRouter()
+# Mounted alone: it only reads the result backend, unlike the broadcast inspections of the admin router
+durations_router = APIRouter()
 logger = get_api_logger("api.admin.endpoints")
 
 @router.get("/tasks", status_code=status.HTTP_200_OK)
@@ -31,3 +34,16 @@ async def stats(api_key: str = Depends(verify_token)):
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"EXCEPTION: {str(e)}")
 
+
+
+@durations_router.get("/durations", status_code=status.HTTP_200_OK)
+async def durations(api_key: str = Depends(verify_token)):
+    """
+    Get the durations of the jobs by kind (process, input extension, input size) and their learned time limits
+    """
+    try:
+        model = pixyz_worker.durations.DurationModel(pixyz_worker.tasks.app.backend.client)
+        return {'enabled': pixyz_worker.durations.DurationModel.is_enabled(),
+                'kinds': await run_in_threadpool(model.get_table, pixyz_worker.config.job_time_limit)}
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"EXCEPTION: {str(e)}")
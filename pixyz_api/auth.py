@@ -3,12 +3,12 @@
 import hashlib
 import os
 
-from fastapi import HTTPException, Security
+from fastapi import HTTPException, Security, WebSocket
 from fastapi.security import APIKeyHeader
 
 from .utils import get_api_logger
 
-__all__ = ['verify_token']
+__all__ = ['verify_token', 'verify_websocket_token']
 
 logger = get_api_logger('pixyz_api.auth')
 
@@ -27,12 +27,20 @@ def validate_sha256(data, expected_hash):
     return sha256_hash == expected_hash
 
 
+def is_valid_token(api_key):
+    return api_key is not None and validate_sha256(api_key, god_hash)
+
+
 # Dependency to check the presence and validity of the token
 def verify_token(api_key: str = Security(api_key_header)):
-    if (api_key is None or
-            not validate_sha256(api_key, god_hash)):
+    if not is_valid_token(api_key):
         raise HTTPException(
             status_code=401,
             detail="Invalid token",
             headers={"WWW-Authenticate": "x-api-key"},
         )
+
+
+# The security dependencies are bound to HTTP requests, the websocket handshake is checked by the endpoint itself
+def verify_websocket_token(websocket: WebSocket):
+    return is_valid_token(websocket.headers.get('x-api-key'))
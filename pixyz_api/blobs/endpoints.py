@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from . import *
+from pixyz_api.patterns import sha256_path_pattern
+from pixyz_api.auth import verify_token
+from fastapi.security.api_key import APIKey
+from fastapi import Depends
+
+logger = get_api_logger('blobs')
+router = APIRouter()
+
+
+# Checks if an input content is already stored
+@router.head("/{sha256}", responses={404: {"description": "Unknown content"}})
+async def head_blob(sha256: sha256_path_pattern, api_key: APIKey = Depends(verify_token)):
+    """
+    Check if a content is already in the blob store, a job can then reference it with `file_sha256` instead of
+    uploading the file again
+    :param sha256: the hex sha256 of the content
+    :return: 200 with the content length, 404 if the content is unknown
+    """
+    try:
+        blob_path = pixyz_worker.share.get_blob_path(sha256)
+        size = os.path.getsize(blob_path)
+    except FileNotFoundError:
+        return Response(status_code=status.HTTP_404_NOT_FOUND)
+    except Exception as e:
+        raise_api_error(ApiError500, e)
+    return Response(status_code=status.HTTP_200_OK, headers={'Content-Length': str(size)})
@@ -1,16 +1,21 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import json
+import shutil
 
 from . import *
 from pixyz_api.patterns import uuid_path_pattern
-from pixyz_api.auth import verify_token
+from pixyz_api.auth import verify_token, verify_websocket_token
 from fastapi.security.api_key import APIKey
-from fastapi import UploadFile, File, Form, Depends
-from fastapi.responses import FileResponse
+from fastapi import Depends, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from starlette.requests import ClientDisconnect
+from fastapi.responses import StreamingResponse
+from typing import List
 
 from pixyz_worker.exception import SharePathInvalidError, SharePathNotFoundError, TaskNotCompletedError, TaskProcessingStarted
 from pixyz_worker.share import SourceInspector
+from pixyz_worker.priority import get_priority
 from kombu.exceptions import OperationalError
 
 logger = get_api_logger('api')
@@ -22,25 +27,83 @@ router = APIRouter()
 
 # Gets list of all registered jobs
 @router.get("", **get_api_response_desc_from_model(JobList))
-async def list_all_jobs_status(api_key: APIKey = Depends(verify_token)):
+async def list_all_jobs_status(api_key: APIKey = Depends(verify_token),
+                               limit: int = Query(100, ge=1, le=1000),
+                               cursor: int = Query(0, ge=0),
+                               status: List[str] | None = Query(None),
+                               process: str | None = Query(None),
+                               queue: str | None = Query(None)):
+    """
+    List the jobs status page by page
+    Without filter, all the tasks of the backend are listed. With a filter, only the jobs submitted through the API
+    are listed, most recent first, from the job index.
+    :param limit: the expected number of jobs in the page
+    :param cursor: the cursor returned by the previous page (0 for the first page)
+    :param status: keep only the jobs in these states (ex: ?status=RUNNING&status=PENDING)
+    :param process: keep only the jobs of this process
+    :param queue: keep only the jobs sent to this queue
+    :return: the jobs status and the cursor of the next page (0 if the listing is complete)
+    """
+    try:
+        if status or process or queue:
+            jobs, next_cursor = grab_indexed_tasks_list(limit, cursor, status, process, queue)
+        else:
+            jobs, next_cursor = grab_tasks_list(limit, cursor)
+        return {'jobs': jobs, 'cursor': next_cursor}
+    except Exception as e:
+        raise_api_error(ApiError500, e)
+
+# Gets the status of several jobs
+@router.post("/status", **get_api_response_desc_from_model(JobList))
+async def get_jobs_status(request: JobStatusRequest, api_key: APIKey = Depends(verify_token)):
+    """
+    Get the status of several jobs in one request
+    :param request: the list of job IDs (1000 max)
+    :return: the jobs status in the same order, unknown jobs are PENDING
+    """
+    if len(request.jobs) > 1000:
+        raise_api_error(ApiError400, "Too many jobs requested (1000 max)")
+    for job_id in request.jobs:
+        if not pixyz_worker.share.is_valid_jobid(job_id):
+            raise_api_error(ApiError400, f"Invalid job id '{job_id}'")
     try:
-        return {'jobs': grab_tasks_list()}
+        return {'jobs': grab_tasks_status(request.jobs), 'cursor': 0}
     except Exception as e:
         raise_api_error(ApiError500, e)
 
+# Job request form, parsed from the request body stream by create_new_job
+job_request_openapi = {
+    'requestBody': {
+        'required': True,
+        'content': {
+            'multipart/form-data': {
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'process': {'type': 'string', 'default': 'custom', 'description': 'process name'},
+                        'file': {'type': 'string', 'format': 'binary', 'description': 'input file'},
+                        'file_sha256': {'type': 'string', 'description': 'sha256 of an already uploaded input file '
+                                                                         '(see HEAD /blobs/{sha256}), instead of file'},
+                        'file_name': {'type': 'string', 'description': 'input file name, required with file_sha256'},
+                        'script': {'type': 'string', 'format': 'binary', 'description': 'custom process script'},
+                        'params': {'type': 'string', 'description': 'process parameters (JSON string)'},
+                        'name': {'type': 'string', 'description': 'job custom name'},
+                        'config': {'type': 'string', 'description': 'worker configuration (JSON string)'},
+                        'stages': {'type': 'string', 'description': 'stages of a multi-stage job: list of {name, '
+                                                                    'entrypoint, queue, priority, time_limit, params, '
+                                                                    'depends_on, foreach} (JSON string)'},
+                    }
+                }
+            }
+        }
+    }
+}
+
 # Creates a new job
-@router.post("", **get_api_response_desc_from_model(JobState))
-async def create_new_job(
-        api_key: APIKey = Depends(verify_token),
-        process: str = Form("custom"), # process name
-        file: UploadFile | str = File(None, example=None), # input file
-        script: UploadFile | str = File(None), # custom process script
-        params: str = Form(None, example=None), # process parameters (JSON string)
-        name: str = Form(None, example=None), # job custom name
-        config: str = Form(None, example=None), # worker configuration (JSON string)
-    ):
+@router.post("", openapi_extra=job_request_openapi, **get_api_response_desc_from_model(JobState, [ApiError409, ApiError429]))
+async def create_new_job(request: Request, api_key: APIKey = Depends(verify_token)):
     def remove_immutable_keys(user_config_: dict):
-        for key in ('script', 'data', 'shadow', 'uuid'):
+        for key in ('script', 'data', 'shadow', 'uuid', 'process'):
             if key in user_config_:
                 warnings[key] = f"The '{key}' config key is not mutable"
                 del user_config_[key]
@@ -55,12 +118,49 @@ async def create_new_job(
             if (k in dst and dst[k] is None) or (k not in dst):
                 dst[k] = src[k]
 
+    async def check_queue_admission(fields: dict):
+        # Don't upload the input of a job that would be rejected
+        queue = await run_in_threadpool(get_job_queue_from_form, fields)
+        retry_after = await run_in_threadpool(QueueAdmission.get_instance().check, queue)
+        if retry_after is not None:
+            raise_api_error(ApiError429, f"The queue '{queue}' is full, retry in {retry_after} seconds",
+                            headers={'Retry-After': str(retry_after)})
+
     # Create a new job uuid
     uuid = create_job_id()
 
-    # Upload files to shared storage
-    input_file_path = upload_file_to_job_input_shared_storage(uuid, file) if file else None
-    input_script_path = upload_file_to_job_input_shared_storage(uuid, script) if script else None
+    # Upload files to shared storage while reading the form, the text fields (config) are sent before the files
+    try:
+        parser = JobFormStreamParser(uuid, before_files=check_queue_admission)
+        form, files = await parser.parse(request)
+    except ClientDisconnect:
+        raise HTTPException(status_code=400, detail="Client disconnected during the upload")
+    except ValueError as e:
+        raise_api_error(ApiError400, f"Invalid form: {e}")
+    except SharePathNotFoundError as e:
+        # An uploaded file already in the blob store was released while it was linked
+        raise_api_error(ApiError409, e)
+
+    process = form.get('process', 'custom')
+    params = form.get('params')
+    name = form.get('name')
+    config = form.get('config')
+    input_file_path = files.get('file')
+    input_script_path = files.get('script')
+    input_sha256 = parser.hashes.get('file')
+
+    # Reuse an input already in the blob store instead of an upload
+    if input_file_path is None and form.get('file_sha256'):
+        if not form.get('file_name'):
+            raise_api_error(ApiError400, "'file_sha256' requires a 'file_name'")
+        try:
+            input_file_path = await run_in_threadpool(pixyz_worker.share.link_blob_to_job_input, form['file_sha256'],
+                                                      uuid, form['file_name'])
+            input_sha256 = form['file_sha256']
+        except SharePathInvalidError as e:
+            raise_api_error(ApiError400, e)
+        except SharePathNotFoundError as e:
+            raise_api_error(ApiError404, e)
 
     # Parse params from JSON string
     if params:
@@ -76,7 +176,7 @@ async def create_new_job(
     process_file_path = None
     
     if process == 'custom':
-        if not script:
+        if not input_script_path:
             raise_api_error(ApiError400, "'custom' process requires a 'script' file")
         
         process_file_path = input_script_path       
@@ -98,11 +198,12 @@ async def create_new_job(
         'data': input_file_path, # input file path
         'root_file': None, # Name of the root file if input is an archive # TODO archive + root file
         'time_request': get_utc_time(), # request time in UTC 
-        'time_limit': 3600, # job timeout in seconds
+        'time_limit': pixyz_worker.config.job_time_limit, # job timeout in seconds
         # Queue must be specified at the end of the process because the queue can be selected by the script
         'entrypoint': 'main', # script entrypoint
         'compute_only': False,
         'shadow': name,
+        'process': process, # process name, the kind of the job for the adaptive time limits
     }
 
     # Log task configuration 
@@ -132,10 +233,20 @@ async def create_new_job(
     # Update worker config with user config
     worker_config.update(user_config)
 
+    # A multi-stage job (DAG) runs the entrypoints of its stages instead of the job entrypoint
+    job_graph = None
+    if form.get('stages'):
+        try:
+            job_graph = pixyz_worker.dag.JobGraph(uuid, json.loads(form['stages']), name)
+        except ValueError as e:
+            raise_api_error(ApiError400, f"Invalid 'stages': {e}")
+
     # Check if the source file contains the entrypoint function otherwise raise an error
     si = SourceInspector(process_file_path)
-    if not si.is_function_exist(worker_config['entrypoint']):
-        raise_api_error(ApiError400, f"The script file does not have the function {worker_config['entrypoint']}")
+    entrypoints = job_graph.get_entrypoints() if job_graph is not None else [worker_config['entrypoint']]
+    for entrypoint in entrypoints:
+        if not si.is_function_exist(entrypoint):
+            raise_api_error(ApiError400, f"The script file does not have the function {entrypoint}")
 
     function_default_parameters = si.get_pixyz_decorator_kwargs_for_a_function(worker_config['entrypoint'])
     remove_immutable_keys(function_default_parameters)
@@ -146,24 +257,85 @@ async def create_new_job(
     # Define a queue if nobody has defined it
     worker_config['queue'] = worker_config.get('queue', 'cpu')
 
+    # A priority level (high, normal, low) or a broker priority (0-9), 0 is served first
+    try:
+        worker_config['priority'] = get_priority(worker_config.get('priority'))
+    except ValueError as e:
+        raise_api_error(ApiError400, e)
+
+    # Without an explicit time limit, a job gets a time limit learned from the previous jobs of the same kind
+    if (job_graph is None and pixyz_worker.durations.DurationModel.is_enabled() and 'time_limit' not in user_config
+            and 'time_limit' not in function_default_parameters):
+        try:
+            model = pixyz_worker.durations.DurationModel(pixyz_worker.tasks.app.backend.client)
+            kind = await run_in_threadpool(model.get_kind, process, input_file_path, worker_config['root_file'])
+            worker_config['time_limit'] = await run_in_threadpool(model.get_time_limit, kind,
+                                                                  worker_config['time_limit'])
+        except Exception as e:
+            logger.warning(f"Adaptive time limit not available for job '{uuid}': {e}")
+
+    # The result cache is opt-in (config or process decorator), for the deterministic processes only
+    use_result_cache = bool(worker_config.pop('result_cache', False))
+
     # create the task's program context
     pc = pixyz_worker.extcode.ProgramContext(**worker_config)
 
+    canvas = None
+    if job_graph is not None:
+        # The options of a stage come from the decorator of its entrypoint, then from the job config
+        job_config = {'queue': user_config.get('queue'), 'priority': user_config.get('priority'),
+                      'time_limit': worker_config['time_limit']}
+        try:
+            job_graph.set_defaults(job_config, {entrypoint: si.get_pixyz_decorator_kwargs_for_a_function(entrypoint)
+                                                for entrypoint in entrypoints})
+            canvas = await run_in_threadpool(job_graph.compile, pc, params)
+        except ValueError as e:
+            raise_api_error(ApiError400, f"Invalid 'stages': {e}")
+        worker_config['queue'] = job_graph.get_queues()[0]
+
     task = None
+    job_index = pixyz_worker.jobindex.JobIndex(pixyz_worker.tasks.app.backend.client)
+
+    if use_result_cache and job_graph is None and pixyz_worker.resultcache.ResultCache.is_enabled():
+        result_cache = pixyz_worker.resultcache.ResultCache(pixyz_worker.tasks.app.backend.client)
+        try:
+            result_cache_key = await run_in_threadpool(result_cache.compute_key, input_sha256, process_file_path,
+                                                       params, worker_config['entrypoint'],
+                                                       worker_config['root_file'], worker_config['compute_only'])
+            if await run_in_threadpool(reuse_cached_task_result, result_cache, result_cache_key, uuid, name):
+                logger.info(f"Job '{uuid}' completed with the cached result {result_cache_key}")
+                await run_in_threadpool(job_index.add, uuid, process, worker_config['queue'], 'SUCCESS')
+                return JobState(uuid, name, status='SUCCESS', progress=100)
+            await run_in_threadpool(result_cache.register, uuid, result_cache_key)
+        except Exception as e:
+            logger.warning(f"Result cache not available for job '{uuid}': {e}")
+
+    # Don't queue more jobs than the workers can absorb
+    for queue in job_graph.get_queues() if job_graph is not None else [worker_config['queue']]:
+        retry_after = await run_in_threadpool(QueueAdmission.get_instance().check, queue)
+        if retry_after is not None:
+            await run_in_threadpool(shutil.rmtree, pixyz_worker.share.get_job_share_dir(uuid), True)
+            raise_api_error(ApiError429, f"The queue '{queue}' is full, retry in {retry_after} seconds",
+                            headers={'Retry-After': str(retry_after)})
 
     try:
-        task = pixyz_worker.tasks.pixyz_execute.apply_async(args=(params, pc), **worker_config)
+        # Index the job before sending it, otherwise a worker can start it before it is indexed
+        await run_in_threadpool(job_index.add, uuid, process, worker_config['queue'])
+        if job_graph is not None:
+            # The workers aggregate the stages in the meta of the job from the stored graph
+            await run_in_threadpool(job_graph.save, pixyz_worker.tasks.app.backend.client)
+            await run_in_threadpool(canvas.apply_async)
+        else:
+            task = await run_in_threadpool(pixyz_worker.tasks.pixyz_execute.apply_async, args=(params, pc),
+                                           **worker_config)
     except OperationalError as e:
         # This error is raised when the worker is not running or the queue is not available
+        remove_job_from_index(job_index, uuid)
         raise HTTPException(status_code=503, detail=f"Service not available: Backend is not ready, please check your redis: {e}")
     except Exception as e:
         # TODO: handle PixyzTimeout ??
+        remove_job_from_index(job_index, uuid)
         raise_api_error(ApiError500, e)
-    finally:
-        if file is not None and isinstance(file, UploadFile):
-            file.file.close()
-        if script is not None and isinstance(script, UploadFile):
-            script.file.close()
 
     return JobState(uuid, name, status='SENT')
 
@@ -198,6 +370,76 @@ async def get_job_details(job_uuid: uuid_path_pattern, api_key: APIKey = Depends
         raise_api_error(ApiError500, e)
 
 
+# Streams the job changes (server-sent events)
+@router.get("/{job_uuid}/events", **get_api_event_stream_response_desc())
+async def get_job_events(job_uuid: uuid_path_pattern, api_key: APIKey = Depends(verify_token),
+                         keepalive: float = Query(15.0, ge=1.0, le=60.0)):
+    """
+    Follow a job with server-sent events instead of polling the details
+    Each change is sent as a `status` event with the job details (same content as /details), a keepalive comment is
+    sent every `keepalive` seconds without change. The stream ends after the final state (SUCCESS, FAILURE, REVOKED).
+    :param job_uuid: the job ID
+    :param keepalive: the maximum delay in seconds between two messages
+    :return: a text/event-stream response
+    """
+    events = follow_task_events(job_uuid, keepalive)
+    try:
+        # Read the current details before sending the headers to be able to report an error
+        details = await anext(events)
+    except Exception as e:
+        await events.aclose()
+        raise_api_error(ApiError500, e)
+
+    async def event_stream(details):
+        try:
+            while True:
+                if details is None:
+                    yield ": keepalive\n\n"
+                else:
+                    yield f"event: status\ndata: {json.dumps(jsonable_encoder(details))}\n\n"
+                details = await anext(events)
+        except StopAsyncIteration:
+            pass
+        except Exception as e:
+            logger.error(f"Error while streaming job '{job_uuid}' events: '{e}'")
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+        finally:
+            await events.aclose()
+
+    return StreamingResponse(event_stream(details), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# Streams the job changes (websocket)
+@router.websocket("/{job_uuid}/events/ws")
+async def get_job_events_websocket(websocket: WebSocket, job_uuid: uuid_path_pattern, keepalive: float = 15.0):
+    """
+    Follow a job with a websocket, the messages are the same as /events in JSON:
+    {"event": "status", "data": <job details>} or {"event": "keepalive"}
+    The server closes the connection after the final state.
+    :param job_uuid: the job ID
+    :param keepalive: the maximum delay in seconds between two messages
+    """
+    if not verify_websocket_token(websocket):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid token")
+        return
+    await websocket.accept()
+    events = follow_task_events(job_uuid, min(max(keepalive, 1.0), 60.0))
+    try:
+        async for details in events:
+            if details is None:
+                await websocket.send_json({'event': 'keepalive'})
+            else:
+                await websocket.send_json({'event': 'status', 'data': jsonable_encoder(details)})
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.error(f"Error while streaming job '{job_uuid}' events: '{e}'")
+        await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
+    finally:
+        await events.aclose()
+
+
 # Gets list of all available outputs (files in the {job_uuid}/output)
 @router.get("/{job_uuid}/outputs", **get_api_response_desc_from_model(JobOutputsList))
 async def get_outputs(job_uuid: uuid_path_pattern, api_key: APIKey = Depends(verify_token)):
@@ -216,19 +458,25 @@ async def get_outputs(job_uuid: uuid_path_pattern, api_key: APIKey = Depends(ver
 
 # Outputs an archive of all outputs
 @router.get("/{job_uuid}/outputs/archive", **get_api_file_response_desc())
-async def get_all_outputs_as_archive(job_uuid: uuid_path_pattern, api_key: APIKey = Depends(verify_token),
-                                     response: Response = None):
+async def get_all_outputs_as_archive(request: Request, job_uuid: uuid_path_pattern,
+                                     api_key: APIKey = Depends(verify_token), response: Response = None,
+                                     stream: bool = Query(True)):
 
     """
-    Get the list of all available outputs for a given job ID
+    Get an archive (zip) of all the outputs of a given job ID
+    An already packaged archive is sent as a file. Otherwise, a package task is started and the zip is generated on the
+    fly from the output directory (stream=true) or 425 is returned until the archive is ready (stream=false).
+    The packaged archive supports the range and conditional requests (Range, If-Range, If-None-Match).
+    :param request: the request
     :param job_uuid: the job ID
     :param api_key: the API key
     :param response: the response object
-    :return: a list of strings with the name of the outputs
+    :param stream: generate the archive while sending it instead of packaging it
+    :return: the archive
     """
 
     try:
-        archive_path = grab_task_outputs_archive(job_uuid)
+        archive = await run_in_threadpool(grab_task_outputs_archive, job_uuid, stream=stream)
     except (TaskProcessingStarted, TaskNotCompletedError) as e:
         raise_api_error(ApiError425, e)
     except (SharePathInvalidError, SharePathNotFoundError) as e:
@@ -236,8 +484,13 @@ async def get_all_outputs_as_archive(job_uuid: uuid_path_pattern, api_key: APIKe
     except Exception as e:
         raise_api_error(ApiError500, e)
 
+    if not isinstance(archive, str):
+        # The archive is generated by the thread pool while it is sent
+        return StreamingResponse(archive, media_type='application/zip',
+                                 headers={'Content-Disposition': f'attachment; filename="{job_uuid}.zip"'})
+
     try:
-        return FileResponse(archive_path, media_type='application/octet-stream', filename=os.path.basename(archive_path))
+        return await run_in_threadpool(get_file_response, request, archive)
     except Exception as e:
         logger.error(f"Error while sending job '{job_uuid}' output archive: '{e}'")
         raise_api_error(ApiError500, f"Failed to retrieve archive")
@@ -245,10 +498,13 @@ async def get_all_outputs_as_archive(job_uuid: uuid_path_pattern, api_key: APIKe
 
 # Gets list of all available outputs (files in the {job_uuid}/outputs)
 @router.get("/{job_uuid}/outputs/{file_path:path}", **get_api_file_response_desc())
-async def get_output_file(job_uuid: uuid_path_pattern, file_path: str, api_key: APIKey = Depends(verify_token)):
+async def get_output_file(request: Request, job_uuid: uuid_path_pattern, file_path: str,
+                          api_key: APIKey = Depends(verify_token)):
 
     """
-    Get the list of all available outputs for a given job ID
+    Get an output file of a given job ID
+    The range and conditional requests (Range, If-Range, If-None-Match) allow to resume or split the download.
+    :param request: the request
     :param job_uuid: the job ID
     :param file_path: the file path
     :param api_key: the API key
@@ -265,7 +521,7 @@ async def get_output_file(job_uuid: uuid_path_pattern, file_path: str, api_key:
         raise_api_error(ApiError500, e)
 
     try:
-        return FileResponse(file_fullpath, media_type='application/octet-stream', filename=os.path.basename(file_fullpath))
+        return await run_in_threadpool(get_file_response, request, file_fullpath)
     except Exception as e:
         logger.error(f"Error while sending job '{job_uuid}' output file: '{e}'")
         raise_api_error(ApiError500, f"Failed to retrieve file '{file_path}'")
@@ -125,6 +125,13 @@ class ApiError404(ApiError):
     code: int = 404
     message: str = "Not Found"
 
+class ApiError409(ApiError):
+    """
+    The request conflicts with a concurrent change of the resource, retry the request
+    """
+    code: int = 409
+    message: str = "Conflict"
+
 class ApiError425(ApiError):
     """
     Process is ongoing and not completed
@@ -132,6 +139,13 @@ class ApiError425(ApiError):
     code: int = 425
     message: str = "Too early"
 
+class ApiError429(ApiError):
+    """
+    Too many jobs are waiting in the queue, retry after the Retry-After delay
+    """
+    code: int = 429
+    message: str = "Too Many Requests"
+
 class ApiError500(ApiError):
     """
     An error occured server side and the request could not be completed
@@ -278,8 +292,18 @@ class TaskMeta(ApiModel):
 class JobList(ApiModel):
     """
     List of all registered jobs status
+        - jobs: the jobs status of the page
+        - cursor: the cursor to get the next page, 0 when the listing is complete
     """
     jobs: List[JobState|None] = []
+    cursor: int = 0
+
+
+class JobStatusRequest(ApiModel):
+    """
+    A list of job IDs to get the status of
+    """
+    jobs: List[str] = []
 
 ########################################################################################
 ##                               PROCESSES MODELS                                     ##
@@ -318,6 +342,46 @@ class JobOutputsList(ApiModel):
         
 
 
+########################################################################################
+##                                  UPLOAD MODELS                                     ##
+########################################################################################
+
+class UploadRequest(ApiModel):
+    """
+    Creation of a chunked upload session:
+        - size: the file size in bytes
+        - chunk_size: the size of the chunks in bytes, the last one can be smaller (optional)
+    """
+    size: int
+    chunk_size: int | None = None
+
+
+class UploadCommitRequest(ApiModel):
+    """
+    Completion of a chunked upload session:
+        - sha256: the hex sha256 of the whole file, checked before the file is stored
+    """
+    sha256: str
+
+
+class UploadSession(ApiModel):
+    """
+    Chunked upload session of a large input file:
+        - id: the unique identifier of the session
+        - size: the file size in bytes
+        - chunk_size: the size of the chunks, the last one can be smaller
+        - chunks: the number of chunks
+        - received: the indexes of the completely received chunks
+        - sha256: the sha256 of the file once committed, a job references it with `file_sha256`
+    """
+    id: str
+    size: int
+    chunk_size: int
+    chunks: int
+    received: List[int] = []
+    sha256: str | None = None
+
+
 ########################################################################################
 ##                                    EXPORTS                                         ##
 ########################################################################################
@@ -15,8 +15,7 @@ def export_model_metadata(filepath, output_dir, progress):
     logger.info("starting metadata generation")
     output = {}   
 
-    # Import the file
-    pxz.core.resetSession()
+    # Import the file (the scheduler starts each task with a clean scene)
     progress.next(f"Importing file '{os.path.basename(filepath)}'", output)
     pxz.io.importFiles([filepath])
 
@@ -56,8 +56,7 @@ def generate_thumbnail_icon_all_in_one(filepath, output_dir, progress, params={'
     # get the start time
     start_time = datetime.now()
 
-    # Import the files in a scene
-    pxz.core.resetSession()
+    # Import the files in a scene (the scheduler starts each task with a clean scene)
     progress.next('Importing file')
     pxz.io.importFiles([filepath])
 
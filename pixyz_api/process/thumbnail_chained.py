@@ -26,7 +26,7 @@ def screenshot(pc: ProgramContext, params: dict):
     start = datetime.now()
     output_dir = params['output_dir']
     pc.progress_next("[screenshot] loading pxz file")
-    pxz.io.importFiles([params['pxz']])
+    pxz.io.importFiles([pc.get_artifact(params['pxz'])])
 
     def take_screenshot(viewer, camera, angle, name):
         target_file = os.path.join(output_dir, f"{name}.png")
@@ -102,8 +102,7 @@ def load_file_and_metadata(pc: ProgramContext, params: dict):
     # get the start time
     start_time = datetime.now()
 
-    # Import the files in a scene
-    pxz.core.resetSession()
+    # Import the files in a scene (the scheduler starts each task with a clean scene)
     progress.next(f"Importing file {pc['queue']}")
     pxz.io.importFiles([filepath])
 
@@ -223,11 +222,11 @@ def load_file_and_metadata(pc: ProgramContext, params: dict):
 
     progress.stop()
 
-    # Export to pxz
-    pxz_file = os.path.join(output_dir, 'export.pxz')
+    # Export to pxz, handed to the screenshot task from the local disk of the worker when possible
+    pxz_file = os.path.join(pc.get_input_dir(), 'export.pxz')
     pxz.io.exportScene(pxz_file)
     # Prepare for screenshot
-    output['pxz'] = pxz_file
+    output['pxz'] = pc.put_artifact('export.pxz', pxz_file)
     return output
 
 
@@ -12,10 +12,12 @@ from prometheus_fastapi_instrumentator import Instrumentator
 import pixyz_worker.share
 from pixyz_worker.tasks import app
 from . import *
-from pixyz_api.admin.endpoints import router as admin_router
+from pixyz_api.admin.endpoints import router as admin_router, durations_router as admin_durations_router
 from pixyz_api.jobs.endpoints import router as jobs_router
 from pixyz_api.processes.endpoints import router as processes_router
 from pixyz_api.backend.endpoints import router as backend_router
+from pixyz_api.blobs.endpoints import router as blobs_router
+from pixyz_api.uploads.endpoints import router as uploads_router
 
 __all__ = ['api_app']
 
@@ -37,6 +39,7 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
 
 ## Admin endpoints
 # api_app.include_router(admin_router, prefix="/admin", tags=["admin"])
+api_app.include_router(admin_durations_router, prefix="/admin", tags=["admin"])
 
 @api_app.get("/")
 async def root():
@@ -47,6 +50,8 @@ async def root():
 api_app.include_router(processes_router, prefix="/processes", tags=["processes"])
 api_app.include_router(jobs_router, prefix="/jobs", tags=["jobs"])
 api_app.include_router(backend_router, prefix="/backend", tags=["backend"])
+api_app.include_router(blobs_router, prefix="/blobs", tags=["blobs"])
+api_app.include_router(uploads_router, prefix="/uploads", tags=["uploads"])
 
 @api_app.post("/dev/callback", status_code=status.HTTP_200_OK, tags=["dev"])
 async def callback_info(infos: dict):
@@ -64,6 +69,8 @@ async def callback_info(infos: dict):
     print("CALLBACK POST:" + json.dumps(infos, indent=2))
 
 Instrumentator().instrument(api_app).expose(api_app, include_in_schema=True, should_gzip=True)
+# Export the queue depths from the start
+QueueAdmission.get_instance()
 
 if __name__ == "__main__":
     import uvicorn
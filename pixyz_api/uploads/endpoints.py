@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from . import *
+from pixyz_api.patterns import uuid_path_pattern
+from pixyz_api.auth import verify_token
+from pixyz_api.utils import api_error_responses
+from fastapi.security.api_key import APIKey
+from fastapi import Depends, Request
+from fastapi.concurrency import run_in_threadpool
+from starlette.requests import ClientDisconnect
+from pixyz_worker.exception import SharePathInvalidError, SharePathNotFoundError
+
+logger = get_api_logger('uploads')
+router = APIRouter()
+
+# Size of the writes of a received chunk to the share
+write_size = 1024 * 1024
+
+
+# Creates a new upload session
+@router.post("", **get_api_response_desc_from_model(UploadSession))
+async def create_upload(upload: UploadRequest, api_key: APIKey = Depends(verify_token)):
+    """
+    Create a chunked upload session for a large input file
+    The chunks are sent with PUT /uploads/{upload_id}/chunks/{index}, in any order and in parallel, then the upload
+    is committed with the file sha256. The committed file is referenced in a job with `file_sha256`.
+    :param upload: the file size and the chunk size
+    :return: the upload session
+    """
+    try:
+        session = await run_in_threadpool(pixyz_worker.share.create_upload, upload.size,
+                                          upload.chunk_size or pixyz_worker.share.upload_default_chunk_size)
+    except SharePathInvalidError as e:
+        raise_api_error(ApiError400, e)
+    except Exception as e:
+        raise_api_error(ApiError500, e)
+    return UploadSession(**session)
+
+
+# Gets the state of an upload session (to resume it)
+@router.get("/{upload_id}", **get_api_response_desc_from_model(UploadSession))
+async def get_upload(upload_id: uuid_path_pattern, api_key: APIKey = Depends(verify_token)):
+    """
+    Get an upload session, with the indexes of the chunks already received
+    :param upload_id: the upload session ID
+    :return: the upload session
+    """
+    try:
+        session = await run_in_threadpool(pixyz_worker.share.get_upload, upload_id)
+    except SharePathNotFoundError as e:
+        raise_api_error(ApiError404, e)
+    except Exception as e:
+        raise_api_error(ApiError500, e)
+    return UploadSession(**session)
+
+
+# Receives a chunk of an upload session
+@router.put("/{upload_id}/chunks/{index}", status_code=status.HTTP_204_NO_CONTENT,
+            responses={**api_error_responses},
+            openapi_extra={'requestBody': {'required': True,
+                                           'content': {'application/octet-stream': {'schema': {'type': 'string',
+                                                                                              'format': 'binary'}}}}})
+async def put_upload_chunk(request: Request, upload_id: uuid_path_pattern, index: int,
+                           api_key: APIKey = Depends(verify_token)):
+    """
+    Write a chunk of an upload session, the body is the raw chunk content
+    A chunk can be sent again (ex: after a network error), it replaces the previous content.
+    :param upload_id: the upload session ID
+    :param index: the chunk index, from 0
+    :return: 204
+    """
+    try:
+        session = await run_in_threadpool(pixyz_worker.share.get_upload, upload_id)
+        offset, size = pixyz_worker.share.get_upload_chunk_range(session, index)
+    except SharePathInvalidError as e:
+        raise_api_error(ApiError400, e)
+    except SharePathNotFoundError as e:
+        raise_api_error(ApiError404, e)
+    if session['sha256'] is not None:
+        raise_api_error(ApiError400, f"Upload '{upload_id}' is already committed")
+
+    fd = os.open(pixyz_worker.share.get_upload_data_path(upload_id), os.O_WRONLY)
+    try:
+        received = 0
+        buffer = bytearray()
+        async for data in request.stream():
+            if received + len(buffer) + len(data) > size:
+                raise_api_error(ApiError400, f"Chunk {index} is larger than {size} bytes")
+            buffer += data
+            if len(buffer) >= write_size:
+                await run_in_threadpool(os.pwrite, fd, bytes(buffer), offset + received)
+                received += len(buffer)
+                buffer = bytearray()
+        if buffer:
+            await run_in_threadpool(os.pwrite, fd, bytes(buffer), offset + received)
+            received += len(buffer)
+    except ClientDisconnect:
+        logger.warning(f"Client disconnected during the upload of chunk {index} of '{upload_id}'")
+        raise_api_error(ApiError400, "Client disconnected during the upload")
+    finally:
+        os.close(fd)
+
+    if received != size:
+        raise_api_error(ApiError400, f"Chunk {index} has {received} bytes instead of {size}")
+    await run_in_threadpool(pixyz_worker.share.set_upload_chunk_received, upload_id, index)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+# Completes an upload session
+@router.post("/{upload_id}/commit", **get_api_response_desc_from_model(UploadSession))
+async def commit_upload(upload_id: uuid_path_pattern, commit: UploadCommitRequest,
+                        api_key: APIKey = Depends(verify_token)):
+    """
+    Check that all the chunks are received and that the file matches the sha256, then store it
+    The file is stored once in the blob store: a job uses it with the `file_sha256` and `file_name` form fields.
+    :param upload_id: the upload session ID
+    :param commit: the file sha256
+    :return: the upload session with its sha256
+    """
+    try:
+        session = await run_in_threadpool(pixyz_worker.share.commit_upload, upload_id, commit.sha256)
+    except SharePathInvalidError as e:
+        raise_api_error(ApiError400, e)
+    except SharePathNotFoundError as e:
+        raise_api_error(ApiError404, e)
+    except Exception as e:
+        raise_api_error(ApiError500, e)
+    return UploadSession(**session)
+
+
+# Aborts an upload session
+@router.delete("/{upload_id}", status_code=status.HTTP_204_NO_CONTENT, responses={**api_error_responses})
+async def delete_upload(upload_id: uuid_path_pattern, api_key: APIKey = Depends(verify_token)):
+    """
+    Abort an upload session and remove the received chunks
+    :param upload_id: the upload session ID
+    :return: 204
+    """
+    try:
+        await run_in_threadpool(pixyz_worker.share.delete_upload, upload_id)
+    except SharePathNotFoundError as e:
+        raise_api_error(ApiError404, e)
+    except Exception as e:
+        raise_api_error(ApiError500, e)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
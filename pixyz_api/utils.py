@@ -5,6 +5,9 @@ import logging
 import datetime
 import traceback
 import time
+import json
+import hashlib
+import threading
 from logging import Formatter
 from logging import getLogger
 from typing import Callable
@@ -12,23 +15,35 @@ from celery.utils import gen_unique_id
 from celery.result import AsyncResult
 # Keep this import otherwise we can't unserialise exception from result in job
 from billiard.pool import *
-from fastapi import Response, status, UploadFile, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import Request, Response, status, UploadFile, HTTPException
+from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from prometheus_client import Counter, Gauge, Histogram
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:
+    # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
 
 from pixyz_api.models import *
 from pixyz_api.patterns import uuid_path_pattern
 
 from pixyz_worker.exception import PixyzException, PixyzTimeout, PixyzExitFault, TaskNotCompletedError, TaskProcessingStarted, SharePathNotFoundError
 from pixyz_worker.share import is_job_in_share
+from pixyz_worker.events import JobEvents
+from pixyz_worker.priority import get_priority_queue_names
 import pixyz_worker
 
 
 __all__ = ['get_api_logger', 'serialize_binary_data_state_dict', 'default_status_manager', 'get_utc_time',
-           'upload_file_to_shared_storage', 'upload_file_to_job_input_shared_storage', 'create_job_id',
-           'grab_task_status', 'grab_task_details', 'grab_tasks_list', 'grab_task_outputs_list',
+           'upload_file_to_shared_storage', 'upload_file_to_job_input_shared_storage', 'JobFormStreamParser',
+           'create_job_id',
+           'grab_task_status', 'grab_tasks_status', 'grab_task_details', 'grab_tasks_list', 'grab_indexed_tasks_list',
+           'remove_job_from_index', 'reuse_cached_task_result', 'follow_task_events', 'grab_task_outputs_list',
            'grab_task_outputs_archive', 'grab_task_output_file', 'get_scripts_list_in_processes_dir',
-           'get_script_path_in_processes_dir', 'raise_api_error', 'get_api_response_desc_from_model',
-           'get_api_file_response_desc'
+           'get_script_path_in_processes_dir', 'get_job_queue_from_form', 'raise_api_error',
+           'get_api_response_desc_from_model', 'get_api_file_response_desc', 'get_api_event_stream_response_desc', 'get_file_etag', 'get_file_response',
+           'QueueAdmission'
            ]
 
 ## LOGGER ##
@@ -61,6 +76,8 @@ def get_api_logger(logger_name='pixyz_api'):
 
 logger = get_api_logger('api.utils')
 debug_mode = True
+job_final_states = ('SUCCESS', 'FAILURE', 'REVOKED')
+events_client = None
 
 ## BINARY UTILS ##
 
@@ -158,6 +175,190 @@ def upload_file_to_job_input_shared_storage(job_id: str, file: UploadFile):
     logger.info(f"File {filename} uploaded to {shared_file_path}")
     return shared_file_path
 
+# Upload metrics, exposed on /metrics by the instrumentator with the default registry
+upload_bytes_counter = Counter('pixyz_api_upload_bytes', 'Bytes uploaded to the shared storage', ['field'])
+upload_duration_histogram = Histogram('pixyz_api_upload_duration_seconds', 'Duration of the uploads to the shared storage',
+                                      ['field'], buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600))
+upload_throughput_histogram = Histogram('pixyz_api_upload_throughput_bytes_per_second',
+                                        'Throughput of the uploads to the shared storage', ['field'],
+                                        buckets=tuple(2 ** i * 1024 * 1024 for i in range(-3, 11)))
+
+
+class JobFormStreamParser(object):
+    """
+    Parse a multipart/form-data job request directly from the request body stream
+
+    Unlike the FastAPI forms, the files are not spooled to a temporary file: each received chunk is hashed and written
+    to the blob store of the shared storage by the thread pool, so the event loop is never blocked by the disk. The
+    complete blob is then hard linked in the job input directory (see `pixyz_worker.share.link_blob_to_job_input`).
+    The `before_files` coroutine is called with the text fields received before the first file, it can reject the
+    request (HTTPException) before any file is uploaded.
+    """
+    max_field_size = 1024 * 1024
+
+    def __init__(self, job_id: str, file_fields=('file', 'script'), before_files: Callable = None):
+        self.job_id = job_id
+        self.file_fields = file_fields
+        self.before_files = before_files
+        self.fields = {}
+        self.files = {}
+        self.hashes = {}
+        self.events = []
+        self.header_field = b''
+        self.header_value = b''
+        self.headers = {}
+        self.part = None
+
+    # Parser callbacks, the data buffers are reused by the parser and must be copied
+    def on_part_begin(self):
+        self.headers = {}
+
+    def on_header_field(self, data, start, end):
+        self.header_field += data[start:end]
+
+    def on_header_value(self, data, start, end):
+        self.header_value += data[start:end]
+
+    def on_header_end(self):
+        self.headers[self.header_field.lower()] = self.header_value
+        self.header_field = b''
+        self.header_value = b''
+
+    def on_headers_finished(self):
+        self.events.append(('begin', self.headers))
+
+    def on_part_data(self, data, start, end):
+        self.events.append(('data', bytes(data[start:end])))
+
+    def on_part_end(self):
+        self.events.append(('end', None))
+
+    async def parse(self, request):
+        """
+        Read the whole request body
+        :return: the text fields and the paths of the uploaded files in the shared storage (by field name)
+        :raises ValueError: if the request is not a valid multipart/form-data request
+        """
+        content_type, params = parse_options_header(request.headers.get('content-type', ''))
+        if content_type == b'application/x-www-form-urlencoded':
+            # No file in this form
+            form = await request.form()
+            return {key: value for key, value in form.items() if isinstance(value, str)}, {}
+        if content_type != b'multipart/form-data' or b'boundary' not in params:
+            raise ValueError("A multipart/form-data request is expected")
+        parser = MultipartParser(params[b'boundary'], {
+            'on_part_begin': self.on_part_begin,
+            'on_part_data': self.on_part_data,
+            'on_part_end': self.on_part_end,
+            'on_header_field': self.on_header_field,
+            'on_header_value': self.on_header_value,
+            'on_header_end': self.on_header_end,
+            'on_headers_finished': self.on_headers_finished,
+        })
+        try:
+            async for chunk in request.stream():
+                parser.write(chunk)
+                await self.process_events()
+            parser.finalize()
+            await self.process_events()
+        finally:
+            if self.part is not None and self.part['file'] is not None:
+                await run_in_threadpool(self.discard, self.part)
+        return self.fields, self.files
+
+    async def process_events(self):
+        events, self.events = self.events, []
+        data = []
+        for event, value in events:
+            if event == 'data':
+                data.append(value)
+                continue
+            if data:
+                await self.write(b''.join(data))
+                data = []
+            if event == 'begin':
+                await self.begin(value)
+            else:
+                await self.end()
+        if data:
+            await self.write(b''.join(data))
+
+    async def begin(self, headers):
+        _, options = parse_options_header(headers.get(b'content-disposition', b''))
+        if b'name' not in options:
+            raise ValueError("A form part has no name")
+        name = options[b'name'].decode('utf-8')
+        filename = options.get(b'filename', b'').decode('utf-8')
+        self.part = {'name': name, 'file': None, 'data': bytearray(), 'size': 0, 'start': time.monotonic()}
+        if name in self.file_fields and filename:
+            if self.before_files is not None:
+                before_files, self.before_files = self.before_files, None
+                await before_files(self.fields)
+            logger.info(f"Uploading file {filename} to the blob store")
+            self.part['filename'] = filename
+            self.part['tmp_path'] = await run_in_threadpool(pixyz_worker.share.get_blob_tmp_path)
+            self.part['file'] = await run_in_threadpool(open, self.part['tmp_path'], 'wb')
+            self.part['sha256'] = hashlib.sha256()
+
+    async def write(self, data):
+        part = self.part
+        part['size'] += len(data)
+        if part['file'] is not None:
+            await run_in_threadpool(self.write_file, part, data)
+        elif part['size'] > self.max_field_size:
+            raise ValueError(f"The form field '{part['name']}' is too large")
+        else:
+            part['data'] += data
+
+    @staticmethod
+    def write_file(part, data):
+        part['sha256'].update(data)
+        part['file'].write(data)
+
+    @staticmethod
+    def discard(part):
+        part['file'].close()
+        if os.path.exists(part['tmp_path']):
+            os.remove(part['tmp_path'])
+
+    @staticmethod
+    def store(part, sha256, job_id):
+        """
+        Move an uploaded file to the blob store and link it in the job inputs
+        An existing blob can be released by the cleanup of another job before it is linked: the upload is then stored
+        as the blob.
+        :return: the path of the job input file
+        :raises: SharePathNotFoundError if the blob is released again before it is linked
+        """
+        try:
+            if os.path.isfile(pixyz_worker.share.get_blob_path(sha256)):
+                try:
+                    return pixyz_worker.share.link_blob_to_job_input(sha256, job_id, part['filename'])
+                except SharePathNotFoundError:
+                    logger.info(f"Blob {sha256} released during the upload, storing it again")
+            pixyz_worker.share.store_blob(part['tmp_path'], sha256)
+            return pixyz_worker.share.link_blob_to_job_input(sha256, job_id, part['filename'])
+        finally:
+            if os.path.exists(part['tmp_path']):
+                os.remove(part['tmp_path'])
+
+    async def end(self):
+        part, self.part = self.part, None
+        if part['file'] is None:
+            self.fields[part['name']] = part['data'].decode('utf-8')
+            return
+        await run_in_threadpool(part['file'].close)
+        sha256 = part['sha256'].hexdigest()
+        self.files[part['name']] = await run_in_threadpool(self.store, part, sha256, self.job_id)
+        self.hashes[part['name']] = sha256
+        duration = time.monotonic() - part['start']
+        upload_bytes_counter.labels(part['name']).inc(part['size'])
+        upload_duration_histogram.labels(part['name']).observe(duration)
+        if duration > 0:
+            upload_throughput_histogram.labels(part['name']).observe(part['size'] / duration)
+        logger.info(f"File {os.path.basename(self.files[part['name']])} uploaded ({part['size']} bytes in "
+                    f"{duration:.1f}s, sha256 {sha256})")
+
 ########################################################################################
 ##                                   TASKS UTILS                                      ##
 ########################################################################################
@@ -199,35 +400,71 @@ def get_error_from_task_meta(task_meta: dict):
 
     return None
 
+def get_job_state_from_task_meta(job_id: str, task_meta: dict):
+    """
+    Build the short status of a job from its celery task metadata
+    """
+    job_status = JobState(job_id)
+    job_status.name = task_meta.get('name', None)
+    job_status.status = str(task_meta.get('status', 'PENDING'))
+    job_status.error = get_error_from_task_meta(task_meta)
+
+    if 'result' in task_meta and isinstance(task_meta['result'], dict):
+        job_status.update_from_task_result(task_meta['result'])
+
+    return job_status
+
+
 def grab_task_status(job_id: uuid_path_pattern):
     """
     Get the status of a given job ID
     """
 
-    job_status = JobState(job_id)
-
-    task = None
     try:
-        task = AsyncResult(job_id, app=pixyz_worker.tasks.app)
-        
-        job_status.name = task.name
-        job_status.status = str(task.state)
+        # Retrieve tasks metadata (status included) in a single read
+        task_meta = pixyz_worker.tasks.app.backend.get_task_meta(job_id)
     except Exception as e:
         if debug_mode:
             logger.error(e)
+        job_status = JobState(job_id)
         job_status.status = 'UNKNOWN'
         job_status.error = 'Unable to get job status'
         return job_status
-        
-    # Retrieve tasks metadata
-    task_meta = task.backend.get_task_meta(job_id)
 
-    job_status.error = get_error_from_task_meta(task_meta)
+    return get_job_state_from_task_meta(job_id, task_meta)
 
-    if 'result' in task_meta and isinstance(task_meta['result'], dict):
-        job_status.update_from_task_result(task_meta['result'])
 
-    return job_status
+def get_jobs_state_from_backend_values(job_ids: list, values: list, skip_missing=False):
+    """
+    Decode the raw task metadata returned by a redis MGET
+    :param job_ids: the job IDs, in the same order as the values
+    :param values: the raw values (None if the task meta does not exist)
+    :param skip_missing: if True, ignore the missing task meta otherwise the job is PENDING
+    """
+    backend = pixyz_worker.tasks.app.backend
+    jobs = []
+    for job_id, value in zip(job_ids, values):
+        if value is None:
+            if not skip_missing:
+                jobs.append(JobState(job_id, status='PENDING'))
+            continue
+        try:
+            jobs.append(get_job_state_from_task_meta(job_id, backend.decode_result(value)))
+        except Exception as e:
+            logger.error(f"Unable to decode job '{job_id}' metadata: {e}")
+            jobs.append(JobState(job_id, status='UNKNOWN', error='Unable to get job status'))
+    return jobs
+
+
+def grab_tasks_status(job_ids: list):
+    """
+    Get the status of several jobs with a single backend read (MGET)
+    """
+    if not job_ids:
+        return []
+    backend = pixyz_worker.tasks.app.backend
+    values = backend.mget([backend.get_key_for_task(job_id) for job_id in job_ids])
+    return get_jobs_state_from_backend_values(job_ids, values)
 
 
 def grab_task_details(job_id: uuid_path_pattern):
@@ -297,22 +534,124 @@ def grab_task_details(job_id: uuid_path_pattern):
 
 
 
-def grab_tasks_list():
+def grab_tasks_list(limit: int = 100, cursor: int = 0):
     """
-    Get a list of all task IDs in the result backend (Redis)
+    Get a page of the jobs status stored in the result backend (Redis)
+    The keys are iterated with SCAN (never KEYS) and each batch of task metadata is read with a single MGET.
+    Like the SCAN count, `limit` is a hint: the last batch is never split, so a page can be a bit larger.
+    :param limit: the expected number of jobs in the page
+    :param cursor: the cursor returned by the previous page (0 for the first page)
+    :return: the jobs status and the cursor of the next page (0 if the listing is complete)
     """
+    backend = pixyz_worker.tasks.app.backend
+    prefix = backend.task_keyprefix
     jobs_list = []
-    cel_tasks = []
 
-    cel_tasks = pixyz_worker.tasks.app.backend.client.keys('celery-task-meta-*')
-    
-    for task_id in cel_tasks:
-        task_id = task_id.decode('utf-8').replace('celery-task-meta-', '')
+    while True:
+        cursor, keys = backend.client.scan(cursor=cursor, match=prefix + b'*', count=limit)
+        if keys:
+            job_ids = [key[len(prefix):].decode('utf-8') for key in keys]
+            # A task meta can expire between SCAN and MGET
+            jobs_list += get_jobs_state_from_backend_values(job_ids, backend.mget(keys), skip_missing=True)
+        if cursor == 0 or len(jobs_list) >= limit:
+            break
+
+    return jobs_list, cursor
+
+
+def grab_indexed_tasks_list(limit: int = 100, cursor: int = 0, status: list = None, process: str = None,
+                            queue: str = None):
+    """
+    Get a page of the jobs status matching the filters with range queries on the job index
+    The status comes from the backend (not from the index) to stay accurate if a worker has been lost.
+    :param limit: the maximum number of jobs in the page
+    :param cursor: the cursor returned by the previous page (0 for the first page)
+    :param status: keep only the jobs in these states
+    :param process: keep only the jobs of this process
+    :param queue: keep only the jobs sent to this queue
+    :return: the jobs status and the cursor of the next page (0 if the listing is complete)
+    """
+    job_index = pixyz_worker.jobindex.JobIndex(pixyz_worker.tasks.app.backend.client)
+    job_ids, cursor = job_index.search(status, process, queue, offset=cursor, limit=limit)
+    return grab_tasks_status(job_ids), cursor
+
+
+def remove_job_from_index(job_index, job_id: str):
+    """
+    Remove a job that could not be sent from the job index, without hiding the original error
+    """
+    try:
+        job_index.remove(job_id)
+    except Exception as e:
+        logger.error(f"Unable to remove job '{job_id}' from the index: {e}")
 
-        job_status = grab_task_status(task_id)
-        jobs_list.append(job_status)
 
-    return jobs_list
+def reuse_cached_task_result(result_cache, key: str, job_id: str, name: str = None):
+    """
+    Complete a new job with a cached result without sending it to a worker: the cached outputs are linked in the job
+    outputs and the result is stored as a SUCCESS in the backend
+    :return: True if the result was cached
+    """
+    result = result_cache.materialize(key, job_id)
+    if result is None:
+        return False
+    if isinstance(result, dict):
+        now = get_utc_time().isoformat()
+        result['time_info'] = {'request': now, 'started': now, 'stopped': now}
+        result['result_cache'] = key
+        result.pop('shadow_name', None)
+        if name is not None:
+            result['shadow_name'] = name
+    pixyz_worker.tasks.app.backend.store_result(job_id, result, 'SUCCESS')
+    return True
+
+
+def get_events_client():
+    """
+    Get the asynchronous redis client used to subscribe to the job events (one per API process)
+    """
+    global events_client
+    if events_client is None:
+        import redis.asyncio
+        events_client = redis.asyncio.from_url(pixyz_worker.tasks.app.conf.result_backend)
+    return events_client
+
+
+async def follow_task_events(job_id: uuid_path_pattern, keepalive: float = 15.0):
+    """
+    Follow a job with the events published by the workers instead of polling the backend
+    The job details are read once, then rebuilt from the progress events. The backend is read again only on a state
+    change and when no event has been received for `keepalive` seconds (a lost worker does not publish anything).
+    :param job_id: the job ID
+    :param keepalive: the maximum delay in seconds without anything yielded
+    :return: an async generator of job details, None when there is nothing new, ended on a final state
+    """
+    pubsub = get_events_client().pubsub()
+    try:
+        # Subscribe before the first read, otherwise an event can be lost between them
+        await pubsub.subscribe(JobEvents.get_channel(job_id))
+        details = await run_in_threadpool(grab_task_details, job_id)
+        yield details
+
+        while details.status not in job_final_states:
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=keepalive)
+            if message is None:
+                job_state = await run_in_threadpool(grab_task_status, job_id)
+                if job_state.status == details.status and job_state.progress == details.progress:
+                    yield None
+                    continue
+                details = await run_in_threadpool(grab_task_details, job_id)
+            else:
+                event = json.loads(message['data'])
+                if 'result' in event and isinstance(event['result'], dict):
+                    details = JobDetails(job_id, name=details.name, status=event['status'])
+                    details.update_from_task_result(event['result'])
+                else:
+                    details = await run_in_threadpool(grab_task_details, job_id)
+            yield details
+    finally:
+        await pubsub.unsubscribe()
+        await pubsub.reset()
 
 
 def grab_task_outputs_list(job_id: uuid_path_pattern):
@@ -322,13 +661,16 @@ def grab_task_outputs_list(job_id: uuid_path_pattern):
     return pixyz_worker.share.get_job_output_dir_content(job_id)
 
 
-def grab_task_outputs_archive(job_id: uuid_path_pattern, package_type: str = 'zip', repack: bool = False):
+def grab_task_outputs_archive(job_id: uuid_path_pattern, package_type: str = 'zip', repack: bool = False,
+                              stream: bool = False):
     """
     Create an archive of all outputs for a given job ID and return the path
     :param job_id: the job ID
     :param package_type: the package type (zip, tar, tar.gz)
     :param repack: if True, force the creation of a new archive
-    :return: the path of the archive
+    :param stream: if True and the archive is not already packaged, return a zip generated on the fly and start a
+    package task for the next downloads
+    :return: the path of the archive, or an iterator of bytes in stream mode
     :raises TaskNotCompletedError: if the job is not finished yet
     """
 
@@ -347,6 +689,16 @@ def grab_task_outputs_archive(job_id: uuid_path_pattern, package_type: str = 'zi
 
     if not repack and os.path.exists(archive_path) and os.path.isfile(archive_path):
         return archive_path
+
+    if stream and package_type == 'zip':
+        # The next downloads get the packaged archive, with its ETag and the range requests
+        if not pixyz_worker.utils.DiskAsyncState.is_registered(job_id, package_type):
+            try:
+                task = pixyz_worker.tasks.package.apply_async(args=(job_id, package_type))
+                logger.info(f"Archive Task {task.id} created for job '{job_id}' outputs while streaming them")
+            except Exception as e:
+                logger.warning(f"Unable to package the outputs of job '{job_id}': {e}")
+        return pixyz_worker.archive.iter_zip_directory(pixyz_worker.share.get_job_output_dir(job_id))
     
     # Check if an archive task is not already running
     if pixyz_worker.utils.DiskAsyncState.is_registered(job_id, package_type):
@@ -369,6 +721,87 @@ def grab_task_output_file(job_id: uuid_path_pattern, file_path: str):
     """
     return pixyz_worker.share.get_job_output_file_path(job_id, file_path, check_if_exists=True)  
 
+########################################################################################
+##                                  QUEUES UTILS                                      ##
+########################################################################################
+
+# Queue metrics, exposed on /metrics by the instrumentator with the default registry
+queue_depth_gauge = Gauge('pixyz_queue_depth', 'Number of messages waiting in a broker queue', ['queue'])
+queue_rejected_counter = Counter('pixyz_api_queue_rejected', 'Jobs rejected because their queue is full', ['queue'])
+
+
+class QueueAdmission(object):
+    """
+    Admission control of the new jobs from the depth of the broker queues
+
+    The depths of the monitored queues (LLEN of the Redis lists of the broker, summed over the priority levels) are
+    read at most once per `config.queue_depth_cache_ttl` seconds and exported as Prometheus gauges. A new job is
+    rejected when its queue has reached its threshold (`config.queue_max_depths`). Without depth (broker not available
+    or not Redis), the jobs are accepted.
+    """
+    queues = ('cpu', 'gpu', 'gpuhigh', 'control')
+    instance = None
+
+    def __init__(self, thresholds=None, ttl=None, retry_after=None):
+        self.thresholds = pixyz_worker.config.queue_max_depths if thresholds is None else thresholds
+        self.ttl = pixyz_worker.config.queue_depth_cache_ttl if ttl is None else ttl
+        self.retry_after = pixyz_worker.config.queue_retry_after if retry_after is None else retry_after
+        self.queues = tuple(dict.fromkeys(self.queues + tuple(self.thresholds)))
+        self.lock = threading.Lock()
+        self.depths = {}
+        self.updated = None
+        for queue in self.queues:
+            queue_depth_gauge.labels(queue).set_function(lambda queue=queue: self.get_depth(queue))
+
+    @classmethod
+    def get_instance(cls):
+        if cls.instance is None:
+            cls.instance = cls()
+        return cls.instance
+
+    def read_depths(self):
+        with pixyz_worker.tasks.app.pool.acquire(block=True) as conn:
+            with conn.default_channel.client.pipeline() as pipe:
+                # A queue has one list per priority level
+                names = {queue: get_priority_queue_names(queue) for queue in self.queues}
+                for queue in self.queues:
+                    for name in names[queue]:
+                        pipe.llen(name)
+                lengths = iter(pipe.execute())
+                return {queue: sum(next(lengths) for _ in names[queue]) for queue in self.queues}
+
+    def get_depths(self):
+        """
+        :return: the number of waiting messages of each monitored queue ({} if the broker is not available)
+        """
+        with self.lock:
+            if self.updated is None or time.monotonic() - self.updated >= self.ttl:
+                try:
+                    self.depths = self.read_depths()
+                except Exception as e:
+                    logger.warning(f"Unable to read the queue depths: {e}")
+                    self.depths = {}
+                self.updated = time.monotonic()
+            return self.depths
+
+    def get_depth(self, queue: str):
+        return self.get_depths().get(queue, float('nan'))
+
+    def check(self, queue: str):
+        """
+        Check if a new job can be sent to a queue
+        :return: None if the job is accepted, otherwise the delay in seconds before a retry
+        """
+        threshold = self.thresholds.get(queue)
+        if threshold is None:
+            return None
+        depth = self.get_depths().get(queue)
+        if depth is None or depth < threshold:
+            return None
+        queue_rejected_counter.labels(queue).inc()
+        return self.retry_after
+
+
 ########################################################################################
 ##                             PROCESSES UTILS                                        ##
 ########################################################################################
@@ -385,13 +818,35 @@ def get_script_path_in_processes_dir(script_name: str):
     return os.path.join(pixyz_worker.config.process_path, f"{script_name}.py")
 
 
+def get_job_queue_from_form(fields: dict):
+    """
+    Get the queue of a job from the form fields received before its files: the queue of the config, then the one of
+    the process decorator, 'cpu' by default
+    """
+    try:
+        config = json.loads(fields['config']) if fields.get('config') else {}
+    except ValueError:
+        config = {}
+    if not isinstance(config, dict):
+        config = {}
+    if config.get('queue'):
+        return config['queue']
+    process = fields.get('process', 'custom')
+    if process != 'custom' and process in get_scripts_list_in_processes_dir():
+        si = pixyz_worker.share.SourceInspector(get_script_path_in_processes_dir(process))
+        queue = si.get_pixyz_decorator_kwargs_for_a_function(config.get('entrypoint') or 'main').get('queue')
+        if queue:
+            return queue
+    return 'cpu'
+
+
 ########################################################################################
 ##                                   API UTILS                                        ##
 ########################################################################################
 
 # Error helper
 # TODO: auto add traceback here if error is Exception not string
-def raise_api_error(error_model: ApiError, error: Exception | str | None = None):
+def raise_api_error(error_model: ApiError, error: Exception | str | None = None, headers: dict | None = None):
     """
     Raise an API error with a detailled error message and default code and message
     Automatically 
@@ -413,7 +868,7 @@ def raise_api_error(error_model: ApiError, error: Exception | str | None = None)
         logger.error(traceback.format_exc())
 
     err = error_model(details=detailled_error_message)
-    raise HTTPException(status_code=err.code, detail=err.dict())
+    raise HTTPException(status_code=err.code, detail=err.dict(), headers=headers)
 
 
 
@@ -428,9 +883,10 @@ api_error_responses = {
     #501: {"model": ApiError501, "description": ApiError501.__doc__ or ApiError501.__name__},
 }
 
-def get_api_response_desc_from_model(model):
+def get_api_response_desc_from_model(model, errors=()):
     """
     Get the description of a route from a model class
+    :param errors: the ApiError models of the route errors not in `api_error_responses`
     """
 
     if not model:
@@ -445,6 +901,7 @@ def get_api_response_desc_from_model(model):
         'response_model': model,
         'responses': {
             **api_error_responses,
+            **{error().code: {"model": error, "description": error.__doc__ or error.__name__} for error in errors},
             status.HTTP_200_OK: {
                 'model': model,
                 'description': 'Successful request',
@@ -463,7 +920,59 @@ def get_api_file_response_desc():
         'description': 'Download a file',
         'response_class': FileResponse,
         'responses': {
-            **api_error_responses
+            **api_error_responses,
+            status.HTTP_206_PARTIAL_CONTENT: {'description': 'Requested range of the file (Range header)'},
+            status.HTTP_304_NOT_MODIFIED: {'description': 'The file matches the If-None-Match ETag'},
+            status.HTTP_416_RANGE_NOT_SATISFIABLE: {'description': 'The range is outside of the file'},
+        }
+    }
+
+
+def get_file_etag(stat_result):
+    """
+    Get the strong ETag of a share file, a new file (or a modified one) gets a new inode, mtime or size
+    """
+
+    return f'"{stat_result.st_ino:x}-{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+
+def get_file_response(request: Request, path: str, media_type='application/octet-stream'):
+    """
+    Send a share file with the conditional and range requests support:
+        - ETag/If-None-Match: 304 when the client already has the file
+        - Range/If-Range: 206 with the requested part(s) when the file is unchanged, to resume or split a download
+    :param request: the request
+    :param path: the file path
+    :param media_type: the response media type
+    :return: the response
+    """
+
+    stat_result = os.stat(path)
+    etag = get_file_etag(stat_result)
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+        if '*' in tags or etag in tags:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+    # The range requests (and the If-Range validation against our ETag) are handled by FileResponse
+    return FileResponse(path, media_type=media_type, filename=os.path.basename(path), stat_result=stat_result,
+                        headers={'ETag': etag, 'Accept-Ranges': 'bytes'})
+
+
+def get_api_event_stream_response_desc():
+    """
+    Get the description of a route that returns a server-sent events StreamingResponse
+    """
+
+    return {
+        'description': 'Stream of server-sent events',
+        'response_class': StreamingResponse,
+        'responses': {
+            **api_error_responses,
+            status.HTTP_200_OK: {
+                'content': {'text/event-stream': {}},
+                'description': 'Successful request',
+            }
         }
     }
 
@@ -9,13 +9,24 @@ from .progress import *
 from .signals import *
 from .storage import *
 from .extcode import *
+from .jobindex import *
+from .events import *
+from .resultcache import *
+from .extractcache import *
+from .licenselease import *
+from .priority import *
+from .dag import *
+from .durations import *
+from .locality import *
+from .artifacts import *
+from .archive import *
 from .utils import *
 
 from .license import *
 
 
 __all__ = (config.__all__ + exception.__all__ + share.__all__ + tasks.__all__ + progress.__all__ + storage.__all__ +
-           extcode.__all__ + utils.__all__ + pc.__all__ )
+           extcode.__all__ + jobindex.__all__ + events.__all__ + resultcache.__all__ + extractcache.__all__ + licenselease.__all__ + priority.__all__ + dag.__all__ + durations.__all__ + locality.__all__ + artifacts.__all__ + archive.__all__ + utils.__all__ + pc.__all__ )
 
 def main():
     import os
@@ -43,7 +54,7 @@ def main():
         return os.path.join(config.share_dir, filename)
 
 
-    options = ['worker', '--loglevel=info', '-E', '-Q', config.queue_name, '-c',
+    options = ['worker', '--loglevel=info', '-E', '-Q', get_worker_queue_names(), '-c',
                config.concurrency, '-n', 'worker@%h',
                '--without-gossip', '--without-mingle', '-Ofair']
     if sys.platform == 'win32' or not debug:
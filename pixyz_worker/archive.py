@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import time
+import zlib
+import struct
+import tarfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import pixyz_worker.config
+
+__all__ = ['ParallelDeflateWriter', 'ParallelGzipWriter', 'ZipStreamWriter', 'package_directory', 'iter_zip_directory']
+
+# Outputs already compressed by their format, stored as is in a zip archive
+stored_extensions = ('.glb', '.png', '.ktx2', '.pxz', '.jpg', '.jpeg', '.webp', '.zip', '.gz', '.7z', '.mp4')
+
+
+class ParallelDeflateWriter(object):
+    """
+    Raw deflate stream compressed by chunks in a thread pool (zlib releases the GIL)
+
+    Like pigz, each chunk is compressed with the end of the previous chunk as dictionary and ends with a sync flush,
+    only the last one is finished: the concatenation is a single valid deflate stream. The compressed chunks are
+    written in order to `raw` as soon as they are ready, the memory is bounded to a few chunks per thread.
+    """
+    dictionary_size = 32 * 1024
+
+    def __init__(self, raw, executor, level=6, chunk_size=1024 * 1024, max_pending=None):
+        self.raw = raw
+        self.executor = executor
+        self.level = level
+        self.chunk_size = chunk_size
+        self.max_pending = max_pending or 2 * (os.cpu_count() or 1)
+        self.buffer = bytearray()
+        self.dictionary = None
+        self.pending = deque()
+        self.crc = 0
+        self.size = 0
+        self.compressed_size = 0
+
+    @staticmethod
+    def compress(data, dictionary, level, last):
+        if dictionary:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=dictionary)
+        else:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.chunk_size:
+            chunk = bytes(self.buffer[:self.chunk_size])
+            del self.buffer[:self.chunk_size]
+            self.submit(chunk, last=False)
+        return len(data)
+
+    def submit(self, chunk, last):
+        self.crc = zlib.crc32(chunk, self.crc)
+        self.size += len(chunk)
+        self.pending.append(self.executor.submit(self.compress, chunk, self.dictionary, self.level, last))
+        self.dictionary = chunk[-self.dictionary_size:]
+        while len(self.pending) > self.max_pending:
+            self.write_compressed(self.pending.popleft().result())
+
+    def write_compressed(self, data):
+        self.raw.write(data)
+        self.compressed_size += len(data)
+
+    def close(self):
+        self.submit(bytes(self.buffer), last=True)
+        self.buffer = bytearray()
+        while self.pending:
+            self.write_compressed(self.pending.popleft().result())
+
+
+class ParallelGzipWriter(object):
+    """
+    Write-only gzip file object compressed with a ParallelDeflateWriter (ex: for a streamed tarfile)
+    """
+    def __init__(self, raw, executor, level=6):
+        self.raw = raw
+        mtime = int(time.time())
+        # ID1 ID2 CM FLG MTIME XFL OS(unix)
+        self.raw.write(struct.pack('<BBBBIBB', 0x1f, 0x8b, 8, 0, mtime, 0, 3))
+        self.deflate = ParallelDeflateWriter(raw, executor, level)
+
+    def write(self, data):
+        return self.deflate.write(data)
+
+    def close(self):
+        self.deflate.close()
+        self.raw.write(struct.pack('<II', self.deflate.crc, self.deflate.size & 0xffffffff))
+
+
+class CountingWriter(object):
+    def __init__(self, raw):
+        self.raw = raw
+        self.offset = 0
+
+    def write(self, data):
+        self.raw.write(data)
+        self.offset += len(data)
+        return len(data)
+
+
+class ZipStreamWriter(object):
+    """
+    Zip archive written sequentially to a non seekable file object (zip64, data descriptors)
+
+    The sizes and CRC of a member are not known before its data is written: the local header has the data descriptor
+    flag and a zip64 extra field, the real values follow the data and are repeated in the central directory.
+    Each member is stored or deflated (in parallel with the executor when provided).
+    """
+    version = 45  # zip64
+    flags = 0x08 | 0x800  # data descriptor, utf-8 names
+
+    def __init__(self, raw, executor=None, level=6):
+        self.out = CountingWriter(raw)
+        self.executor = executor
+        self.level = level
+        self.entries = []
+
+    @staticmethod
+    def get_dos_datetime(mtime):
+        t = time.localtime(mtime)
+        if t.tm_year < 1980:
+            return 0, (0 << 9) | (1 << 5) | 1
+        return ((t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+                ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday)
+
+    @staticmethod
+    def is_stored(arcname):
+        return arcname.lower().endswith(stored_extensions)
+
+    def write_file(self, path, arcname, chunk_size=1024 * 1024):
+        """
+        Add a file to the archive, the already compressed formats are stored
+        """
+        for _ in self.iter_file(path, arcname, chunk_size):
+            pass
+
+    def iter_file(self, path, arcname, chunk_size=1024 * 1024):
+        """
+        Same as write_file, but yields after each chunk to let the caller flush the output
+        """
+        st = os.stat(path)
+        with open(path, 'rb') as f:
+            yield from self.iter_member(arcname, iter(lambda: f.read(chunk_size), b''), st.st_mtime, st.st_mode,
+                                        zlib.DEFLATED if not self.is_stored(arcname) else 0)
+
+    def write_member(self, arcname, chunks, mtime=None, mode=0o644, method=zlib.DEFLATED):
+        """
+        Add a member from an iterable of bytes
+        """
+        for _ in self.iter_member(arcname, chunks, mtime, mode, method):
+            pass
+
+    def iter_member(self, arcname, chunks, mtime=None, mode=0o644, method=zlib.DEFLATED):
+        """
+        Same as write_member, but yields after each chunk
+        """
+        name = arcname.replace(os.sep, '/').encode('utf-8')
+        dos_time, dos_date = self.get_dos_datetime(time.time() if mtime is None else mtime)
+        offset = self.out.offset
+        extra = struct.pack('<HHQQ', 0x0001, 16, 0, 0)
+        self.out.write(struct.pack('<IHHHHHIIIHH', 0x04034b50, self.version, self.flags, method, dos_time, dos_date,
+                                   0, 0xffffffff, 0xffffffff, len(name), len(extra)))
+        self.out.write(name)
+        self.out.write(extra)
+
+        if method == zlib.DEFLATED and self.executor is not None:
+            writer = ParallelDeflateWriter(self.out, self.executor, self.level)
+            for chunk in chunks:
+                writer.write(chunk)
+                yield
+            writer.close()
+            crc, size, compressed_size = writer.crc, writer.size, writer.compressed_size
+        else:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS) if method else None
+            crc, size, start = 0, 0, self.out.offset
+            for chunk in chunks:
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+                self.out.write(compressor.compress(chunk) if compressor else chunk)
+                yield
+            if compressor:
+                self.out.write(compressor.flush())
+            compressed_size = self.out.offset - start
+
+        self.out.write(struct.pack('<IIQQ', 0x08074b50, crc, compressed_size, size))
+        self.entries.append((name, method, dos_time, dos_date, crc, compressed_size, size, offset, mode))
+        yield
+
+    def close(self):
+        """
+        Write the central directory, the underlying file object is not closed
+        """
+        cd_offset = self.out.offset
+        for name, method, dos_time, dos_date, crc, compressed_size, size, offset, mode in self.entries:
+            if max(compressed_size, size, offset) >= 0xffffffff:
+                extra = struct.pack('<HHQQQ', 0x0001, 24, size, compressed_size, offset)
+                compressed_size = size = offset = 0xffffffff
+            else:
+                extra = b''
+            self.out.write(struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, (3 << 8) | self.version, self.version,
+                                       self.flags, method, dos_time, dos_date, crc, compressed_size, size, len(name),
+                                       len(extra), 0, 0, 0, (mode & 0xffff) << 16, offset))
+            self.out.write(name)
+            self.out.write(extra)
+        cd_size = self.out.offset - cd_offset
+        count = len(self.entries)
+        if count >= 0xffff or max(cd_size, cd_offset) >= 0xffffffff:
+            zip64_offset = self.out.offset
+            self.out.write(struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, self.version, self.version, 0, 0, count, count,
+                                       cd_size, cd_offset))
+            self.out.write(struct.pack('<IIQI', 0x07064b50, 0, zip64_offset, 1))
+        self.out.write(struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, min(count, 0xffff), min(count, 0xffff),
+                                   min(cd_size, 0xffffffff), min(cd_offset, 0xffffffff), 0))
+
+
+class ChunkBuffer(object):
+    """
+    Write-only file object keeping the written bytes until they are popped
+    """
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        self.size = 0
+        return data
+
+
+def iter_zip_directory(directory, chunk_size=1024 * 1024, level=6):
+    """
+    Generate a zip archive of a directory on the fly, without temporary file (ex: as an HTTP response body)
+    The already compressed formats are stored, the others are deflated by the calling thread.
+    :param directory: the directory to archive
+    :param chunk_size: the approximate size of the generated chunks
+    :return: an iterator of bytes
+    """
+    buffer = ChunkBuffer()
+    writer = ZipStreamWriter(buffer, level=level)
+    for path, arcname in list_directory_files(directory):
+        for _ in writer.iter_file(path, arcname, chunk_size):
+            if buffer.size >= chunk_size:
+                yield buffer.pop()
+    writer.close()
+    yield buffer.pop()
+
+
+def list_directory_files(directory):
+    """
+    List the files of a directory recursively (sorted, relative paths)
+    """
+    ret = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for file in sorted(files):
+            path = os.path.join(root, file)
+            ret.append((path, os.path.relpath(path, directory)))
+    return ret
+
+
+def package_directory(directory, destination, package_type='zip', threads=None):
+    """
+    Package a directory into an archive file, the compression runs in a thread pool
+    :param directory: the directory to package
+    :param destination: the archive file path
+    :param package_type: zip, tar or gztar
+    :param threads: the number of compression threads (default: `config.package_threads`)
+    """
+    threads = threads or pixyz_worker.config.package_threads or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=threads) as executor, open(destination, 'wb') as f:
+        if package_type == 'zip':
+            writer = ZipStreamWriter(f, executor)
+            for path, arcname in list_directory_files(directory):
+                writer.write_file(path, arcname)
+            writer.close()
+        elif package_type in ('tar', 'gztar'):
+            gz = ParallelGzipWriter(f, executor) if package_type == 'gztar' else None
+            # Stream mode: the tar is written sequentially to the gzip writer
+            with tarfile.open(fileobj=gz or f, mode='w|') as tar:
+                tar.add(directory, arcname='.')
+            if gz is not None:
+                gz.close()
+        else:
+            raise ValueError(f"Unsupported archive type {package_type}")
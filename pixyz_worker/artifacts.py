@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import uuid
+import shutil
+import socket
+import threading
+from .share import get_logger, get_job_share_file_path
+from .exception import PixyzArtifactNotFound
+from .locality import HostAffinity, get_host_queue, get_worker_queues
+import pixyz_worker.config
+
+__all__ = ['ArtifactCache']
+
+
+class ArtifactCache(object):
+    """
+    Intermediate files of a job handed from a task to the next one, kept on the local disk of the worker
+
+        - <cache>/<task_id>/<name>: the artifacts produced by a task, its modification time is its last use
+        - <share>/<task_id>/artifacts/<name>: the copy of an artifact that may be used on another host
+    After a task that produced local artifacts, the next task of its chain is sent to the host queue of the worker
+    (ex: gpu@node1, see HostAffinity) if the worker also consumes its queue, so the artifacts are read from the local
+    disk. The artifacts are copied to the share in the background, for the next task sent to its generic queue after
+    `config.host_affinity_timeout` or when there is no host affinity. Without the local cache, the artifacts are
+    directly stored in the share.
+    """
+    def __init__(self, directory=None, capacity=None):
+        self.directory = pixyz_worker.config.artifact_cache_dir if directory is None else directory
+        self.capacity = pixyz_worker.config.artifact_cache_size if capacity is None else capacity
+        self.logger = get_logger('pixyz_worker.artifacts.ArtifactCache')
+
+    @staticmethod
+    def is_enabled():
+        return pixyz_worker.config.artifact_cache_size > 0
+
+    @staticmethod
+    def get_share_path(artifact):
+        return get_job_share_file_path(artifact['task_id'], artifact['name'], directory='artifacts')
+
+    def get_local_path(self, artifact):
+        return os.path.join(self.directory, artifact['task_id'], artifact['name'])
+
+    def put(self, task_id, name, path):
+        """
+        Move a file in the artifacts of a task
+        :param task_id: the task that produced the file
+        :param name: the name of the artifact, unique in the task
+        :param path: the file, it is moved
+        :return: the artifact: name, task_id, host, local (True if only stored on the host)
+        """
+        if not name or os.path.basename(name) != name:
+            raise ValueError(f"Invalid artifact name '{name}'")
+        artifact = {'name': name, 'task_id': task_id, 'host': socket.gethostname(), 'local': self.is_enabled()}
+        target = self.get_local_path(artifact) if artifact['local'] else self.get_share_path(artifact)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.move(path, target)
+        self.logger.debug(f"Artifact {name} of task {task_id} stored in {target}")
+        if artifact['local']:
+            self.evict()
+        return artifact
+
+    def get(self, artifact):
+        """
+        Get the path of an artifact: from the local cache on the host that produced it, from the share otherwise
+        :raise PixyzArtifactNotFound: the artifact is not on this host and has not been copied to the share
+        """
+        if artifact['host'] == socket.gethostname():
+            path = self.get_local_path(artifact)
+            if os.path.isfile(path):
+                os.utime(os.path.dirname(path))
+                return path
+        path = self.get_share_path(artifact)
+        if not os.path.isfile(path):
+            raise PixyzArtifactNotFound(f"Artifact {artifact['name']} of task {artifact['task_id']} is not available "
+                                        f"on {socket.gethostname()} (stored on {artifact['host']})")
+        return path
+
+    def publish(self, artifact):
+        """
+        Copy a local artifact to the share, for a task that runs on another host
+        """
+        source = self.get_local_path(artifact)
+        target = self.get_share_path(artifact)
+        tmp_path = f"{target}.{uuid.uuid4()}"
+        shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, target)
+        self.logger.info(f"Artifact {artifact['name']} of task {artifact['task_id']} copied to the share")
+
+    def publish_all(self, artifacts):
+        for artifact in artifacts:
+            try:
+                self.publish(artifact)
+            except OSError as e:
+                self.logger.warning(f"Unable to copy the artifact {artifact['name']} of task {artifact['task_id']} "
+                                    f"to the share: {e}")
+
+    @staticmethod
+    def get_next_task(task):
+        """
+        The next task of the chain of a task (signature dict), None if there is none
+        """
+        chain = getattr(task.request, 'chain', None)
+        return chain[-1] if chain else None
+
+    def handoff(self, task, artifacts):
+        """
+        Make the local artifacts of a task available to the next one
+        :param task: the Celery task that produced the artifacts (before it returns)
+        :param artifacts: the artifacts of the task
+        :return: the queue of the next task if it is sent to this host, None otherwise
+        """
+        artifacts = [artifact for artifact in artifacts if artifact.get('local')]
+        if not artifacts:
+            return None
+        signature = self.get_next_task(task)
+        if signature is not None:
+            options = signature.setdefault('options', {})
+            next_task = task.app.tasks.get(signature.get('task'))
+            queue = options.get('queue') or getattr(next_task, 'queue', None) or task.app.conf.task_default_queue
+            timeout = pixyz_worker.config.host_affinity_timeout
+            if timeout and HostAffinity.is_enabled() and queue in get_worker_queues():
+                # Sent to its generic queue if no worker of this host takes it in time
+                task_id = options.setdefault('task_id', str(uuid.uuid4()))
+                HostAffinity.request(task.app, task_id, queue, timeout)
+                options['queue'] = get_host_queue(queue)
+                # The exchange and routing key of the generic queue are not the ones of the host queue
+                options.pop('exchange', None)
+                options.pop('routing_key', None)
+                self.logger.info(f"Next task {task_id} sent to {options['queue']} with the local artifacts")
+                threading.Thread(target=self.publish_all, args=(artifacts,), name='PixyzArtifactPublish').start()
+                return options['queue']
+        self.publish_all(artifacts)
+        return None
+
+    def evict(self):
+        """
+        Remove the artifacts of the least recently used tasks until the cache fits in its capacity
+        """
+        if not os.path.isdir(self.directory):
+            return
+        entries = []
+        for task_id in os.listdir(self.directory):
+            task_dir = os.path.join(self.directory, task_id)
+            try:
+                size = sum(entry.stat().st_size for entry in os.scandir(task_dir) if entry.is_file())
+                entries.append((os.path.getmtime(task_dir), task_dir, size))
+            except OSError:
+                continue
+        total = sum(size for _, _, size in entries)
+        for _, task_dir, size in sorted(entries):
+            if total <= self.capacity:
+                break
+            shutil.rmtree(task_dir, ignore_errors=True)
+            total -= size
+            self.logger.info(f"Artifacts {os.path.basename(task_dir)} evicted")
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 import os
 import sys
+import tempfile
 import dotenv
 
 __all__ = ['share_dir', 'version', 'debug', 'log_level', 'cleanup_delay', 'supported_archive']
@@ -47,12 +48,58 @@ api_port = int(os.getenv('API_PORT', 8001))
 # This time limit is used for pixyz task in the internal process manager (not the default celery manager that not works)
 time_limit = int(os.getenv('PIXYZ_TIME_LIMIT', 60*40))  # on little worker, you can't wait more time
 retry_time_limit = int(os.getenv('PIXYZ_RETRY_TIME_LIMIT', 60*60))  # on gpuhigh queue,you can wait more time
+# Default time limit of the jobs submitted to the API
+job_time_limit = int(os.getenv('JOB_TIME_LIMIT', 3600))
+# Time limit of a job learned from the durations of the previous jobs of the same kind (see DurationModel)
+adaptive_time_limit = os.getenv('ADAPTIVE_TIME_LIMIT', 'false').lower() == 'true'
+adaptive_time_limit_factor = float(os.getenv('ADAPTIVE_TIME_LIMIT_FACTOR', 3.0))
+adaptive_time_limit_samples = int(os.getenv('ADAPTIVE_TIME_LIMIT_SAMPLES', 20))
+adaptive_time_limit_min = int(os.getenv('ADAPTIVE_TIME_LIMIT_MIN', 60))
+
+# Minimal delay in seconds between two task progress writes to the backend (0 = write on every progress update)
+progress_flush_interval = float(os.getenv('PROGRESS_FLUSH_INTERVAL', 1.0))
+
+# Maximal delay in seconds without event before the states of the subtasks waited by a job are read again
+wait_resync_interval = float(os.getenv('WAIT_RESYNC_INTERVAL', 10.0))
+
+# Number of compression threads used to package the job outputs (0 = number of CPUs)
+package_threads = int(os.getenv('PACKAGE_THREADS', 0))
+
+# Pre-forked sandbox processes used by the segfault protection (0 = fork a new process for each task)
+sandbox_pool_size = int(os.getenv('SANDBOX_POOL_SIZE', 0))
+# Recycle a sandbox process after this number of tasks (0 = never)
+sandbox_max_tasks_per_child = int(os.getenv('SANDBOX_MAX_TASKS_PER_CHILD', 50))
+
+# Admission control of the API: maximum number of waiting messages of a queue before the new jobs of this queue are
+# rejected (ex: "gpu=500,cpu=2000", a queue without threshold is never full)
+queue_max_depths = {queue.strip(): int(depth) for queue, depth in
+                    (item.split('=') for item in os.getenv('QUEUE_MAX_DEPTHS', '').split(',') if item.strip())}
+# Delay in seconds between two reads of the queue depths by the API
+queue_depth_cache_ttl = float(os.getenv('QUEUE_DEPTH_CACHE_TTL', 2.0))
+# Retry-After delay in seconds sent with a rejected job
+queue_retry_after = int(os.getenv('QUEUE_RETRY_AFTER', 60))
+
+# Priority levels of the jobs (`priority` of the job config), one broker list per level and queue: 0 is served first
+job_priorities = {'high': 0, 'normal': 5, 'low': 9}
+job_default_priority = os.getenv('JOB_DEFAULT_PRIORITY', 'normal')
+# Every N seconds, the oldest waiting job of each level is promoted to the level above so that the low priority jobs
+# always make progress (0 = strict priorities)
+priority_aging_interval = float(os.getenv('PRIORITY_AGING_INTERVAL', 30))
 
 # License information
 license_host = os.getenv('LICENSE_HOST', None)
 license_port = int(os.getenv('LICENSE_PORT', 35000))
 license_acquire_at_start = os.getenv('LICENSE_ACQUIRE_AT_START', 'true').lower() == 'true'
 license_flexlm = os.getenv('LICENSE_FLEXLM', 'false').lower() == 'true'
+# Number of license tokens shared by all the workers: a process waits for a free token before initializing its pixyz
+# session (0 = no limit, each process gets its license from the server directly)
+license_tokens = int(os.getenv('LICENSE_TOKENS', 0))
+# A lease of a dead process is freed after this delay in seconds
+license_lease_ttl = int(os.getenv('LICENSE_LEASE_TTL', 60))
+# Maximum wait in seconds for a free token, the task fails after it (0 = no limit)
+license_lease_timeout = int(os.getenv('LICENSE_LEASE_TIMEOUT', 0))
+# Keep the pixyz session of a worker process between the tasks when the license is not acquired at start
+session_keep_alive = os.getenv('PIXYZ_SESSION_KEEP_ALIVE', 'false').lower() == 'true'
 
 # number of second to wait before deleting a share file (upload or extract)
 cleanup_enabled = os.getenv('CLEANUP_ENABLED', 'false').lower() == 'true'
@@ -77,6 +124,25 @@ except ImportError:
 
 process_path = os.getenv('PROCESS_PATH', default_process_dir)
 
+# Number of process scripts (from process_path) kept imported by a worker process (0 = always reload)
+module_cache_size = int(os.getenv('MODULE_CACHE_SIZE', 32))
+
+# Maximum size in bytes of the cached job results, the least recently used are evicted (0 = disable the cache)
+result_cache_size = int(os.getenv('RESULT_CACHE_SIZE', 10 * 1024 ** 3))
+
+# Local cache of the extracted input archives shared by the tasks of a worker, maximum size in bytes (0 = disable)
+extract_cache_size = int(os.getenv('EXTRACT_CACHE_SIZE', 10 * 1024 ** 3))
+extract_cache_dir = os.getenv('EXTRACT_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'pixyz-extract-cache'))
+
+# Local cache of the artifacts handed between the tasks of a chain, maximum size in bytes (0 = store them in the share)
+artifact_cache_size = int(os.getenv('ARTIFACT_CACHE_SIZE', 10 * 1024 ** 3))
+artifact_cache_dir = os.getenv('ARTIFACT_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'pixyz-artifact-cache'))
+
+# Each worker also consumes the queues of its host (ex: gpu@node1) for the tasks sent to the host of their parent
+host_queues = os.getenv('HOST_QUEUES', 'true').lower() == 'true'
+# Default maximal wait in seconds of a subtask for a worker on the host of its parent (0 = no host affinity)
+host_affinity_timeout = float(os.getenv('HOST_AFFINITY_TIMEOUT', 0))
+
 
 def print_pixyz_scheduler_configuration(variables):
     import sys
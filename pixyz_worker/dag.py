@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import uuid
+import fnmatch
+import zipfile
+import tarfile
+from kombu.utils.json import dumps, loads
+from .share import get_logger
+from .settings import task_expire
+from .priority import get_priority
+
+__all__ = ['JobGraph']
+
+
+class JobGraph(object):
+    """
+    Multi-stage job (DAG) compiled into a Celery canvas: no control task waits for the stages
+
+    A stage runs an entrypoint of the job script, its options are:
+        - name: the unique name of the stage
+        - entrypoint: the function of the script (default: the name of the stage)
+        - queue, priority, time_limit: default from the pixyz_schedule decorator of the entrypoint, then from the job
+        - params: merged with the job params
+        - depends_on: the names of the stages to run before this one
+        - foreach: a glob pattern (ex: "*.CATPart"), one task per matching member of the input archive (root_file)
+    The stages are grouped by level, a level starts when all the tasks of the previous level succeeded (chain of
+    groups). All the stages share the input and the output directories of the job. The graph is stored in the result
+    backend (pixyz-dags-<uuid>), the workers write the aggregated state and progress of the stage tasks in the meta of
+    the job when a task starts and ends.
+    """
+    prefix = 'pixyz-dags-'
+    stage_keys = ('name', 'entrypoint', 'queue', 'priority', 'time_limit', 'params', 'depends_on', 'foreach')
+
+    def __init__(self, job_id, stages, name=None):
+        self.job_id = job_id
+        self.name = name
+        self.stages = self.validate(stages)
+        self.logger = get_logger('pixyz_worker.dag.JobGraph')
+
+    @classmethod
+    def validate(cls, stages):
+        """
+        Check the stages and their dependencies
+        :return: the stages with their default options
+        :raise ValueError: invalid stage, unknown dependency or cycle
+        """
+        if not isinstance(stages, list) or not stages:
+            raise ValueError("The stages must be a non empty list")
+        ret = {}
+        for stage in stages:
+            if not isinstance(stage, dict) or not isinstance(stage.get('name'), str) or not stage['name']:
+                raise ValueError(f"Invalid stage {stage}, a stage is an object with a name")
+            unknown = set(stage) - set(cls.stage_keys)
+            if unknown:
+                raise ValueError(f"Unknown options {', '.join(sorted(unknown))} in stage '{stage['name']}'")
+            if stage['name'] in ret:
+                raise ValueError(f"Duplicated stage '{stage['name']}'")
+            if not isinstance(stage.get('params', {}), dict):
+                raise ValueError(f"The params of stage '{stage['name']}' must be an object")
+            depends_on = stage.get('depends_on', [])
+            if isinstance(depends_on, str):
+                depends_on = [depends_on]
+            ret[stage['name']] = {**stage, 'entrypoint': stage.get('entrypoint', stage['name']),
+                                  'depends_on': list(depends_on), 'params': stage.get('params', {})}
+        for stage in ret.values():
+            for dependency in stage['depends_on']:
+                if dependency not in ret:
+                    raise ValueError(f"Stage '{stage['name']}' depends on the unknown stage '{dependency}'")
+        cls.get_levels(ret)
+        return ret
+
+    @staticmethod
+    def get_levels(stages):
+        """
+        Sort the stages by level: a stage is in the level after the last level of its dependencies
+        :return: the list of the stage names of each level
+        """
+        levels, done = [], set()
+        while len(done) < len(stages):
+            level = [name for name, stage in stages.items()
+                     if name not in done and all(dependency in done for dependency in stage['depends_on'])]
+            if not level:
+                raise ValueError(f"Cycle in the dependencies of the stages "
+                                 f"{', '.join(name for name in stages if name not in done)}")
+            levels.append(level)
+            done.update(level)
+        return levels
+
+    def get_entrypoints(self):
+        return list(dict.fromkeys(stage['entrypoint'] for stage in self.stages.values()))
+
+    def get_queues(self):
+        return list(dict.fromkeys(stage['queue'] for stage in self.stages.values()))
+
+    def set_defaults(self, job_config, decorators=None):
+        """
+        Complete the options of the stages
+        :param job_config: the config of the job (queue, priority, time_limit)
+        :param decorators: the pixyz_schedule kwargs of each entrypoint
+        """
+        for stage in self.stages.values():
+            defaults = (decorators or {}).get(stage['entrypoint'], {})
+            for key in ('queue', 'priority', 'time_limit'):
+                if stage.get(key) is None:
+                    stage[key] = defaults.get(key, job_config.get(key))
+            stage['queue'] = stage['queue'] or 'cpu'
+            stage['priority'] = get_priority(stage['priority'])
+
+    @staticmethod
+    def list_archive_members(path):
+        """
+        List the files of a zip or tar.gz archive (relative paths)
+        """
+        if path is None or not os.path.isfile(path):
+            return []
+        if path.endswith('.zip'):
+            with zipfile.ZipFile(path) as archive:
+                return [name for name in archive.namelist() if not name.endswith('/')]
+        if path.endswith('.tar.gz'):
+            with tarfile.open(path) as archive:
+                return [member.name for member in archive.getmembers() if member.isfile()]
+        return []
+
+    def expand(self, data=None):
+        """
+        Create the tasks of the stages, the fan-out stages get one task per matching member of the input archive
+        :raise ValueError: a fan-out stage does not match any member
+        """
+        members = None
+        for stage in self.stages.values():
+            if stage.get('foreach'):
+                if members is None:
+                    members = [member for member in self.list_archive_members(data)
+                               if not member.startswith('__MACOSX/') and not os.path.basename(member).startswith('._')]
+                root_files = [member for member in members if fnmatch.fnmatch(member, stage['foreach'])]
+                if not root_files:
+                    raise ValueError(f"No member of the input archive matches '{stage['foreach']}' "
+                                     f"(stage '{stage['name']}')")
+            else:
+                root_files = [None]
+            stage['tasks'] = [{'id': str(uuid.uuid4()), 'root_file': root_file} for root_file in root_files]
+
+    def compile(self, pc, params):
+        """
+        Build the canvas of the job: a chain of groups of immutable pixyz_execute signatures
+        :param pc: the ProgramContext of the job
+        :param params: the params of the job
+        """
+        from celery import chain, group
+        from pixyz_worker.tasks import pixyz_execute
+        if any('tasks' not in stage for stage in self.stages.values()):
+            self.expand(pc.get('data'))
+        levels = []
+        for level in self.get_levels(self.stages):
+            signatures = []
+            for name in level:
+                stage = self.stages[name]
+                depends = {dependency: [task['id'] for task in self.stages[dependency]['tasks']]
+                           for dependency in stage['depends_on']}
+                for task in stage['tasks']:
+                    stage_pc = pc.clone(entrypoint=stage['entrypoint'], queue=stage['queue'],
+                                        root_file=task['root_file'] or pc.get('root_file'),
+                                        dag={'job_id': self.job_id, 'stage': name, 'depends': depends})
+                    options = {'task_id': task['id'], 'queue': stage['queue'], 'priority': stage['priority']}
+                    if stage.get('time_limit'):
+                        options['time_limit'] = stage['time_limit']
+                    signatures.append(pixyz_execute.si({**params, **stage['params']}, stage_pc).set(**options))
+            levels.append(signatures[0] if len(signatures) == 1 else group(signatures))
+        return levels[0] if len(levels) == 1 else chain(*levels)
+
+    def get_task_ids(self):
+        return [task['id'] for stage in self.stages.values() for task in stage.get('tasks', [])]
+
+    @classmethod
+    def get_key(cls, job_id):
+        return f"{cls.prefix}{job_id}"
+
+    def save(self, client, expire=task_expire):
+        client.set(self.get_key(self.job_id), dumps({'name': self.name, 'stages': list(self.stages.values())}),
+                   ex=expire)
+
+    @classmethod
+    def load(cls, client, job_id):
+        """
+        :return: the graph of a job, None if the job is not a multi-stage job
+        """
+        value = client.get(cls.get_key(job_id))
+        if value is None:
+            return None
+        graph = loads(value)
+        ret = cls.__new__(cls)
+        ret.job_id, ret.name, ret.stages = job_id, graph['name'], {s['name']: s for s in graph['stages']}
+        ret.logger = get_logger('pixyz_worker.dag.JobGraph')
+        return ret
+
+    @staticmethod
+    def get_task_progress(meta):
+        if meta['status'] == 'SUCCESS':
+            return 100
+        if isinstance(meta.get('result'), dict):
+            return meta['result'].get('progress') or 0
+        return 0
+
+    def aggregate(self, metas):
+        """
+        Aggregate the meta of the stage tasks
+        :param metas: the meta of each task id
+        :return: the state, the result (or the exception of the failed task) and the traceback of the job
+        """
+        stages, failed = {}, None
+        started, stopped = [], []
+        for name, stage in self.stages.items():
+            tasks = []
+            for task in stage['tasks']:
+                meta = metas.get(task['id']) or {'status': 'PENDING'}
+                tasks.append({'id': task['id'], 'root_file': task['root_file'], 'status': meta['status'],
+                              'progress': self.get_task_progress(meta)})
+                if meta['status'] in ('FAILURE', 'REVOKED') and failed is None:
+                    failed = meta
+                if isinstance(meta.get('result'), dict):
+                    time_info = meta['result'].get('time_info') or {}
+                    started += [time_info['started']] if time_info.get('started') else []
+                    stopped += [time_info['stopped']] if time_info.get('stopped') else []
+            stages[name] = tasks
+        all_tasks = [task for tasks in stages.values() for task in tasks]
+        if failed is not None:
+            return failed['status'], failed.get('result'), failed.get('traceback')
+        if all(task['status'] == 'SUCCESS' for task in all_tasks):
+            state = 'SUCCESS'
+        elif all(task['status'] == 'PENDING' for task in all_tasks):
+            state = 'PENDING'
+        else:
+            state = 'RUNNING'
+        result = {'shadow_name': self.name,
+                  'progress': sum(task['progress'] for task in all_tasks) // len(all_tasks),
+                  'time_info': {'started': min(started, default=None),
+                                'stopped': max(stopped, default=None) if state == 'SUCCESS' else None},
+                  'steps': [{'info': f"{name} [{task['root_file'] or task['id']}]", 'status': task['status'],
+                             'progress': task['progress']} for name, tasks in stages.items() for task in tasks],
+                  'stages': stages}
+        return state, result, None
+
+    @classmethod
+    def update(cls, app, job_id):
+        """
+        Write the aggregated state of the stage tasks in the meta of the job (serialized by a lock)
+        :return: the state of the job, None if the job is not a multi-stage job or nothing has started
+        """
+        backend = app.backend
+        with backend.client.lock(f"{cls.prefix}lock-{job_id}", timeout=30, blocking_timeout=30):
+            graph = cls.load(backend.client, job_id)
+            if graph is None:
+                return None
+            task_ids = graph.get_task_ids()
+            values = backend.mget([backend.get_key_for_task(task_id) for task_id in task_ids])
+            metas = {task_id: backend.decode_result(value) for task_id, value in zip(task_ids, values)
+                     if value is not None}
+            state, result, traceback = graph.aggregate(metas)
+            if state == 'PENDING':
+                return None
+            backend.store_result(job_id, result, state, traceback=traceback)
+            return state
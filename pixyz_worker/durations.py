@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import math
+from .share import get_logger
+import pixyz_worker.config
+
+__all__ = ['DurationModel']
+
+
+class DurationModel(object):
+    """
+    Durations of the successful jobs, used to set the time limit of the next jobs of the same kind
+
+    A kind of job is a (process, input extension, input size bucket), the size buckets are powers of 4 from 1 MiB
+    (ex: 4M is 1 to 4 MiB). The durations are stored in the result backend (Redis):
+        - pixyz-durations: set of the kinds
+        - pixyz-durations-<process>:<extension>:<bucket>: list of the latest durations in seconds of a kind
+    The time limit of a kind is its p99 x `config.adaptive_time_limit_factor`, between
+    `config.adaptive_time_limit_min` and the default time limit, once `config.adaptive_time_limit_samples` durations
+    are known. A job killed by a too short limit is retried with `PIXYZ_RETRY_TIME_LIMIT`.
+    """
+    key = 'pixyz-durations'
+    max_samples = 1000
+
+    def __init__(self, client):
+        self.client = client
+        self.logger = get_logger('pixyz_worker.durations.DurationModel')
+
+    @staticmethod
+    def is_enabled():
+        return pixyz_worker.config.adaptive_time_limit
+
+    @staticmethod
+    def get_size_bucket(size):
+        bucket = 1
+        while bucket * 1024 ** 2 < size:
+            bucket *= 4
+        return f"{bucket}M"
+
+    @classmethod
+    def get_kind(cls, process, data, root_file=None):
+        """
+        :param process: the name of the process
+        :param data: the input file of the job (None without input)
+        :param root_file: the root file in the input archive
+        :return: the kind of the job (process:extension:bucket)
+        """
+        if data is None or not os.path.isfile(data):
+            return f"{process}::0M"
+        name = (root_file or os.path.basename(data)).lower()
+        extension = 'tar.gz' if name.endswith('.tar.gz') else os.path.splitext(name)[1].lstrip('.')
+        return f"{process}:{extension}:{cls.get_size_bucket(os.path.getsize(data))}"
+
+    def record(self, kind, duration):
+        with self.client.pipeline() as pipe:
+            pipe.sadd(self.key, kind)
+            pipe.lpush(f"{self.key}-{kind}", round(duration, 3))
+            pipe.ltrim(f"{self.key}-{kind}", 0, self.max_samples - 1)
+            pipe.execute()
+
+    def get_durations(self, kind):
+        return sorted(float(duration) for duration in self.client.lrange(f"{self.key}-{kind}", 0, -1))
+
+    @staticmethod
+    def get_percentile(durations, percentile):
+        """
+        :param durations: the sorted durations
+        """
+        return durations[min(len(durations) - 1, math.ceil(percentile / 100 * len(durations)) - 1)]
+
+    @classmethod
+    def compute_time_limit(cls, durations, default):
+        if len(durations) < pixyz_worker.config.adaptive_time_limit_samples:
+            return default
+        time_limit = math.ceil(cls.get_percentile(durations, 99) * pixyz_worker.config.adaptive_time_limit_factor)
+        return min(default, max(pixyz_worker.config.adaptive_time_limit_min, time_limit))
+
+    def get_time_limit(self, kind, default):
+        """
+        :param default: the time limit of the jobs, also the maximal time limit
+        :return: the time limit in seconds of a job of this kind
+        """
+        return self.compute_time_limit(self.get_durations(kind), default)
+
+    def get_table(self, default):
+        """
+        :return: the durations and the time limit of each kind
+        """
+        table = []
+        for kind in sorted(kind.decode() for kind in self.client.smembers(self.key)):
+            durations = self.get_durations(kind)
+            if not durations:
+                continue
+            process, extension, size = kind.rsplit(':', 2)
+            table.append({'process': process, 'extension': extension, 'size': size, 'samples': len(durations),
+                          'p50': self.get_percentile(durations, 50), 'p99': self.get_percentile(durations, 99),
+                          'max': durations[-1], 'time_limit': self.compute_time_limit(durations, default)})
+        return table
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import time
+from kombu.utils.json import dumps, loads
+from .share import get_logger
+import pixyz_worker.config
+
+__all__ = ['JobEvents', 'JobsTracker']
+
+
+class JobEvents(object):
+    """
+    Job progress and state changes published on the result backend (Redis pub/sub)
+
+    Each job has its own channel pixyz-jobs-events-<uuid>, the messages are JSON objects:
+        - {'status': 'RUNNING', 'result': <task meta>}: progress/step update written by TaskProgress
+        - {'status': <state>}: state change (SUCCESS, FAILURE, REVOKED...), the final meta is in the backend
+    Nothing is stored: a subscriber must read the current state once after subscribing.
+    """
+    prefix = 'pixyz-jobs-events-'
+
+    def __init__(self, client):
+        self.client = client
+        self.logger = get_logger('pixyz_worker.events.JobEvents')
+
+    @classmethod
+    def get_channel(cls, job_id):
+        return f"{cls.prefix}{job_id}"
+
+    def publish(self, job_id, status, result=None):
+        """
+        Publish a job event, a failure is only logged because the events are not the reference
+        :return: the number of subscribers that received the event
+        """
+        event = {'status': status}
+        if result is not None:
+            event['result'] = result
+        try:
+            return self.client.publish(self.get_channel(job_id), dumps(event))
+        except Exception as e:
+            self.logger.warning(f"Unable to publish an event for job {job_id}: {e}")
+            return 0
+
+
+class JobsTracker(object):
+    """
+    Follow the state of jobs (ex: the subtasks of a job) with their events instead of polling the backend
+
+    The channels of the jobs are subscribed before their states are read once, then a state is only read again when
+    the final state event of a job is received (the event does not contain the result). The states of the unfinished
+    jobs are read again when no event has been received for `config.wait_resync_interval` seconds (a lost worker
+    does not publish anything) and after a failure (a failed chain marks its next tasks as failed without event).
+    Without pub/sub (backend other than Redis), the states are polled every `resync_interval`.
+    """
+    ready_states = ('SUCCESS', 'FAILURE', 'REVOKED')
+
+    def __init__(self, backend, job_ids, resync_interval=None):
+        self.backend = backend
+        self.job_ids = list(dict.fromkeys(job_ids))
+        self.resync_interval = pixyz_worker.config.wait_resync_interval if resync_interval is None \
+            else resync_interval
+        self.states = {}
+        self.backend_reads = 0
+        self.events = 0
+        self.pubsub = None
+        self.logger = get_logger('pixyz_worker.events.JobsTracker')
+
+    def __enter__(self):
+        client = getattr(self.backend, 'client', None)
+        if client is not None:
+            try:
+                self.pubsub = client.pubsub(ignore_subscribe_messages=True)
+                self.pubsub.subscribe(*[JobEvents.get_channel(job_id) for job_id in self.job_ids])
+            except Exception as e:
+                self.logger.warning(f"Unable to subscribe to the job events, polling the backend: {e}")
+                self.pubsub = None
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.pubsub is not None:
+            try:
+                self.pubsub.close()
+            except Exception:
+                pass
+            self.pubsub = None
+
+    def read(self, job_id):
+        self.backend_reads += 1
+        meta = self.backend.get_task_meta(job_id, cache=False)
+        return meta['status'], meta.get('result')
+
+    def is_ready(self, job_id):
+        return self.states.get(job_id) in self.ready_states
+
+    def set_state(self, job_id, state):
+        """
+        :return: True if the state of the job has changed
+        """
+        # A late progress event must not bring a finished job back
+        if self.states.get(job_id, 'PENDING') == state or self.is_ready(job_id):
+            return False
+        self.states[job_id] = state
+        return True
+
+    def resync(self):
+        """
+        Read the states of the unfinished jobs
+        :return: the list of the changes (job_id, state, result)
+        """
+        changes = []
+        for job_id in self.job_ids:
+            if not self.is_ready(job_id):
+                state, result = self.read(job_id)
+                if self.set_state(job_id, state):
+                    changes.append((job_id, state, result))
+        return changes
+
+    def get_event(self, timeout):
+        """
+        :return: the job id and its event, None if no event has been received before the timeout
+        """
+        if self.pubsub is None:
+            time.sleep(timeout)
+            return None
+        deadline = time.monotonic() + timeout
+        while (remaining := deadline - time.monotonic()) > 0:
+            message = self.pubsub.get_message(timeout=remaining)
+            if message is not None and message['type'] == 'message':
+                self.events += 1
+                channel = message['channel'].decode() if isinstance(message['channel'], bytes) \
+                    else message['channel']
+                return channel[len(JobEvents.prefix):], loads(message['data'])
+        return None
+
+    def changes(self, until=None, timeout=None):
+        """
+        Iterate on the state changes of the jobs until they are all finished
+        :param until: stop when this job is finished (ex: the last task of a chain), even if others are not
+        :param timeout: the maximum wait in seconds (None = no limit)
+        :return: a generator of (job_id, state, result)
+        :raise TimeoutError: the jobs are not finished before the timeout
+        """
+        from celery.exceptions import TimeoutError
+        deadline = None if timeout is None else time.monotonic() + timeout
+        pending = self.resync()
+
+        def is_finished():
+            return self.is_ready(until) if until is not None else all(map(self.is_ready, self.job_ids))
+
+        while True:
+            for change in pending:
+                yield change
+            if is_finished():
+                return
+            pending = []
+            wait = self.resync_interval
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+                if wait <= 0:
+                    raise TimeoutError(f"The jobs are not finished after {timeout}s")
+            received = self.get_event(wait)
+            if received is None:
+                pending = self.resync()
+                continue
+            job_id, event = received
+            if event['status'] in self.ready_states:
+                state, result = self.read(job_id)
+                if self.set_state(job_id, state):
+                    pending.append((job_id, state, result))
+                if state != 'SUCCESS':
+                    pending += self.resync()
+            elif self.set_state(job_id, event['status']):
+                pending.append((job_id, event['status'], event.get('result')))
@@ -1,14 +1,12 @@
 __all__ = [
             'PixyzException', 'InvalidFile', 'InvalidYamlFile', 'InvalidConfigurationFile', 'InternalError',
-            'PixyzWebError', 'PixyzFileNotFound', 'PixyzSecurityViolation', 'PixyzSharedDirectoryNotFound',
+            'PixyzWebError', 'PixyzFileNotFound', 'PixyzArtifactNotFound', 'PixyzSecurityViolation', 'PixyzSharedDirectoryNotFound',
             'PixyzExecutionFault', 'PixyzSignalFault', 'PixyzExitFault', 'DiskStateAlreadyExists',
-            'InvalidBackendParameter', 'PixyzTimeout',
+            'InvalidBackendParameter', 'PixyzTimeout', 'PixyzLicenseError',
             'SharePathNotFoundError', 'SharePathInvalidError', 'TaskNotCompletedError', 'TaskProcessingStarted',
             'PixyzExceptionUnpickleableExceptionWrapper'
            ]
 
-# TODO: create a PixyzLicenseError
-
 class PixyzException(Exception):
     def __init__(self, message):
         self.message = message
@@ -64,6 +62,10 @@ class PixyzFileNotFound(PixyzException):
     pass
 
 
+class PixyzArtifactNotFound(PixyzFileNotFound):
+    pass
+
+
 class PixyzSharedDirectoryNotFound(PixyzException):
     pass
 
@@ -92,6 +94,10 @@ class PixyzTimeout(PixyzException):
     pass
 
 
+class PixyzLicenseError(PixyzException):
+    pass
+
+
 class SharePathNotFoundError(ValueError): 
     pass
 
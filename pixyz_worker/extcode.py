@@ -6,17 +6,27 @@ import sys
 import os
 import string
 import secrets
+import atexit
+import hashlib
+import io
+import signal
+import struct
+import threading
+import time
+from collections import OrderedDict
 from pixyz_worker.share import *
 from pixyz_worker.exception import *
+from pixyz_worker.license import License
+import pixyz_worker.config
 from multiprocessing import Process
-from multiprocessing import Manager
-from queue import Empty as EmptyQueue
+from multiprocessing import Pipe
+from multiprocessing.connection import wait
 from pixyz_worker.pc import ProgramContext
 from tblib import pickling_support
 import pickle
 
 
-__all__ = ['ExternalPythonCode', 'SignalSafeExecution']
+__all__ = ['ExternalPythonCode', 'SignalSafeExecution', 'SandboxPool', 'ModuleCache']
 
 
 class ExceptionWrapper(object):
@@ -61,7 +71,18 @@ class ExternalPythonCode(object):
         self.source = source
         self.module_name = module_name
         self.logger = get_logger('pixyz_worker.extcode.ExternalPythonCode')
-        self.module = self.load_module(source, module_name)
+        if ModuleCache.is_cacheable(source):
+            self.module = ModuleCache.get_instance().load(source)
+        else:
+            # Uploaded scripts are always isolated in a fresh module
+            self.module = self.load_module(source, module_name)
+
+    def __getstate__(self):
+        # A module is not pickable, the sandbox process reloads it from the source
+        return {'source': self.source, 'module_name': self.module_name}
+
+    def __setstate__(self, state):
+        self.__init__(state['source'], state['module_name'])
 
     @staticmethod
     def check_if_source_exist_or_raise(source):
@@ -167,6 +188,106 @@ class ExternalPythonCode(object):
 
 
 
+class ModuleCache(object):
+    """
+    LRU cache of the modules loaded from the process directory (`config.process_path`)
+
+    A module is reloaded when its file changes (mtime, then sha256 of the content) and the whole cache is flushed
+    when a file is added, removed or replaced in the process directory.
+    """
+    _instance = None
+
+    def __init__(self, process_path, max_size):
+        self.logger = get_logger('pixyz_worker.extcode.ModuleCache')
+        self.process_path = os.path.realpath(process_path)
+        self.max_size = max_size
+        # realpath -> {'mtime': mtime_ns, 'size': size, 'sha256': digest, 'module': module}
+        self.entries = OrderedDict()
+        self.directory_mtime = None
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    @staticmethod
+    def get_instance():
+        if ModuleCache._instance is None:
+            ModuleCache._instance = ModuleCache(pixyz_worker.config.process_path,
+                                                pixyz_worker.config.module_cache_size)
+        return ModuleCache._instance
+
+    @staticmethod
+    def is_cacheable(source):
+        if pixyz_worker.config.module_cache_size <= 0:
+            return False
+        process_path = os.path.realpath(pixyz_worker.config.process_path)
+        return os.path.realpath(source).startswith(process_path + os.sep)
+
+    @staticmethod
+    def get_sha256(path):
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as f:
+            while chunk := f.read(1024 * 1024):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    def invalidate(self, source=None):
+        """
+        Forget a cached module, or all of them if no source is given
+        """
+        with self.lock:
+            if source is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(os.path.realpath(source), None)
+            self.stats['invalidations'] += 1
+
+    def check_process_directory(self):
+        try:
+            directory_mtime = os.stat(self.process_path).st_mtime_ns
+        except FileNotFoundError:
+            directory_mtime = None
+        if self.directory_mtime is not None and directory_mtime != self.directory_mtime:
+            self.logger.info(f"Process directory {self.process_path} changed, flushing the module cache")
+            self.invalidate()
+        self.directory_mtime = directory_mtime
+
+    def is_up_to_date(self, entry, path, stat):
+        if entry['mtime'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+            return True
+        # Touched but not modified
+        if entry['sha256'] == self.get_sha256(path):
+            entry['mtime'], entry['size'] = stat.st_mtime_ns, stat.st_size
+            return True
+        return False
+
+    def load(self, source):
+        """
+        Return the module loaded from source, import it only if needed
+        """
+        path = os.path.realpath(source)
+        self.check_process_directory()
+        stat = os.stat(path)
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and self.is_up_to_date(entry, path, stat):
+                self.entries.move_to_end(path)
+                self.stats['hits'] += 1
+                return entry['module']
+
+            self.stats['misses'] += 1
+            sha256 = self.get_sha256(path)
+            self.logger.debug(f"Importing {path} ({sha256})")
+            module = ExternalPythonCode.load_module(path, f"pixyz_process_{sha256[:16]}")
+            self.entries[path] = {'mtime': stat.st_mtime_ns, 'size': stat.st_size, 'sha256': sha256,
+                                  'module': module}
+            self.entries.move_to_end(path)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+            return module
+
+    def get_stats(self):
+        return {**self.stats, 'size': len(self.entries)}
+
+
 class SignalSafeExecution(object):
     @staticmethod
     def get_default_params(params=None):
@@ -180,6 +301,83 @@ class SignalSafeExecution(object):
             default_params['time_limit'] = None
         return default_params
 
+    @staticmethod
+    def call_and_wrap(func, pc, kwargs):
+        """
+        Call the function inside the sandbox and return what must be sent back to the worker
+        :return: (result, program context) or an ExceptionWrapper
+        """
+        try:
+            return func(pc, **kwargs), pc
+        except Exception as e:
+            return ExceptionWrapper(e)
+        finally:
+            # A pending progress write from the sandbox must not land after the worker's final state
+            if hasattr(pc, 'progress_flush'):
+                pc.progress_flush()
+
+    @staticmethod
+    def send_result(conn, payload):
+        try:
+            ResultChannel.send(conn, payload)
+        except Exception as e:
+            # The result itself can't be sent back (not pickable)
+            ResultChannel.send(conn, ExceptionWrapper(e))
+
+    @staticmethod
+    def wait_result(conn, process, func, pc, kwargs, time_limit):
+        """
+        Wait for the result of the function executed by a sandbox process
+        :return: (result, program context) or an ExceptionWrapper
+        :raises: PixyzTimeout, PixyzSignalFault or PixyzExitFault if the sandbox process is lost
+        """
+        logger = get_logger('pixyz_worker.extcode.SignalSafeExecution')
+        # Read the result while the process is running, otherwise a large result fills the pipe and blocks it
+        ready = wait([conn, process.sentinel], time_limit)
+        if not ready:
+            logger.debug(f"wait for kill")
+            # Terminate is not enough
+            process.kill()
+            logger.debug(f"wait for join")
+            process.join()
+            message = f"function {str(func)}({str(pc)}##{str(kwargs)}) trigger a timeout({time_limit})"
+            logger.error(message)
+            raise PixyzTimeout(message)
+
+        if conn in ready:
+            try:
+                return ResultChannel.recv(conn)
+            except EOFError:
+                # The process died without any result
+                pass
+
+        process.join()
+        if process.exitcode < 0:
+            signal_number = process.exitcode * -1
+            logger.error(f"function {func} trigger a signal {signal_number}, raising PixyzExecutionFault")
+            raise PixyzSignalFault(signal_number)
+        else:
+            logger.error(f"function {func} trigger an exit code {process.exitcode}")
+            raise PixyzExitFault(process.exitcode)
+
+    @staticmethod
+    def unwrap_result(func, pc, payload):
+        if isinstance(payload, ExceptionWrapper):
+            logger = get_logger('pixyz_worker.extcode.SignalSafeExecution')
+            logger.error(f"function {func} trigger an exception {payload.exception}, raising it")
+            # In this case, the exception can be pickled OR NOT
+            # In the pickled exception, exception come from the code itself like user exception
+            # But if the exception come from a C library, the exception is not pickable
+            # If you use a function in ExceptionWrapper, It will fail!
+            payload.re_raise()
+        ret, pc_child = payload
+        if hasattr(pc, 'update'):
+            pc.update(**pc_child)
+        else:
+            # Not a ProgramContext, we can't update it
+            pass
+        return ret
+
     @staticmethod
     def run(func, pc:ProgramContext, kwargs=None, **params):
         ret = None
@@ -188,89 +386,278 @@ class SignalSafeExecution(object):
 
         default_params = SignalSafeExecution.get_default_params(params)
 
-        def _return_func_shm(_func, _shm, _args, _kwargs):
-            _ret = None
-            try:
-                _ret = _func(_args, **_kwargs)
-                _shm.append(_ret)
-                _shm.append(_args)
-            except Exception as e:
-                _ret = ExceptionWrapper(e)
-                _shm.append(_ret)
-            return _ret
+        if SandboxPool.is_enabled():
+            return SandboxPool.get_instance().run(func, pc, kwargs, default_params['time_limit'])
+
+        def _return_func_channel(_func, _conn, _args, _kwargs):
+            SignalSafeExecution.send_result(_conn, SignalSafeExecution.call_and_wrap(_func, _args, _kwargs))
 
         logger = get_logger('pixyz_worker.extcode.SignalSafeExecution')
-        with Manager() as manager:
-            shared = manager.list()
-            func_with_queue = [func, shared, pc, kwargs]
-            process = Process(target=_return_func_shm, args=func_with_queue)
+        reader, writer = Pipe(duplex=False)
+        process = Process(target=_return_func_channel, args=[func, writer, pc, kwargs])
 
+        try:
+            logger.debug(f"Executing {func}...")
+            process.start()
+            # Keep only the reader side, otherwise a dead process is never detected on the pipe
+            writer.close()
+            payload = SignalSafeExecution.wait_result(reader, process, func, pc, kwargs,
+                                                      default_params['time_limit'])
+            logger.debug(f"execution of {func} finished, get result")
+            process.join()
+            ret = SignalSafeExecution.unwrap_result(func, pc, payload)
+        except KeyboardInterrupt:
+            logger.error(f"CTRL+C")
+            pass
+        finally:
+            reader.close()
+            if process.is_alive():
+                process.terminate()
+        return ret
+
+
+class ResultChannel(object):
+    """
+    Send a result between the sandbox and the worker through a pipe in a single copy
+
+    The message is a header (payload length, number of out-of-band buffers) followed by a pickle protocol 5
+    payload and its out-of-band buffers. Large bytes are sent as out-of-band buffers, so they are never copied
+    into the pickle payload.
+    """
+    header = struct.Struct('!QI')
+    # Smaller bytes are cheaper in the pickle payload than in a dedicated message
+    out_of_band_threshold = 64 * 1024
+
+    class Pickler(pickle.Pickler):
+        def reducer_override(self, obj):
+            if type(obj) is bytes and len(obj) >= ResultChannel.out_of_band_threshold:
+                return ResultChannel.identity, (pickle.PickleBuffer(obj),)
+            return NotImplemented
+
+    @staticmethod
+    def identity(buffer):
+        return buffer
+
+    @staticmethod
+    def dumps(obj):
+        buffers = []
+        stream = io.BytesIO()
+        ResultChannel.Pickler(stream, protocol=5, buffer_callback=buffers.append).dump(obj)
+        return stream.getbuffer(), buffers
+
+    @staticmethod
+    def send(conn, obj):
+        payload, buffers = ResultChannel.dumps(obj)
+        conn.send_bytes(ResultChannel.header.pack(len(payload), len(buffers)))
+        conn.send_bytes(payload)
+        for buffer in buffers:
+            conn.send_bytes(buffer.raw())
+
+    @staticmethod
+    def recv(conn):
+        size, count = ResultChannel.header.unpack(conn.recv_bytes())
+        payload = conn.recv_bytes()
+        if len(payload) != size:
+            raise InternalError(f"Truncated result ({len(payload)}/{size} bytes)")
+        buffers = [conn.recv_bytes() for _ in range(count)]
+        return pickle.loads(payload, buffers=buffers)
+
+
+class SandboxProcess(object):
+    """
+    A pre-forked child process that executes the functions sent through a pipe until it is recycled
+    """
+    def __init__(self):
+        self.logger = get_logger('pixyz_worker.extcode.SandboxProcess')
+        self.conn, child_conn = Pipe()
+        self.process = Process(target=SandboxProcess.serve, args=(child_conn,), name='PixyzSandbox')
+        self.process.start()
+        # Keep only the parent side, otherwise a dead child is never detected on the pipe
+        child_conn.close()
+        self.task_count = 0
+        self.logger.debug(f"Sandbox process {self.process.pid} started")
+
+    @staticmethod
+    def warm_up(license_: License):
+        """
+        :return: True if the sandbox owns its pixyz session
+        """
+        if license_.disable_pixyz:
+            return False
+        if license_.is_acquire_at_start() and PiXYZSession.initialized:
+            # The pixyz session and the license are inherited from the worker process
+            try:
+                import pxz
+                from pxz import io, algo, scene, view, material, core
+            except ImportError:
+                pass
+            return False
+        # The worker does not hold a session (or is still waiting for a license lease), so the sandbox owns one for
+        # its whole life
+        if PiXYZSession.initialize() is not None and license_.is_acquire_at_start():
+            license_.configure_license()
+        return True
+
+    @staticmethod
+    def cool_down(owner):
+        if owner:
+            PiXYZSession.release()
+
+    @staticmethod
+    def serve(conn):
+        # CTRL+C is managed by the worker that shutdowns the pool
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        license_ = License.from_config()
+        owner = SandboxProcess.warm_up(license_)
+        while True:
+            try:
+                job = conn.recv()
+            except EOFError:
+                break
+            if job is None:
+                break
+            func, pc, kwargs = job
+            PiXYZSession.mark_used()
+            SignalSafeExecution.send_result(conn, SignalSafeExecution.call_and_wrap(func, pc, kwargs))
+            # Don't leak the scene of the previous task in the next one
+            if not license_.disable_pixyz:
+                PiXYZSession.reset()
+        SandboxProcess.cool_down(owner)
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def stop(self, timeout=10):
+        if self.process.is_alive():
             try:
-                import selectors
-                logger.debug(f"Executing {func}...")
-                process.start()
-                process.join(default_params['time_limit'])
-                logger.debug(f"execution of {func} finished, get result")
-                if process.is_alive():
-                    logger.debug(f"wait for kill")
-                    # Terminate is not enough
-                    #process.terminate()
-                    process.kill()
-                    logger.debug(f"wait for join")
-                    process.join()
-                    message = f"function {str(func)}({str(pc)}##{str(kwargs)}) trigger a timeout({default_params['time_limit']})"
-                    logger.error(message)
-                    raise PixyzTimeout(message)
-                if process.exitcode < 0:
-                    signal = process.exitcode * -1
-                    logger.error(f"function {func} trigger a signal {signal}, raising PixyzExecutionFault")
-                    process.terminate()
-                    raise PixyzSignalFault(signal)
-                elif process.exitcode == 0:
-                    logger.debug(f"function {func} trigger a normal exit code, get result...")
-                    ret = shared[0]
-                    if isinstance(ret, ExceptionWrapper):
-                        logger.error(f"function {func} trigger an exception {ret.exception}, raising it")
-                        exc = ret
-                        process.terminate()
-                        # In this case, the exception can be pickled OR NOT
-                        # In the pickled exception, exception come from the code itself like user exception
-                        # But if the exception come from a C library, the exception is not pickable
-                        # If you use a function in ExceptionWrapper, It will fail!
-                        exc.re_raise()
-                    else:
-                        if hasattr(pc, 'update'):
-                            pc.update(**shared[1])
-                        else:
-                            # Not a ProgramContext, we can't update it
-                            pass
-                else:  # process.exitcode > 0
-                    try:
-                        if len(shared) > 0:
-                            ret = shared[0]
-                        if isinstance(ret, ExceptionWrapper):
-                            logger.error(f"function {func} trigger an exception {ret.exception}, raising it")
-                            exc = ret
-                            process.terminate()
-                            exc.re_raise()
-                        else:
-                            # Should not happen because the queue will be empty
-                            logger.error(f"function {func} trigger an exit code {process.exitcode} (with ret, should not be happen)")
-                            process.terminate()
-                            raise PixyzExitFault(process.exitcode)
-                    except EmptyQueue:
-                        logger.error(f"function {func} trigger an exit code {process.exitcode}")
-                        process.terminate()
-                        raise PixyzExitFault(process.exitcode)
-
-            except KeyboardInterrupt:
-                logger.error(f"CTRL+C")
+                self.conn.send(None)
+            except (BrokenPipeError, OSError):
                 pass
-            # except Exception as e:
-            #     print("From SIGNALSAFEEXECUTION*************" + traceback.format_exc())
-            #     raise e
-            process.terminate()
-            return ret
+            self.process.join(timeout)
+            if self.process.is_alive():
+                self.logger.warning(f"Sandbox process {self.process.pid} does not stop, killing it")
+                self.process.kill()
+                self.process.join()
+        self.conn.close()
+
+    def execute(self, func, pc, kwargs, time_limit):
+        """
+        Send a function to the sandbox and wait for its result
+        :return: (result, program context) or an ExceptionWrapper
+        :raises: PixyzTimeout, PixyzSignalFault or PixyzExitFault if the sandbox process is lost
+        """
+        self.task_count += 1
+        self.conn.send((func, pc, kwargs))
+        try:
+            return SignalSafeExecution.wait_result(self.conn, self.process, func, pc, kwargs, time_limit)
+        except PixyzException:
+            self.conn.close()
+            raise
+
+
+class SandboxPool(object):
+    """
+    Pool of pre-forked sandbox processes used by SignalSafeExecution
+    A sandbox is reused between tasks and replaced after `max_tasks_per_child` tasks or after a crash
+    """
+    _instance = None
+
+    def __init__(self, size, max_tasks_per_child=0):
+        self.logger = get_logger('pixyz_worker.extcode.SandboxPool')
+        self.size = size
+        self.max_tasks_per_child = max_tasks_per_child
+        self.idle = []
+        self.stats = {'spawned': 0, 'reused': 0, 'recycled': 0, 'crashed': 0}
+        self.last_task = {}
+
+    @staticmethod
+    def is_enabled():
+        return pixyz_worker.config.sandbox_pool_size > 0
+
+    @staticmethod
+    def get_instance():
+        if SandboxPool._instance is None:
+            SandboxPool._instance = SandboxPool(pixyz_worker.config.sandbox_pool_size,
+                                                pixyz_worker.config.sandbox_max_tasks_per_child)
+            atexit.register(SandboxPool.shutdown_instance)
+        return SandboxPool._instance
+
+    @staticmethod
+    def shutdown_instance():
+        if SandboxPool._instance is not None:
+            SandboxPool._instance.shutdown()
+            SandboxPool._instance = None
+
+    @staticmethod
+    def forget_instance():
+        """
+        Drop the pool inherited from the parent after a fork: its sandboxes are not children of this process
+        """
+        SandboxPool._instance = None
+
+    def spawn(self):
+        self.stats['spawned'] += 1
+        return SandboxProcess()
+
+    def prefork(self):
+        """
+        Start the missing sandbox processes, so the next task does not wait for a fork
+        """
+        self.idle = [child for child in self.idle if child.is_alive()]
+        while len(self.idle) < self.size:
+            self.idle.append(self.spawn())
+
+    def acquire(self):
+        start = time.perf_counter()
+        child = None
+        while self.idle and child is None:
+            candidate = self.idle.pop(0)
+            if candidate.is_alive():
+                child = candidate
+            else:
+                self.stats['crashed'] += 1
+        # A reused sandbox is an already running one, no fork in the critical path
+        reused = child is not None
+        if reused:
+            self.stats['reused'] += 1
+        else:
+            child = self.spawn()
+        self.last_task = {'last_reused': reused, 'last_acquire_duration': time.perf_counter() - start}
+        return child
+
+    def release(self, child):
+        if not child.is_alive():
+            self.stats['crashed'] += 1
+            self.logger.warning(f"Sandbox process {child.process.pid} lost, it will be replaced")
+        elif self.max_tasks_per_child and child.task_count >= self.max_tasks_per_child:
+            self.stats['recycled'] += 1
+            self.logger.info(f"Sandbox process {child.process.pid} reached {child.task_count} tasks, recycling")
+            child.stop()
+        else:
+            self.idle.append(child)
+        self.prefork()
+
+    def get_stats(self):
+        return {**self.stats, **self.last_task}
+
+    def run(self, func, pc, kwargs, time_limit):
+        logger = get_logger('pixyz_worker.extcode.SignalSafeExecution')
+        child = self.acquire()
+        try:
+            logger.debug(f"Executing {func} in sandbox {child.process.pid}...")
+            payload = child.execute(func, pc, kwargs, time_limit)
+        finally:
+            self.release(child)
+        return SignalSafeExecution.unwrap_result(func, pc, payload)
+
+    def shutdown(self):
+        for child in self.idle:
+            child.stop()
+        self.idle = []
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=SandboxPool.forget_instance)
 
 
 def main():
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import json
+import uuid
+import shutil
+import hashlib
+from contextlib import contextmanager
+from .share import get_logger
+import pixyz_worker.config
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: no lock, an entry in use may be evicted (the linked files stay valid)
+    fcntl = None
+
+__all__ = ['ExtractionCache']
+
+
+class ExtractionCache(object):
+    """
+    Cache of the extracted input archives on the local disk, shared by the tasks (and processes) of a worker
+
+    An archive is identified by the sha256 of its content and extracted once:
+        - <cache>/entries/<sha256>/tree: the archive content
+        - <cache>/entries/<sha256>/index.json: the files of the archive and their total size,
+          its modification time is the last use of the entry
+        - <cache>/keys/<dev>-<inode>-<size>-<mtime>: the sha256 of an input file, computed once per file
+        - <cache>/locks/<sha256>: locked (shared) while an entry is used, the eviction skips the locked entries
+    A task gets its own directory where the files of the entry are hard linked: it can add, remove or rename files,
+    the files are read-only so an input file is not modified in place.
+    """
+    def __init__(self, directory=None, capacity=None):
+        self.directory = pixyz_worker.config.extract_cache_dir if directory is None else directory
+        self.capacity = pixyz_worker.config.extract_cache_size if capacity is None else capacity
+        self.logger = get_logger('pixyz_worker.extractcache.ExtractionCache')
+
+    @staticmethod
+    def is_enabled():
+        return pixyz_worker.config.extract_cache_size > 0
+
+    def get_entry_dir(self, key):
+        return os.path.join(self.directory, 'entries', key)
+
+    def get_key(self, archive_path):
+        """
+        Get the sha256 of an archive, the inputs hard linked to the same blob share their inode and their key
+        """
+        st = os.stat(archive_path)
+        key_path = os.path.join(self.directory, 'keys', f"{st.st_dev}-{st.st_ino}-{st.st_size}-{st.st_mtime_ns}")
+        try:
+            with open(key_path) as f:
+                return f.read()
+        except FileNotFoundError:
+            pass
+        sha256 = hashlib.sha256()
+        with open(archive_path, 'rb') as f:
+            while content := f.read(10 * 1024 * 1024):
+                sha256.update(content)
+        os.makedirs(os.path.dirname(key_path), exist_ok=True)
+        tmp_path = f"{key_path}.{uuid.uuid4()}"
+        with open(tmp_path, 'w') as f:
+            f.write(sha256.hexdigest())
+        os.replace(tmp_path, key_path)
+        return sha256.hexdigest()
+
+    @contextmanager
+    def lock(self, key, exclusive=False):
+        """
+        Lock an entry: shared while it is used, exclusive (non-blocking) to evict it
+        :return: True if the lock is acquired
+        """
+        os.makedirs(os.path.join(self.directory, 'locks'), exist_ok=True)
+        with open(os.path.join(self.directory, 'locks', key), 'a') as f:
+            if fcntl is None:
+                yield True
+                return
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB if exclusive else fcntl.LOCK_SH)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def populate(self, archive_path, key):
+        """
+        Extract an archive in a new entry and index its files
+        """
+        entry_dir = self.get_entry_dir(key)
+        tmp_dir = os.path.join(self.directory, 'entries', f"tmp-{uuid.uuid4()}")
+        try:
+            tree_dir = os.path.join(tmp_dir, 'tree')
+            os.makedirs(tree_dir)
+            shutil.unpack_archive(archive_path, tree_dir)
+            files, size = [], 0
+            for root, dirs, file_names in os.walk(tree_dir):
+                for file_name in file_names:
+                    path = os.path.join(root, file_name)
+                    if not os.path.islink(path):
+                        os.chmod(path, 0o444)
+                    files.append(os.path.relpath(path, tree_dir))
+                    size += os.path.getsize(path)
+            with open(os.path.join(tmp_dir, 'index.json'), 'w') as f:
+                json.dump({'files': files, 'size': size}, f)
+            os.rename(tmp_dir, entry_dir)
+            self.logger.info(f"Archive {archive_path} extracted in the cache ({len(files)} files, {size} bytes)")
+        except OSError:
+            # Extracted in the meantime by another process
+            if not os.path.exists(os.path.join(entry_dir, 'index.json')):
+                raise
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def extract(self, archive_path, destination):
+        """
+        Extract an archive in a directory, from the cache if the same content has already been extracted
+        :param archive_path: the archive (zip, tar.gz)
+        :param destination: the directory where the files are linked
+        :return: the index of the archive: files (relative paths), size
+        """
+        key = self.get_key(archive_path)
+        entry_dir = self.get_entry_dir(key)
+        index_path = os.path.join(entry_dir, 'index.json')
+        populated = False
+        with self.lock(key):
+            if not os.path.exists(index_path):
+                self.populate(archive_path, key)
+                populated = True
+            else:
+                self.logger.debug(f"Archive {archive_path} found in the cache ({key})")
+            with open(index_path) as f:
+                index = json.load(f)
+            os.utime(index_path)
+            self.link_tree(os.path.join(entry_dir, 'tree'), destination)
+        if populated:
+            self.evict()
+        return index
+
+    @staticmethod
+    def link_tree(source, destination):
+        for root, dirs, files in os.walk(source):
+            target_root = os.path.join(destination, os.path.relpath(root, source))
+            os.makedirs(target_root, exist_ok=True)
+            for file_name in files:
+                try:
+                    os.link(os.path.join(root, file_name), os.path.join(target_root, file_name))
+                except OSError:
+                    # Not on the same file system
+                    shutil.copy2(os.path.join(root, file_name), os.path.join(target_root, file_name))
+
+    def evict(self):
+        """
+        Remove the least recently used entries (not in use) until the cache fits in its capacity
+        """
+        entries = []
+        entries_dir = os.path.join(self.directory, 'entries')
+        for key in os.listdir(entries_dir):
+            if key.startswith('tmp-'):
+                continue
+            try:
+                index_path = os.path.join(entries_dir, key, 'index.json')
+                with open(index_path) as f:
+                    entries.append((os.path.getmtime(index_path), key, json.load(f)['size']))
+            except (OSError, ValueError):
+                continue
+        total = sum(size for _, _, size in entries)
+        for _, key, size in sorted(entries):
+            if total <= self.capacity:
+                break
+            with self.lock(key, exclusive=True) as locked:
+                if not locked:
+                    continue
+                evicted_dir = os.path.join(entries_dir, f"tmp-{uuid.uuid4()}")
+                try:
+                    os.rename(self.get_entry_dir(key), evicted_dir)
+                except OSError:
+                    continue
+            shutil.rmtree(evicted_dir, ignore_errors=True)
+            total -= size
+            self.logger.info(f"Extracted archive {key} evicted")
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import time
+import uuid
+from .share import get_logger
+from .settings import task_expire
+
+__all__ = ['JobIndex']
+
+
+class JobIndex(object):
+    """
+    Secondary index of the jobs submitted through the API, stored in the result backend (Redis).
+
+    Each job is a member of several sorted sets, always scored by its submission time:
+        - pixyz-jobs-index-time: all jobs
+        - pixyz-jobs-index-state-<state>: jobs by state (PENDING, RUNNING, SUCCESS, FAILURE, RETRY, REVOKED)
+        - pixyz-jobs-index-process-<process>: jobs by process name
+        - pixyz-jobs-index-queue-<queue>: jobs by queue
+    The current state/process/queue of a job is kept in the pixyz-jobs-<uuid> hash to move it between the sets.
+    As all scores are submission times, the jobs older than the task expiration are removed by score.
+    """
+    prefix = 'pixyz-jobs-'
+    states = ('PENDING', 'RUNNING', 'SUCCESS', 'FAILURE', 'RETRY', 'REVOKED')
+
+    def __init__(self, client, expire=task_expire):
+        self.client = client
+        self.expire = expire
+        self.logger = get_logger('pixyz_worker.jobindex.JobIndex')
+
+    def get_job_key(self, job_id):
+        return f"{self.prefix}{job_id}"
+
+    def get_index_key(self, kind=None, value=None):
+        if kind is None:
+            return f"{self.prefix}index-time"
+        return f"{self.prefix}index-{kind}-{value}"
+
+    def add(self, job_id, process, queue, state='PENDING', submitted=None):
+        """
+        Register a new job in the index
+        """
+        submitted = time.time() if submitted is None else submitted
+        with self.client.pipeline() as pipe:
+            pipe.hset(self.get_job_key(job_id), mapping={'state': state, 'process': process, 'queue': queue,
+                                                         'time': submitted})
+            pipe.expire(self.get_job_key(job_id), self.expire)
+            for key in (self.get_index_key(), self.get_index_key('state', state),
+                        self.get_index_key('process', process), self.get_index_key('queue', queue)):
+                self._add_to_index(pipe, key, job_id, submitted)
+            pipe.execute()
+
+    def update(self, job_id, state=None, queue=None):
+        """
+        Move an indexed job to another state and/or queue, the jobs not submitted through the API are ignored
+        :return: True if the job is indexed
+        """
+        key = self.get_job_key(job_id)
+        current_state, current_queue, submitted = self.client.hmget(key, 'state', 'queue', 'time')
+        if submitted is None:
+            return False
+        submitted = float(submitted)
+        with self.client.pipeline() as pipe:
+            for kind, current, new in (('state', current_state, state), ('queue', current_queue, queue)):
+                if new is None or (current is not None and current.decode('utf-8') == new):
+                    continue
+                if current is not None:
+                    pipe.zrem(self.get_index_key(kind, current.decode('utf-8')), job_id)
+                self._add_to_index(pipe, self.get_index_key(kind, new), job_id, submitted)
+                pipe.hset(key, kind, new)
+            pipe.execute()
+        return True
+
+    def remove(self, job_id):
+        """
+        Remove a job from the index
+        """
+        key = self.get_job_key(job_id)
+        state, process, queue = self.client.hmget(key, 'state', 'process', 'queue')
+        with self.client.pipeline() as pipe:
+            pipe.zrem(self.get_index_key(), job_id)
+            for kind, value in (('state', state), ('process', process), ('queue', queue)):
+                if value is not None:
+                    pipe.zrem(self.get_index_key(kind, value.decode('utf-8')), job_id)
+            pipe.delete(key)
+            pipe.execute()
+
+    def search(self, states=None, process=None, queue=None, offset=0, limit=100):
+        """
+        Get the most recent jobs matching all the given criteria with range queries on the sorted sets
+        :param states: a list of states (any of them), SENT is the PENDING state of a job waiting in its queue
+        :param process: a process name
+        :param queue: a queue name
+        :param offset: the number of jobs to skip
+        :param limit: the maximum number of jobs to return
+        :return: the job IDs (most recent first) and the offset of the next page (0 if there are no more jobs)
+        """
+        keys = []
+        if process:
+            keys.append(self.get_index_key('process', process))
+        if queue:
+            keys.append(self.get_index_key('queue', queue))
+        states = {'PENDING' if state == 'SENT' else state for state in states} if states else ()
+        state_keys = [self.get_index_key('state', state) for state in sorted(states)]
+        tmp_keys = []
+
+        with self.client.pipeline() as pipe:
+            if len(state_keys) == 1:
+                keys.append(state_keys[0])
+            elif len(state_keys) > 1:
+                tmp_keys.append(f"{self.prefix}search-{uuid.uuid4()}")
+                pipe.zunionstore(tmp_keys[-1], state_keys)
+                keys.append(tmp_keys[-1])
+            if not keys:
+                keys.append(self.get_index_key())
+            if len(keys) > 1:
+                # The scores are the same in all sets, keep them
+                tmp_keys.append(f"{self.prefix}search-{uuid.uuid4()}")
+                pipe.zinterstore(tmp_keys[-1], keys, aggregate='MAX')
+                keys = [tmp_keys[-1]]
+            # Fetch one more job to know if there is a next page
+            pipe.zrevrange(keys[0], offset, offset + limit)
+            if tmp_keys:
+                pipe.delete(*tmp_keys)
+            job_ids = pipe.execute()[-2 if tmp_keys else -1]
+
+        job_ids = [job_id.decode('utf-8') for job_id in job_ids]
+        if len(job_ids) > limit:
+            return job_ids[:limit], offset + limit
+        return job_ids, 0
+
+    def _add_to_index(self, pipe, key, job_id, submitted):
+        pipe.zadd(key, {job_id: submitted})
+        pipe.zremrangebyscore(key, '-inf', time.time() - self.expire)
+        pipe.expire(key, self.expire)
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import time
+import uuid
+import socket
+import threading
+from .share import get_logger
+from .exception import PixyzLicenseError
+import pixyz_worker.config
+
+__all__ = ['LicenseLease', 'RedisLeaseStore', 'LocalLeaseStore']
+
+
+class RedisLeaseStore(object):
+    """
+    License leases shared by all the workers, stored in the result backend (Redis)
+
+        - pixyz-license-leases: sorted set of the lease holders scored by the expiration time of their lease
+    The expired leases (holder killed without releasing it) are removed before each acquisition, so a token is never
+    lost for longer than the lease TTL.
+    """
+    key = 'pixyz-license-leases'
+    acquire_script = """
+        redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+        if redis.call('ZSCORE', KEYS[1], ARGV[3]) or redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[4]) then
+            redis.call('ZADD', KEYS[1], ARGV[2], ARGV[3])
+            return 1
+        end
+        return 0
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.acquire_lease = client.register_script(self.acquire_script)
+
+    def acquire(self, holder, tokens, ttl):
+        now = time.time()
+        return bool(self.acquire_lease(keys=[self.key], args=[now, now + ttl, holder, tokens]))
+
+    def renew(self, holder, ttl):
+        """
+        :return: False if the lease has expired in the meantime
+        """
+        return bool(self.client.zadd(self.key, {holder: time.time() + ttl}, xx=True, ch=True))
+
+    def release(self, holder):
+        self.client.zrem(self.key, holder)
+
+    def count(self):
+        return self.client.zcount(self.key, time.time(), '+inf')
+
+
+class LocalLeaseStore(object):
+    """
+    License leases of the current process only (ex: without Redis, local execution, tests)
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.leases = {}
+
+    def purge(self):
+        now = time.time()
+        self.leases = {holder: expire for holder, expire in self.leases.items() if expire > now}
+
+    def acquire(self, holder, tokens, ttl):
+        with self.lock:
+            self.purge()
+            if holder in self.leases or len(self.leases) < tokens:
+                self.leases[holder] = time.time() + ttl
+                return True
+            return False
+
+    def renew(self, holder, ttl):
+        with self.lock:
+            self.purge()
+            if holder not in self.leases:
+                return False
+            self.leases[holder] = time.time() + ttl
+            return True
+
+    def release(self, holder):
+        with self.lock:
+            self.leases.pop(holder, None)
+
+    def count(self):
+        with self.lock:
+            self.purge()
+            return len(self.leases)
+
+
+class LicenseLease(object):
+    """
+    Lease of a license token, held by a worker process while its pixyz session is initialized
+
+    The number of concurrent sessions is limited to `config.license_tokens`: a process waits for a free token instead
+    of failing to get a license from the server. The lease is renewed by a background thread every third of its TTL
+    and expires if the process dies without releasing it.
+    """
+    # Shared by the leases of the process when the result backend is not Redis
+    local_store = LocalLeaseStore()
+
+    def __init__(self, store=None, tokens=None, ttl=None, poll_interval=1.0):
+        self.store = LicenseLease.get_default_store() if store is None else store
+        self.tokens = pixyz_worker.config.license_tokens if tokens is None else tokens
+        self.ttl = pixyz_worker.config.license_lease_ttl if ttl is None else ttl
+        self.poll_interval = min(poll_interval, self.ttl / 4)
+        self.holder = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4()}"
+        self.pid = None
+        self.stop_event = threading.Event()
+        self.heartbeat = None
+        self.logger = get_logger('pixyz_worker.licenselease.LicenseLease')
+
+    @staticmethod
+    def is_enabled():
+        return pixyz_worker.config.license_tokens > 0 and not pixyz_worker.config.disable_pixyz
+
+    @staticmethod
+    def get_default_store():
+        """
+        The Redis store of the result backend, or a local store if the backend is not Redis
+        """
+        try:
+            from pixyz_worker.progress import app
+            return RedisLeaseStore(app.backend.client)
+        except Exception as e:
+            get_logger('pixyz_worker.licenselease').warning(f"License leases are local to the process: {e}")
+            return LicenseLease.local_store
+
+    def is_held(self):
+        return self.pid == os.getpid()
+
+    def acquire(self, blocking=True, timeout=None):
+        """
+        Wait for a license token
+        :param blocking: False to return immediately if no token is available
+        :param timeout: the maximum wait in seconds (default: `config.license_lease_timeout`, 0 = no limit)
+        :return: the wait duration in seconds, None if not blocking and no token is available
+        :raise PixyzLicenseError: no token has been released before the timeout
+        """
+        timeout = pixyz_worker.config.license_lease_timeout if timeout is None else timeout
+        start = time.perf_counter()
+        logged = False
+        while not self.store.acquire(self.holder, self.tokens, self.ttl):
+            if not blocking:
+                return None
+            waited = time.perf_counter() - start
+            if 0 < timeout <= waited:
+                raise PixyzLicenseError(f"No license token released after {waited:.0f}s "
+                                        f"({self.tokens} tokens in use)")
+            if not logged:
+                self.logger.info(f"All the {self.tokens} license tokens are in use, waiting for a lease...")
+                logged = True
+            time.sleep(self.poll_interval)
+        wait = time.perf_counter() - start
+        self.pid = os.getpid()
+        self.stop_event.clear()
+        self.heartbeat = threading.Thread(target=self.renew, name='PixyzLicenseLease', daemon=True)
+        self.heartbeat.start()
+        self.logger.info(f"License lease {self.holder} acquired after {wait:.3f}s")
+        return wait
+
+    def renew(self):
+        while not self.stop_event.wait(self.ttl / 3):
+            try:
+                if not self.store.renew(self.holder, self.ttl):
+                    self.logger.warning(f"License lease {self.holder} expired, acquiring it again")
+                    self.store.acquire(self.holder, self.tokens, self.ttl)
+            except Exception as e:
+                self.logger.warning(f"Unable to renew the license lease {self.holder}: {e}")
+
+    def release(self):
+        """
+        Release the token, nothing is done in a forked process that inherited the lease
+        """
+        if not self.is_held():
+            return
+        self.pid = None
+        self.stop_event.set()
+        try:
+            self.store.release(self.holder)
+            self.logger.info(f"License lease {self.holder} released")
+        except Exception as e:
+            self.logger.warning(f"Unable to release the license lease {self.holder}: {e}")
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import time
+import socket
+import threading
+from kombu.utils.json import dumps, loads
+from .share import get_logger
+from .priority import get_priority_queue_names
+from .settings import task_expire
+import pixyz_worker.config
+
+__all__ = ['HostAffinity', 'get_host_queue', 'get_generic_queue', 'get_worker_queue_names']
+
+
+def get_host_queue(queue, host=None):
+    """
+    The queue of a host, consumed only by the workers of this host (ex: gpu@node1)
+    """
+    return f"{queue}@{host or socket.gethostname()}"
+
+
+def get_generic_queue(queue):
+    """
+    The queue of a host queue (ex: gpu@node1 -> gpu)
+    """
+    return queue.split('@', 1)[0] if queue else queue
+
+
+def get_worker_queues():
+    return [queue.strip() for queue in pixyz_worker.config.queue_name.split(',') if queue.strip()]
+
+
+def get_worker_queue_names():
+    """
+    The queues consumed by the worker (-Q): the configured queues and their host queues
+    """
+    queues = get_worker_queues()
+    if HostAffinity.is_enabled():
+        queues += [get_host_queue(queue) for queue in queues]
+    return ','.join(queues)
+
+
+class HostAffinity(threading.Thread):
+    """
+    Send a task to the host of its parent if a worker of this host takes it in time, to the generic queue otherwise
+
+    The task is sent to the host queue (ex: gpu@node1) and registered in the broker:
+        - pixyz-host-affinity: sorted set of the waiting tasks ({'id', 'queue', 'fallback'}) scored by their deadline
+        - pixyz-locality-<parent_id>: (result backend) the number of subtasks sent with an affinity and of the ones
+          that ran on the host of their parent
+    Every second, one worker moves the tasks still waiting after their deadline to the generic queue (ex: gpu), they
+    are served first in their priority level.
+    """
+    key = 'pixyz-host-affinity'
+    lock_key = 'pixyz-host-affinity-lock'
+    stats_prefix = 'pixyz-locality-'
+
+    def __init__(self, app, interval=1.0):
+        super(HostAffinity, self).__init__(name='PixyzHostAffinity', daemon=True)
+        self.app = app
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.logger = get_logger('pixyz_worker.locality.HostAffinity')
+
+    @staticmethod
+    def is_enabled():
+        return pixyz_worker.config.host_queues
+
+    @classmethod
+    def request(cls, app, task_id, queue, timeout, parent_id=None):
+        """
+        Register a task sent to the host queue of the current host
+        :param queue: the generic queue of the task
+        :param timeout: the maximal wait in seconds before the task is sent to the generic queue
+        :return: the affinity of the task (host, queue, deadline, parent)
+        """
+        affinity = {'host': socket.gethostname(), 'queue': queue, 'deadline': time.time() + timeout,
+                    'parent': parent_id}
+        with app.pool.acquire(block=True) as conn:
+            member = dumps({'id': task_id, 'queue': get_host_queue(queue), 'fallback': queue})
+            conn.default_channel.client.zadd(cls.key, {member: affinity['deadline']})
+        if parent_id is not None:
+            try:
+                client = app.backend.client
+                client.hincrby(f"{cls.stats_prefix}{parent_id}", 'requested', 1)
+                client.expire(f"{cls.stats_prefix}{parent_id}", task_expire)
+            except Exception as e:
+                get_logger('pixyz_worker.locality').warning(f"Unable to count the affinity of {task_id}: {e}")
+        return affinity
+
+    @classmethod
+    def report(cls, app, affinity, queue):
+        """
+        Record where a task with an affinity runs
+        :param queue: the queue the task has been received from
+        :return: the locality of the task, stored in its meta
+        """
+        hit = queue == get_host_queue(affinity['queue'], affinity['host'])
+        if affinity.get('parent') is not None and hit:
+            try:
+                app.backend.client.hincrby(f"{cls.stats_prefix}{affinity['parent']}", 'hits', 1)
+            except Exception as e:
+                get_logger('pixyz_worker.locality').warning(f"Unable to count the locality hit: {e}")
+        return {'host': affinity['host'], 'hit': hit}
+
+    @classmethod
+    def get_stats(cls, app, parent_id):
+        """
+        :return: the locality of the subtasks of a task (requested, hits, rate), None without affinity
+        """
+        stats = app.backend.client.hgetall(f"{cls.stats_prefix}{parent_id}")
+        if not stats:
+            return None
+        requested = int(stats.get(b'requested', 0))
+        hits = int(stats.get(b'hits', 0))
+        return {'requested': requested, 'hits': hits, 'rate': hits / requested if requested else None}
+
+    @staticmethod
+    def move(client, task_id, queue, fallback):
+        """
+        Move a waiting task from a host queue to its generic queue
+        :return: False if the task is no more waiting (taken by a worker of the host)
+        """
+        for name, fallback_name in zip(get_priority_queue_names(queue), get_priority_queue_names(fallback)):
+            for payload in client.lrange(name, 0, -1):
+                message = loads(payload)
+                if message.get('headers', {}).get('id') != task_id:
+                    continue
+                # Removed atomically: the task may be taken in the meantime
+                if not client.lrem(name, 1, payload):
+                    return False
+                message['properties']['delivery_info'].update(exchange=fallback, routing_key=fallback)
+                # The oldest task of the level, it has already waited
+                client.rpush(fallback_name, dumps(message))
+                return True
+        return False
+
+    def fallback(self, client):
+        """
+        :return: the number of tasks moved to their generic queue
+        """
+        if not client.set(self.lock_key, 1, nx=True, px=int(self.interval * 1000)):
+            return 0
+        moved = 0
+        for member in client.zrangebyscore(self.key, '-inf', time.time()):
+            if not client.zrem(self.key, member):
+                continue
+            waiting = loads(member)
+            if self.move(client, waiting['id'], waiting['queue'], waiting['fallback']):
+                moved += 1
+        return moved
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                with self.app.pool.acquire(block=True) as conn:
+                    moved = self.fallback(conn.default_channel.client)
+                if moved:
+                    self.logger.info(f"{moved} tasks not taken by the host of their parent sent to their queue")
+            except Exception as e:
+                self.logger.warning(f"Unable to send the waiting tasks to their queue: {e}")
+
+    def stop(self):
+        self.stop_event.set()
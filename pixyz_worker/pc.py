@@ -6,6 +6,7 @@ import logging
 from datetime import datetime
 from pixyz_worker.exception import *
 import os
+import uuid
 from kombu.utils.json import register_type
 
 
@@ -53,6 +54,16 @@ class ProgramContext(dict):
         else:
             pass
 
+    def progress_flush(self):
+        if 'progress' in self:
+            self['progress'].flush()
+        else:
+            pass
+
+    def progress_store(self, **kwargs):
+        if 'progress' in self:
+            self['progress'].store(**kwargs)
+
     def progress_output(self, ret):
         if 'progress' in self and self['raw'] is False:
             return self['progress'].output(ret)
@@ -69,6 +80,9 @@ class ProgramContext(dict):
         # task is not json serializable and it must be removed
         if 'task' in pc:
             del pc['task']
+        # The artifacts and the affinity belong to the task
+        pc.pop('artifacts', None)
+        pc.pop('affinity', None)
 
         return pc
 
@@ -166,6 +180,38 @@ class ProgramContext(dict):
             from celery.result import allow_join_result
             return allow_join_result()
 
+    def get_stage_results(self, stage: str):
+        """
+        Get the results of a stage of the multi-stage job (one per task), the stage must be in `depends_on`
+        """
+        if not self.get('dag') or stage not in self['dag']['depends']:
+            raise ValueError(f"The task does not depend on the stage '{stage}'")
+        from celery.result import AsyncResult
+        return [AsyncResult(task_id).result for task_id in self['dag']['depends'][stage]]
+
+    def put_artifact(self, name: str, path: str):
+        """
+        Store an intermediate file for the next task of the chain, on the local disk of the worker when possible (the
+        next task is then sent to this host, see ArtifactCache). The file is moved.
+        :return: the artifact to give to the next task (ex: in the returned params), see `get_artifact`
+        """
+        if self.is_local():
+            return {'name': name, 'path': path}
+        from pixyz_worker.artifacts import ArtifactCache
+        artifact = ArtifactCache().put(self['progress'].task_id, name, path)
+        self.setdefault('artifacts', []).append(artifact)
+        self.progress_store(artifacts=self['artifacts'])
+        return artifact
+
+    def get_artifact(self, artifact: dict):
+        """
+        Get the path of an artifact stored by a previous task with `put_artifact`
+        """
+        if 'path' in artifact:
+            return artifact['path']
+        from pixyz_worker.artifacts import ArtifactCache
+        return ArtifactCache().get(artifact)
+
     def execute(self, params=None, **kwargs):
         if self.is_local():
             self.logger.debug("Creating a LOCAL task")
@@ -174,7 +220,23 @@ class ProgramContext(dict):
         else:
             self.logger.debug("Creating a REMOTE task")
             from pixyz_worker.tasks import pixyz_execute
+            from pixyz_worker.priority import get_priority
+            from pixyz_worker.locality import HostAffinity, get_host_queue
+            import pixyz_worker.config
             pc = self.clone()
+            # A subtask of a stage has its own outputs
+            pc.pop('dag', None)
+            # A subtask inherits the priority of its job
+            kwargs['priority'] = get_priority(kwargs.get('priority', self.get('priority')))
+            # Same host as the parent if a worker of the host takes it within `affinity` seconds
+            affinity = kwargs.pop('affinity', pixyz_worker.config.host_affinity_timeout)
+            if affinity and HostAffinity.is_enabled():
+                kwargs.setdefault('task_id', str(uuid.uuid4()))
+                queue = kwargs.get('queue') or pixyz_execute.queue
+                parent_id = self['progress'].task_id if 'progress' in self else None
+                pc['affinity'] = HostAffinity.request(pixyz_execute.app, kwargs['task_id'], queue, affinity,
+                                                      parent_id)
+                kwargs['queue'] = get_host_queue(queue)
             return pixyz_execute.apply_async(args=(params, pc), **kwargs)
 
 
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import threading
+from .share import get_logger
+import pixyz_worker.config
+
+__all__ = ['get_priority', 'get_priority_queue_names', 'PriorityAging']
+
+# Separator of the queue name and the priority in the name of the Redis list of a priority (kombu default)
+priority_separator = '\x06\x16'
+
+
+def get_priority(value=None):
+    """
+    Get the broker priority of a job (Redis: 0 is served first)
+    :param value: a level name of `config.job_priorities` (ex: high, normal, low), a priority (0-9) or None (default)
+    :raise ValueError: unknown level or priority
+    """
+    if value is None:
+        value = pixyz_worker.config.job_default_priority
+    if isinstance(value, str) and not value.isdigit():
+        try:
+            return pixyz_worker.config.job_priorities[value.lower()]
+        except KeyError:
+            raise ValueError(f"Unknown priority '{value}', expected one of "
+                             f"{', '.join(pixyz_worker.config.job_priorities)} or 0-9")
+    if not 0 <= int(value) <= 9:
+        raise ValueError(f"Invalid priority {value}, expected 0-9")
+    return int(value)
+
+
+def get_priority_queue_names(queue):
+    """
+    The Redis lists of a queue, one per priority level, from the first served to the last one
+    """
+    return [queue if priority == 0 else f"{queue}{priority_separator}{priority}"
+            for priority in get_priority_steps()]
+
+
+def get_priority_steps():
+    return sorted(set(pixyz_worker.config.job_priorities.values()) | {0})
+
+
+class PriorityAging(threading.Thread):
+    """
+    Promote the waiting jobs of the lower priorities so that they always make progress
+
+    The Redis transport serves the levels of a queue in strict order: a low priority job waits as long as a job of a
+    higher level is waiting. Every `config.priority_aging_interval` seconds, the oldest job of each level is moved to
+    the end of the level above. Only one worker promotes the jobs of a queue per interval (lock in the broker).
+    """
+    lock_prefix = 'pixyz-priority-aging-'
+
+    def __init__(self, app, queues, interval=None):
+        super(PriorityAging, self).__init__(name='PixyzPriorityAging', daemon=True)
+        self.app = app
+        self.queues = queues
+        self.interval = pixyz_worker.config.priority_aging_interval if interval is None else interval
+        self.stop_event = threading.Event()
+        self.logger = get_logger('pixyz_worker.priority.PriorityAging')
+
+    @staticmethod
+    def is_enabled():
+        return pixyz_worker.config.priority_aging_interval > 0
+
+    def promote(self, client):
+        """
+        :return: the number of promoted jobs
+        """
+        promoted = 0
+        for queue in self.queues:
+            if not client.set(f"{self.lock_prefix}{queue}", 1, nx=True, px=int(self.interval * 1000)):
+                continue
+            names = get_priority_queue_names(queue)
+            # From the highest level: a job is promoted once per interval
+            for higher, lower in zip(names, names[1:]):
+                if client.rpoplpush(lower, higher) is not None:
+                    promoted += 1
+        return promoted
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                with self.app.pool.acquire(block=True) as conn:
+                    promoted = self.promote(conn.default_channel.client)
+                if promoted:
+                    self.logger.debug(f"{promoted} waiting jobs promoted to a higher priority")
+            except Exception as e:
+                self.logger.warning(f"Unable to promote the waiting jobs: {e}")
+
+    def stop(self):
+        self.stop_event.set()
@@ -2,11 +2,14 @@
 # -*- coding: utf-8 -*-
 import time
 import os
+import threading
 from celery import Celery
 from typing import List
 from datetime import datetime, timezone
 from .share import get_logger
+from .events import JobEvents
 from kombu.utils.json import register_type
+import pixyz_worker.config
 
 app = Celery()
 app.config_from_object('pixyz_worker.settings')
@@ -36,6 +39,13 @@ class CeleryAppSerializer(object):
 
 
 class TaskProgress(ProgressCallBack):
+    """
+    Task progress stored in the task meta
+
+    The meta is kept in memory and written to the backend asynchronously: the writes are coalesced to at most one
+    every `config.progress_flush_interval` seconds, and `stop()` always flushes synchronously.
+    Each write is also published on the job events channel for the API subscribers (see `JobEvents`).
+    """
     def __init__(self, celery_self, task_id, step_total=1, time_request=None):
         self.celery_self = celery_self
         self.retry_count = 0  # number of retries
@@ -49,7 +59,36 @@ class TaskProgress(ProgressCallBack):
         self.time_started = datetime.now(timezone.utc)
         self.time_stopped = None
         self.step_start_time = None
+
+        self.flush_interval = pixyz_worker.config.progress_flush_interval
+        self.closed = False
+        self.dirty = False
+        self.last_flush = 0
+        self.init_flush_state()
+        # Only read once, the meta may already contain data from the task itself (ex: shadow_name)
+        self.meta = self._get_task_meta()
         self.start()
+
+    def init_flush_state(self):
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.timer = None
+
+    def check_owner(self):
+        # After a fork, locks and timer belong to the parent process
+        if self.pid != os.getpid():
+            self.init_flush_state()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ('lock', 'flush_lock', 'timer'):
+            del state[key]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.init_flush_state()
     
     @property
     def step_total(self):
@@ -93,6 +132,12 @@ class TaskProgress(ProgressCallBack):
         self.time_request = progress.time_request
         self.time_started = progress.time_started
         self.time_stopped = progress.time_stopped
+        # Keep the meta written by the sandbox process
+        if getattr(progress, 'meta', None):
+            self.check_owner()
+            with self.lock:
+                self.meta.update(progress.meta)
+                self.dirty = True
 
     # Create TaskProgress Object
     @staticmethod
@@ -140,10 +185,11 @@ class TaskProgress(ProgressCallBack):
             self.step_start_time = current_time
             self.step_infos.append({'duration': -1, 'info': step_info})
 
-        # save task state
-        self.store(progress=self.percent, steps=self.step_infos)
+        # save task state (copy because the steps are still updated while an asynchronous flush is running)
+        self.store(progress=self.percent, steps=[dict(step) for step in self.step_infos])
 
     def start(self):
+        self.closed = False
         self.time_started = datetime.now(timezone.utc)
         self.store(time_info=self.get_time_info())
 
@@ -183,18 +229,65 @@ class TaskProgress(ProgressCallBack):
     def output(self, output: None):
         return self.store(result=output)
 
-    # grab the task state meta and update it with the new values (formerly `update_task_state_meta`)
+    # update the in-memory task state meta with the new values and plan a write (formerly `update_task_state_meta`)
     def store(self, **kwargs):
-        meta = self._get_task_meta()
-
-        if meta is not None:
+        self.check_owner()
+        with self.lock:
             if len(kwargs) > 0:
-                meta.update(**kwargs)
-                ##DEBUG## logger.info(f"NEW TASK META: {meta}")
-                if self.celery_self is not None:
-                    self.celery_self.update_state(task_id=self.task_id, state='RUNNING', meta=meta)
-            return meta
-        return {}
+                self.meta.update(**kwargs)
+                self.dirty = True
+            meta = dict(self.meta)
+
+        # After stop, the meta is returned as the task result, a late write would overwrite the final state
+        if len(kwargs) > 0 and not self.closed:
+            self.schedule_flush()
+        return meta
+
+    def schedule_flush(self):
+        if self.celery_self is None:
+            return
+        if self.flush_interval <= 0:
+            self.flush()
+            return
+        with self.lock:
+            if self.timer is not None:
+                # A write is already planned, it will take this update
+                return
+            delay = max(0.0, self.last_flush + self.flush_interval - time.monotonic())
+            self.timer = threading.Timer(delay, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush(self):
+        """
+        Write the in-memory meta to the backend now if it has changed
+        """
+        self.check_owner()
+        with self.flush_lock:
+            with self.lock:
+                if self.timer is not None and self.timer is not threading.current_thread():
+                    self.timer.cancel()
+                self.timer = None
+                if not self.dirty or self.celery_self is None:
+                    return
+                meta = dict(self.meta)
+                self.dirty = False
+            ##DEBUG## logger.info(f"NEW TASK META: {meta}")
+            try:
+                self.celery_self.update_state(task_id=self.task_id, state='RUNNING', meta=meta)
+            except Exception as e:
+                logger.warning(f"Unable to write the progress of task {self.task_id}: {e}")
+                with self.lock:
+                    self.dirty = True
+            else:
+                self.publish(meta)
+            self.last_flush = time.monotonic()
+
+    def publish(self, meta):
+        # Only the redis backend supports pub/sub
+        client = getattr(self.celery_self.backend, 'client', None)
+        if client is not None:
+            JobEvents(client).publish(self.task_id, 'RUNNING', meta)
 
     def retry(self, retry_count=None):
         self.retry_count = retry_count if retry_count is not None else self.retry_count + 1
@@ -236,7 +329,9 @@ class TaskProgress(ProgressCallBack):
         # save last step timing and time_stopped
         self._add_step_info("end")
         self.time_stopped = datetime.now(timezone.utc)
+        self.closed = True
         self.store(time_info=self.get_time_info(), progress=100, **kwargs) # TODO: les 2 passent; le progress reste, pas le time_info # TRISTESSE
+        self.flush()
         
         
 ## To use inception inside inception, you must serialize celery conf and the Settings class itself
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import time
+import uuid
+import json
+import shutil
+import hashlib
+from kombu.utils.json import dumps, loads
+from .share import get_logger, get_job_share_dir, get_job_output_dir, cleanup_data_after_timeout
+from .settings import task_expire
+import pixyz_worker.config
+
+__all__ = ['ResultCache']
+
+
+class ResultCache(object):
+    """
+    Cache of the successful job results of the deterministic processes, stored in the shared storage
+
+    A result is identified by the sha256 of the input content, of the process script, the canonical JSON of the
+    params, the entrypoint, the job config that changes the outputs (root file, compute only) and the scheduler
+    version. The cached outputs are hard links of the job outputs:
+        - {share}/results/<key>/outputs: the outputs
+        - {share}/results/<key>/result.json: the task result and the id of the job that computed it
+    The result backend (Redis) keeps the usage of the results to evict the least recently used ones:
+        - pixyz-results-lru: sorted set of the keys scored by their last use time
+        - pixyz-results-size: hash of the size in bytes of each result
+        - pixyz-results-job-<uuid>: the key of a job to cache when it succeeds
+    """
+    prefix = 'pixyz-results-'
+    dirname = 'results'
+
+    def __init__(self, client, capacity=None, expire=task_expire):
+        self.client = client
+        self.capacity = pixyz_worker.config.result_cache_size if capacity is None else capacity
+        self.expire = expire
+        self.logger = get_logger('pixyz_worker.resultcache.ResultCache')
+
+    @staticmethod
+    def is_enabled():
+        return pixyz_worker.config.result_cache_size > 0
+
+    @staticmethod
+    def compute_key(input_sha256, script_path, params, entrypoint='main', root_file=None, compute_only=False):
+        """
+        Compute the key of a job result
+        :param input_sha256: the sha256 of the input content (None without input)
+        :param script_path: the process script path
+        :param params: the process params (JSON serializable)
+        :param entrypoint: the script entrypoint
+        :param root_file: the root file in the input archive (None to detect it)
+        :param compute_only: True if the job does not write its outputs
+        """
+        script_sha256 = hashlib.sha256()
+        with open(script_path, 'rb') as f:
+            while content := f.read(1024 * 1024):
+                script_sha256.update(content)
+        key = hashlib.sha256()
+        for value in (input_sha256 or '', script_sha256.hexdigest(),
+                      json.dumps(params, sort_keys=True, separators=(',', ':')), entrypoint, root_file or '',
+                      str(bool(compute_only)), pixyz_worker.config.version):
+            key.update(value.encode('utf-8'))
+            key.update(b'\0')
+        return key.hexdigest()
+
+    def get_result_dir(self, key):
+        return os.path.join(pixyz_worker.config.share_dir, self.dirname, key)
+
+    def register(self, job_id, key):
+        """
+        Cache the result of a job when it succeeds
+        """
+        self.client.set(f"{self.prefix}job-{job_id}", key, ex=self.expire)
+
+    def store(self, job_id, result):
+        """
+        Cache the outputs and the result of a successful job registered with `register`
+        :return: True if the result has been cached by this call
+        """
+        key = self.client.get(f"{self.prefix}job-{job_id}")
+        if key is None:
+            return False
+        key = key.decode('utf-8')
+        self.client.delete(f"{self.prefix}job-{job_id}")
+        if self.client.zscore(f"{self.prefix}lru", key) is not None:
+            return False
+
+        result_dir = self.get_result_dir(key)
+        tmp_dir = os.path.join(pixyz_worker.config.share_dir, self.dirname, f"tmp-{uuid.uuid4()}")
+        size = 0
+        try:
+            output_dir = get_job_output_dir(job_id)
+            for root, dirs, files in os.walk(output_dir):
+                cache_root = os.path.join(tmp_dir, 'outputs', os.path.relpath(root, output_dir))
+                os.makedirs(cache_root, exist_ok=True)
+                for file in files:
+                    os.link(os.path.join(root, file), os.path.join(cache_root, file))
+                    size += os.path.getsize(os.path.join(root, file))
+            with open(os.path.join(tmp_dir, 'result.json'), 'w') as f:
+                f.write(dumps({'job_id': job_id, 'result': result}))
+            # Another worker may have cached the same result
+            os.rename(tmp_dir, result_dir)
+        except OSError as e:
+            self.logger.warning(f"Unable to cache the result of job {job_id}: {e}")
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return False
+
+        with self.client.pipeline() as pipe:
+            pipe.zadd(f"{self.prefix}lru", {key: time.time()})
+            pipe.hset(f"{self.prefix}size", key, size)
+            pipe.execute()
+        self.logger.info(f"Result of job {job_id} cached ({size} bytes)")
+        self.evict()
+        return True
+
+    def materialize(self, key, job_id):
+        """
+        Copy a cached result to a new job: the outputs are hard linked in the job output directory
+        :return: the task result of the new job, None if the result is not cached
+        """
+        if self.client.zscore(f"{self.prefix}lru", key) is None:
+            return None
+        result_dir = self.get_result_dir(key)
+        output_dir = get_job_output_dir(job_id)
+        try:
+            with open(os.path.join(result_dir, 'result.json')) as f:
+                cached = loads(f.read())
+            cached_output_dir = os.path.join(result_dir, 'outputs')
+            for root, dirs, files in os.walk(cached_output_dir):
+                job_root = os.path.join(output_dir, os.path.relpath(root, cached_output_dir))
+                os.makedirs(job_root, exist_ok=True)
+                for file in files:
+                    os.link(os.path.join(root, file), os.path.join(job_root, file))
+        except OSError as e:
+            # Evicted in the meantime
+            self.logger.warning(f"Unable to reuse the cached result {key}: {e}")
+            shutil.rmtree(output_dir, ignore_errors=True)
+            return None
+        # Like a job run by a worker (StorageOutputManager), the job directory is removed after the cleanup delay
+        cleanup_data_after_timeout(get_job_share_dir(job_id), is_directory=True)
+
+        self.client.zadd(f"{self.prefix}lru", {key: time.time()})
+        return self.replace_paths(cached['result'], get_job_share_dir(cached['job_id']), get_job_share_dir(job_id))
+
+    def evict(self):
+        """
+        Remove the least recently used results until the cache fits in its capacity
+        """
+        sizes = self.client.hgetall(f"{self.prefix}size")
+        total = sum(int(size) for size in sizes.values())
+        while total > self.capacity:
+            oldest = self.client.zrange(f"{self.prefix}lru", 0, 0)
+            if not oldest:
+                break
+            key = oldest[0].decode('utf-8')
+            with self.client.pipeline() as pipe:
+                pipe.zrem(f"{self.prefix}lru", key)
+                pipe.hdel(f"{self.prefix}size", key)
+                pipe.execute()
+            total -= int(sizes.get(oldest[0], 0))
+            shutil.rmtree(self.get_result_dir(key), ignore_errors=True)
+            self.logger.info(f"Cached result {key} evicted")
+
+    @classmethod
+    def replace_paths(cls, value, old, new):
+        if isinstance(value, str):
+            return new + value[len(old):] if value.startswith(old) else value
+        if isinstance(value, dict):
+            return {k: cls.replace_paths(v, old, new) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [cls.replace_paths(v, old, new) for v in value]
+        return value
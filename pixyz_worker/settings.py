@@ -5,6 +5,7 @@ from kombu import Queue, Exchange
 from os import environ
 from .share import get_logger
 from .config import debug
+from .priority import get_priority, get_priority_steps, priority_separator
 import os
 logger = get_logger('pixyz_worker.settings')
 
@@ -89,6 +90,10 @@ task_queues = (
     Queue('cpu', Exchange('cpu'), routing_key='cpu'),
 )
 
+# Priority levels of the jobs: one Redis list per level and queue (see pixyz_worker.priority)
+broker_transport_options = {'priority_steps': get_priority_steps(), 'sep': priority_separator}
+task_default_priority = get_priority()
+
 # default queue
 task_default_queue = 'cpu'
 task_default_exchange = 'cpu'
@@ -5,6 +5,8 @@ import os
 import sys
 import uuid
 import ast
+import json
+import hashlib
 
 import logging
 import shutil
@@ -16,12 +18,16 @@ import time
 from pixyz_worker.license import License
 
 __all__ = ['get_logger', 'cleanup_data_after_timeout',
-           'move_file_as_result_to_shared_storage', 'get_first_3D_files_in_directory',
+           'move_file_as_result_to_shared_storage', 'is_3D_file', 'get_root_3D_file',
+           'get_first_3D_files_in_directory',
            'get_filename_from_url', 'download_file', 'each',
            'get_job_output_dir', 'TaskInfos', 'is_a_valid_job_id_directory', 'is_job_in_share', 'is_path_in_share',
            'is_job_in_share', 'get_job_share_dir', 'get_job_share_file_path', 'get_job_input_dir',
            'get_job_output_dir', 'get_job_input_dir_content', 'get_job_output_dir_content', 'get_job_input_file_path',
-           'get_job_output_file_path', 'get_job_archive_file_path', 'PiXYZSession'
+           'get_job_output_file_path', 'get_job_archive_file_path', 'is_valid_sha256', 'get_blob_path',
+           'get_blob_tmp_path', 'store_blob', 'link_blob_to_job_input', 'release_blob', 'create_upload', 'get_upload',
+           'get_upload_data_path', 'get_upload_chunk_range', 'set_upload_chunk_received', 'commit_upload',
+           'delete_upload', 'PiXYZSession'
            ]
 
 
@@ -71,6 +77,13 @@ logger = get_logger('pixyz_worker.share')
 job_input_dirname = 'inputs'
 job_output_dirname = 'outputs'
 job_archive_directory = 'archives'
+blob_dirname = 'blobs'
+upload_dirname = 'uploads'
+# Chunk size bounds of the upload sessions
+upload_min_chunk_size = 1024 * 1024
+upload_default_chunk_size = 16 * 1024 * 1024
+upload_max_chunk_size = 512 * 1024 * 1024
+upload_max_chunks = 10000
 
 
 def is_valid_jobid(job_id):
@@ -256,6 +269,233 @@ def get_job_archive_file_path(job_id, file_name, check_if_exists=False):
 
 
 
+########################################################################################
+##                                 BLOB STORE                                         ##
+########################################################################################
+
+# The uploaded inputs are stored once in {share}/blobs/<sha256[:2]>/<sha256> and hard linked in the job inputs.
+# The link count of a blob is its reference count: 1 means that no job input uses it anymore.
+
+def is_valid_sha256(sha256):
+    from re import match
+    return isinstance(sha256, str) and match(r'^[0-9a-f]{64}$', sha256) is not None
+
+
+def get_blob_path(sha256, check_if_exists=False):
+    """
+    Return the full path of a blob in the shared storage
+    :param sha256: the hex sha256 of the blob content
+    :param check_if_exists: if `True`, check that the blob exists
+    :raises: SharePathInvalidError if the hash is invalid
+    :raises: SharePathNotFoundError if the blob is not found
+    """
+    if not is_valid_sha256(sha256):
+        raise SharePathInvalidError(f"Invalid sha256 '{sha256}'")
+    blob_path = os.path.join(pixyz_worker.config.share_dir, blob_dirname, sha256[:2], sha256)
+    if check_if_exists and not os.path.isfile(blob_path):
+        raise SharePathNotFoundError(f"Blob '{sha256}' not found")
+    return blob_path
+
+
+def get_blob_tmp_path():
+    """
+    Return a new temporary path in the blob store, on the same file system as the blobs to be renamed
+    """
+    tmp_dir = os.path.join(pixyz_worker.config.share_dir, blob_dirname, 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    return os.path.join(tmp_dir, str(uuid.uuid4()))
+
+
+def store_blob(tmp_path, sha256):
+    """
+    Move a temporary file to the blob store, the file is removed if the blob already exists
+    A blob is read-only: it is hard linked in the inputs of several jobs and identified by its content
+    :return: the blob path
+    """
+    blob_path = get_blob_path(sha256)
+    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+    if os.path.exists(blob_path):
+        os.remove(tmp_path)
+    else:
+        os.chmod(tmp_path, 0o444)
+        os.replace(tmp_path, blob_path)
+    return blob_path
+
+
+def link_blob_to_job_input(sha256, job_id, file_name):
+    """
+    Add a blob in the inputs of a job (hard link, copy if the file system does not support it) and plan its cleanup
+    :return: the path of the job input file
+    :raises: SharePathNotFoundError if the blob is not found
+    """
+    blob_path = get_blob_path(sha256, check_if_exists=True)
+    input_path = get_job_input_file_path(job_id, os.path.basename(file_name))
+    try:
+        os.link(blob_path, input_path)
+    except FileNotFoundError:
+        # Released between the check and the link
+        raise SharePathNotFoundError(f"Blob '{sha256}' not found")
+    except OSError:
+        shutil.copyfile(blob_path, input_path)
+        os.chmod(input_path, 0o444)
+    cleanup_data_after_timeout(input_path, blob=sha256)
+    return input_path
+
+
+def release_blob(sha256):
+    """
+    Remove a blob if no job input uses it anymore
+    :return: True if the blob has been removed
+    """
+    blob_path = get_blob_path(sha256)
+    try:
+        if os.stat(blob_path).st_nlink > 1:
+            return False
+        logger.info(f"Removing unused blob {sha256}")
+        os.remove(blob_path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+# A large input can be uploaded by chunks, in parallel, to an upload session {share}/uploads/<uuid>:
+#     - session.json: the file size, the chunk size and the sha256 once committed
+#     - data: the file, preallocated, each chunk is written at its offset
+#     - chunks/<index>: marker of a completely received chunk
+# The committed file is moved to the blob store, the session keeps a link to the blob until its cleanup so that a
+# job can reference it with `file_sha256`.
+
+def get_upload_dir(upload_id, check_if_exists=True):
+    """
+    Return the directory of an upload session
+    :raises: SharePathInvalidError if the upload id is invalid
+    :raises: SharePathNotFoundError if the session is not found
+    """
+    if not is_valid_jobid(upload_id):
+        raise SharePathInvalidError(f"Invalid upload id '{upload_id}'")
+    upload_dir = os.path.join(pixyz_worker.config.share_dir, upload_dirname, upload_id)
+    if check_if_exists and not os.path.isfile(os.path.join(upload_dir, 'session.json')):
+        raise SharePathNotFoundError(f"Upload '{upload_id}' not found")
+    return upload_dir
+
+
+def get_upload_data_path(upload_id):
+    return os.path.join(get_upload_dir(upload_id), 'data')
+
+
+def create_upload(size, chunk_size):
+    """
+    Create an upload session of a file and plan its cleanup
+    :param size: the file size in bytes
+    :param chunk_size: the size of the chunks, the last one can be smaller
+    :return: the session infos (see `get_upload`)
+    :raises: SharePathInvalidError if the sizes are out of bounds
+    """
+    if size < 0 or not upload_min_chunk_size <= chunk_size <= upload_max_chunk_size:
+        raise SharePathInvalidError(f"Invalid upload size {size} or chunk size {chunk_size} "
+                                    f"({upload_min_chunk_size}-{upload_max_chunk_size})")
+    if -(-size // chunk_size) > upload_max_chunks:
+        raise SharePathInvalidError(f"Too many chunks, the chunk size must be at least {-(-size // upload_max_chunks)}")
+    upload_id = str(uuid.uuid4())
+    upload_dir = get_upload_dir(upload_id, check_if_exists=False)
+    os.makedirs(os.path.join(upload_dir, 'chunks'))
+    with open(os.path.join(upload_dir, 'data'), 'wb') as f:
+        f.truncate(size)
+    # Written last: the session exists once it is complete
+    with open(os.path.join(upload_dir, 'session.json'), 'w') as f:
+        json.dump({'size': size, 'chunk_size': chunk_size}, f)
+    cleanup_data_after_timeout(upload_dir, is_directory=True)
+    return get_upload(upload_id)
+
+
+def get_upload(upload_id):
+    """
+    Return the infos of an upload session: id, size, chunk_size, chunks (count), received (chunk indexes), sha256
+    :raises: SharePathNotFoundError if the session is not found
+    """
+    upload_dir = get_upload_dir(upload_id)
+    with open(os.path.join(upload_dir, 'session.json')) as f:
+        session = json.load(f)
+    chunks = max(-(-session['size'] // session['chunk_size']), 1)
+    try:
+        received = sorted(int(index) for index in os.listdir(os.path.join(upload_dir, 'chunks')))
+    except FileNotFoundError:
+        received = []
+    return {'id': upload_id, 'size': session['size'], 'chunk_size': session['chunk_size'], 'chunks': chunks,
+            'received': received, 'sha256': session.get('sha256')}
+
+
+def get_upload_chunk_range(upload, index):
+    """
+    Return the offset and the size of a chunk of an upload session
+    :raises: SharePathInvalidError if the index is out of the file
+    """
+    if not 0 <= index < upload['chunks']:
+        raise SharePathInvalidError(f"Invalid chunk index {index} (0-{upload['chunks'] - 1})")
+    offset = index * upload['chunk_size']
+    return offset, min(upload['chunk_size'], upload['size'] - offset)
+
+
+def set_upload_chunk_received(upload_id, index):
+    open(os.path.join(get_upload_dir(upload_id), 'chunks', str(index)), 'w').close()
+
+
+def commit_upload(upload_id, sha256):
+    """
+    Check the uploaded file and move it to the blob store
+    :param upload_id: the upload session id
+    :param sha256: the expected hex sha256 of the file
+    :return: the session infos with the sha256
+    :raises: SharePathInvalidError if chunks are missing or if the content does not match the sha256
+    """
+    upload = get_upload(upload_id)
+    if upload['sha256'] is not None:
+        if upload['sha256'] != sha256:
+            raise SharePathInvalidError(f"Upload '{upload_id}' already committed with another sha256")
+        return upload
+    if not is_valid_sha256(sha256):
+        raise SharePathInvalidError(f"Invalid sha256 '{sha256}'")
+    missing = sorted(set(range(upload['chunks'])) - set(upload['received']))
+    if upload['size'] > 0 and missing:
+        raise SharePathInvalidError(f"Upload '{upload_id}' is missing {len(missing)} chunk(s): {missing[:10]}")
+
+    upload_dir = get_upload_dir(upload_id)
+    data_path = os.path.join(upload_dir, 'data')
+    content_sha256 = hashlib.sha256()
+    with open(data_path, 'rb') as f:
+        while content := f.read(10 * 1024 * 1024):
+            content_sha256.update(content)
+    if content_sha256.hexdigest() != sha256:
+        raise SharePathInvalidError(f"Upload '{upload_id}' sha256 mismatch: received {content_sha256.hexdigest()}")
+
+    blob_path = store_blob(data_path, sha256)
+    # Reference of the blob until the session cleanup
+    blob_link = os.path.join(upload_dir, sha256)
+    try:
+        os.link(blob_path, blob_link)
+        cleanup_data_after_timeout(blob_link, blob=sha256)
+    except FileExistsError:
+        pass
+    except OSError:
+        logger.warning(f"Unable to reference blob {sha256} from upload '{upload_id}'")
+    with open(os.path.join(upload_dir, 'session.json'), 'w') as f:
+        json.dump({'size': upload['size'], 'chunk_size': upload['chunk_size'], 'sha256': sha256}, f)
+    logger.info(f"Upload '{upload_id}' committed as blob {sha256}")
+    return {**upload, 'sha256': sha256}
+
+
+def delete_upload(upload_id):
+    """
+    Abort an upload session, a committed blob stays in the blob store until its cleanup
+    """
+    upload_dir = get_upload_dir(upload_id)
+    upload = get_upload(upload_id)
+    if upload['sha256'] is not None and os.path.exists(os.path.join(upload_dir, upload['sha256'])):
+        os.remove(os.path.join(upload_dir, upload['sha256']))
+        release_blob(upload['sha256'])
+    shutil.rmtree(upload_dir, ignore_errors=True)
+
+
 # TODO: deprecated
 
 
@@ -296,11 +536,12 @@ def is_a_valid_job_id_directory(directory_path):
             match(r'.*[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$',
                   real_path_directory) is not None)
 
-def cleanup_data_after_timeout(file_name, is_directory=False):
+def cleanup_data_after_timeout(file_name, is_directory=False, blob=None):
     """
     Delete a file after a timeout
     :param file_name: file to delete
     :param is_directory: True if the file is a directory, False otherwise
+    :param blob: the sha256 of the blob linked by the file, released with its last reference
     :return: None
     """
     if not pixyz_worker.config.cleanup_enabled:
@@ -311,7 +552,10 @@ def cleanup_data_after_timeout(file_name, is_directory=False):
     inode_type = "directory" if is_directory else "file"
 
     logger.info(f"Scheduling a cleanup task for {inode_type} %s at %s", file_name, eta)
-    return cleanup_share_file.apply_async(args=[file_name], kwargs={'is_directory': is_directory}, eta=eta)
+    kwargs = {'is_directory': is_directory}
+    if blob is not None:
+        kwargs['blob'] = blob
+    return cleanup_share_file.apply_async(args=[file_name], kwargs=kwargs, eta=eta)
 
 
 def move_file_as_result_to_shared_storage(job_id, tmp_glb_file):
@@ -322,17 +566,74 @@ def move_file_as_result_to_shared_storage(job_id, tmp_glb_file):
     os.remove(tmp_glb_file)
 
 
+# Extensions of the 3D files supported by Pixyz, ranked as root file candidates of an archive:
+#   0: assemblies that reference the other files, 1: scenes and exchange formats, 2: parts,
+#   3: documents and point clouds (often shipped next to the model)
+file_3D_extension_ranks = {
+    extension: rank
+    for rank, extensions in enumerate(("""CATPRODUCT IAM SLDASM PLMXML ASM 3DXML NWD""",
+                                       """PXZ FBX GLTF GLB USD USDZ USDA USDC IFC RVT RFA VPB SKP 3DM RVM DWG DXF WRL
+                                       VRML 3DS U3D PRC IGS IGES STP STEP STPZ STEPZ STPX STPXZ JT VDA CSB PVS PVZ GDS
+                                       XAS XPR NWC RCP RCS WIRE ACIS""",
+                                       """CATPART CATSHAPE CGR IPT SLDPRT PRT PAR PSM PWD X_T X_B P_T P_B XMT XMT_TXT
+                                       XMT_BIN SAT SAB NEU OBJ STL""",
+                                       """PDF E57 PTS PTX"""))
+    for extension in extensions.split()
+}
+
+
+def get_3D_file_rank(file_name):
+    """
+    Return the rank of a file as root file candidate (0 is the best), None if it is not a 3D file
+    """
+    if file_name.startswith('._'):
+        # macOS resource forks
+        return None
+    return file_3D_extension_ranks.get(os.path.splitext(file_name)[1][1:].upper())
+
+
+def is_3D_file(file_name):
+    return get_3D_file_rank(file_name) is not None
+
+
+def get_root_3D_file(file_paths):
+    """
+    Return the root 3D file of a list of relative paths: the best ranked format, then the shallowest, then by name
+    """
+    best = None
+    for path in file_paths:
+        parts = path.replace(os.sep, '/').split('/')
+        rank = get_3D_file_rank(parts[-1])
+        if rank is not None and '__MACOSX' not in parts:
+            best = min(best or (rank, len(parts), path), (rank, len(parts), path))
+    return best[2] if best is not None else None
+
+
 def get_first_3D_files_in_directory(directory_path):
-    file_extensions = """PXZ 3DS ACIS SAT SAB DWG DXF WIRE FBX IPT IAM NWD NWC RVT RFA RCP RCS VPB CATPART
-                      CATPRODUCT CATSHAPE CGR 3DXML ASM NEU PRT XAS XPR PVS PVZ CSB GLTF GLB GDS IFC IGS
-                      IGES JT OBJ PRT X_B X_T P_T P_B XMT XMT_TXT XMT_BIN PDF PLMXML E57 PTS PTX PRC 3DM
-                      RVM SKP ASM PAR PWD PSM SLDASM SLDPRT STP STEP STPZ STEPZ STPX STPXZ STL U3D USD USD
-                      USDZ USDA USDC VDA WRL VRML""".split()
-    for root, dirs, files in os.walk(directory_path):
-        for file_name in files:
-            if file_name.upper().endswith(tuple(file_extensions)):
-                return os.path.join(root, file_name)
-    return None
+    """
+    Return the root 3D file of a directory (see `get_root_3D_file`)
+    The tree is scanned level by level and the scan stops after the first level with an assembly.
+    """
+    best = None
+    level = [directory_path]
+    depth = 0
+    while level:
+        next_level = []
+        for directory in level:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name != '__MACOSX':
+                            next_level.append(entry.path)
+                    else:
+                        rank = get_3D_file_rank(entry.name)
+                        if rank is not None:
+                            best = min(best or (rank, depth, entry.path), (rank, depth, entry.path))
+        if best is not None and best[0] == 0:
+            break
+        level = next_level
+        depth += 1
+    return best[2] if best is not None else None
 
 
 def get_filename_from_url(url):
@@ -362,36 +663,75 @@ def each(fn, items):
 
 class PiXYZSession(object):
     """
-    PiXYZ session class
+    PiXYZ session of a task
+
+    A worker process keeps one warm session between its tasks when the license is acquired at start or with
+    `config.session_keep_alive`, otherwise the session is initialized and released for each task.
+    With `config.license_tokens`, a session holds a license lease (see `LicenseLease`) from its initialization to its
+    release, the wait for the lease is stored with the durations.
+    The scene state of the process is tracked to skip the redundant resets: the scene is only reset after a task
+    that used it in this process (a task executed in a forked process leaves it clean), so a task always starts with
+    a clean scene. The durations of the session operations are stored in the task meta (`session`).
     """
+    # Session of the current process
+    initialized = False
+    clean = False
+    lease = None
+    lease_wait = None
 
-    def __init__(self, license:License):
+    def __init__(self, license:License, progress=None):
         self.license = license
+        self.progress = progress
+        self.timings = {}
 
     def __enter__(self):
-        self.initialize_at_start_if_needed(self.license)
+        self.timings = {'warm': PiXYZSession.initialized}
+        self.timings.update(self.initialize_at_start_if_needed(self.license))
+        self.store()
+        return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.release_at_shutdown_if_needed(self.license)
+        self.timings.update(self.release_at_shutdown_if_needed(self.license))
+        self.store()
+
+    def store(self):
+        if self.progress is not None:
+            self.progress.store(session=dict(self.timings))
+
+    @staticmethod
+    def is_kept_alive(license:License):
+        return license.is_acquire_at_start() or pixyz_worker.config.session_keep_alive
 
     @staticmethod
     def initialize_at_start_if_needed(license:License):
-        if license.is_acquire_at_start():
+        """
+        :return: the durations of the lease wait and of the initialization ({} if the session is already initialized)
+        """
+        if license.disable_pixyz or (license.is_acquire_at_start() and PiXYZSession.initialized):
             # License is already acquire at start-up
-            pass
-        else:
-            if not license.disable_pixyz:
-                PiXYZSession.initialize(True)
-
+            return {}
+        duration = PiXYZSession.initialize(True)
+        if duration is None:
+            return {}
+        if license.is_acquire_at_start():
+            # No lease was available when the worker process started
+            license.configure_license()
+        ret = {'initialize': duration}
+        if PiXYZSession.lease_wait is not None:
+            ret['lease_wait'] = PiXYZSession.lease_wait
+        return ret
 
     @staticmethod
     def release_at_shutdown_if_needed(license:License):
+        """
+        :return: the duration of the reset or of the release ({} if nothing has been done)
+        """
         if license.disable_pixyz:
-            return
-        if license.is_acquire_at_start():
-            PiXYZSession.reset()
-        else:
-            PiXYZSession.release()
+            return {}
+        if PiXYZSession.is_kept_alive(license):
+            duration = PiXYZSession.reset()
+            return {'reset': duration} if duration is not None else {}
+        return {'release': PiXYZSession.release()}
 
     @staticmethod
     def initialize_import():
@@ -402,7 +742,18 @@ class PiXYZSession(object):
 
 
     @staticmethod
-    def initialize(mandatory=False):
+    def initialize(mandatory=False, blocking=True):
+        """
+        Initialize the pixyz session of the process, nothing is done if it is already initialized
+        :param blocking: False to give up if no license lease is available
+        :return: the duration in seconds (without the lease wait), None if nothing has been initialized
+        """
+        if PiXYZSession.initialized:
+            return None
+        PiXYZSession.lease_wait = None
+        if PiXYZSession.acquire_lease(blocking) is None:
+            return None
+        start = time.perf_counter()
         try:
             if os.getenv('PIXYZ_PYTHON_PATH', None) is not None:
                 if not os.path.exists(os.getenv('PIXYZ_PYTHON_PATH')):
@@ -414,19 +765,49 @@ class PiXYZSession(object):
                 sys.path.append("/opt/pixyz")
 
             PiXYZSession.initialize_import()
+            PiXYZSession.initialized = True
+            PiXYZSession.clean = True
+            return time.perf_counter() - start
 
         except ImportError as e:
+            PiXYZSession.release_lease()
             if mandatory:
                 logger.fatal("PiXYZ module not found, cannot continue")
                 raise e
             else:
                 logger.warning("Pixyz module not found - Pixyz dataset optimization has been skipped...")
+        return None
+
+    @staticmethod
+    def acquire_lease(blocking=True):
+        """
+        Acquire a license lease for the session of the process if the license tokens are limited
+        :return: the wait in seconds (0 without limit), None if not blocking and no lease is available
+        """
+        from pixyz_worker.licenselease import LicenseLease
+        if not LicenseLease.is_enabled():
+            return 0
+        if PiXYZSession.lease is None or not PiXYZSession.lease.is_held():
+            # A forked process gets its own lease
+            PiXYZSession.lease = LicenseLease()
+        PiXYZSession.lease_wait = PiXYZSession.lease.acquire(blocking)
+        return PiXYZSession.lease_wait
+
+    @staticmethod
+    def release_lease():
+        if PiXYZSession.lease is not None:
+            PiXYZSession.lease.release()
+            PiXYZSession.lease = None
 
     @staticmethod
     def release():
         """
         Release the pixyz license
+        :return: the duration in seconds
         """
+        start = time.perf_counter()
+        PiXYZSession.initialized = False
+        PiXYZSession.clean = False
         try:
             import pxz
             # usefull?
@@ -435,20 +816,36 @@ class PiXYZSession(object):
             logger.info("Pixyz session released")
         except:
             logger.warning("Unable to release pixyz, probably unexpected license allocation")
+        PiXYZSession.release_lease()
+        return time.perf_counter() - start
+
+    @staticmethod
+    def mark_used():
+        """
+        A task is about to use the scene of this process
+        """
+        PiXYZSession.clean = False
 
     @staticmethod
     def reset():
         """
-        Reset the pixyz license
+        Reset the pixyz scene, nothing is done if no task used it since the last reset
+        :return: the duration in seconds, None if the scene is already clean
         """
+        if PiXYZSession.clean:
+            logger.debug("Pixyz scene already clean, reset skipped")
+            return None
+        start = time.perf_counter()
         try:
             import pxz
             #usefull?
             pxz.get_current_session()
             pxz.core.resetSession()
+            PiXYZSession.clean = True
             logger.info("Pixyz session reset")
         except:
             logger.warning("Unable to reset pixyz")
+        return time.perf_counter() - start
 
 
 class TaskInfos(dict):
@@ -483,31 +880,29 @@ def pixyz_schedule(**kwargs_):
 
     def decorator(f):
         def wrapper(*args, **kwargs):
-            ready_job = []
-
-            def process_job_list(pc_, r_):
-                for job_id in r_.as_list():
-                    if job_id in ready_job:
-                        continue
-                    task = AsyncResult(job_id)
-                    if isinstance(task, AsyncResult):
-                        if task.state in ('STARTED', 'RUNNING') or task.ready():
-                            #logger.debug(f"Task {task.id} finished in state {task.state}, result=" + str(task.result))
-                            pc_.progress_next(f"{task.id}", {'id': task.id, 'state': task.state, task.id: task.result})
-                            ready_job.append(job_id)
-                    else:
-                        logger.error(f"Task {task.id} not return a asyncresult")
-                time.sleep(0.1)
             from celery.result import AsyncResult
+            from .events import JobsTracker
             if 'wait' in kwargs_ and kwargs_['wait']:
                 timeout = kwargs_['timeout'] if 'timeout' in kwargs_ else None
                 r = f(*args, **kwargs)
                 if isinstance(r, AsyncResult):
                     pc = args[0]
-                    pc.progress_set_total(len(r.as_list()))
-                    while not r.ready():
-                        process_job_list(pc, r)
-                    process_job_list(pc, r)
+                    job_ids = r.as_list()
+                    pc.progress_set_total(len(job_ids))
+                    reported = set()
+                    start = time.perf_counter()
+                    with JobsTracker(r.backend, job_ids) as tracker:
+                        for job_id, state, result in tracker.changes(until=r.id, timeout=timeout):
+                            # One step per subtask, when it starts or ends
+                            if job_id not in reported and (state in ('STARTED', 'RUNNING') or
+                                                           tracker.is_ready(job_id)):
+                                pc.progress_next(f"{job_id}", {'id': job_id, 'state': state, job_id: result})
+                                reported.add(job_id)
+                    wait = {'subtasks': len(job_ids), 'backend_reads': tracker.backend_reads,
+                            'events': tracker.events, 'duration': time.perf_counter() - start}
+                    logger.debug(f"Subtasks waited: {wait}")
+                    if 'progress' in pc:
+                        pc['progress'].store(wait=wait)
                     with pc.allow_join_result():
                         return r.get(timeout=timeout)
                 else:
@@ -1,12 +1,22 @@
 # `after_task_publish` is available in celery 3.1+
 # for older versions use the deprecated `task_sent` signal
-from celery.signals import after_task_publish, task_prerun, task_postrun, worker_process_init, worker_process_shutdown, worker_shutting_down
+from celery.signals import after_task_publish, task_prerun, task_postrun, task_revoked, worker_process_init, worker_process_shutdown, worker_shutting_down, worker_ready
 from celery import current_app
 
 from .watchdog import *
 from .share import PiXYZSession,get_logger
 from .license import License
+from .extcode import SandboxPool
+from .jobindex import JobIndex
+from .events import JobEvents
+from .resultcache import ResultCache
+from .priority import PriorityAging
+from .locality import HostAffinity, get_generic_queue
+from .dag import JobGraph
+from .durations import DurationModel
+import pixyz_worker.config
 from datetime import datetime
+import time
 import sys
 license_ = License.from_config()
 
@@ -21,14 +31,59 @@ def setup_celery_worker(sender, **kwargs):
     logger = get_logger('pixyz_worker.signals')
     try:
         if license_.is_acquire_at_start():
-            PiXYZSession.initialize(mandatory=True)
-            license_.configure_license()
+            # Don't block the start of the process: without a free license lease, the first task waits for it
+            if PiXYZSession.initialize(mandatory=True, blocking=False) is not None:
+                license_.configure_license()
+            else:
+                logger.info("No license lease available, the pixyz session will be initialized by the first task")
     except RuntimeError:
         logger.fatal("License server not found, invalid or no license available")
         current_app.control.broadcast('shutdown')
         sys.exit(100)
 
 
+def prefork_sandbox_pool():
+    if SandboxPool.is_enabled():
+        logger = get_logger('pixyz_worker.signals')
+        logger.info("Pre-forking sandbox processes...")
+        SandboxPool.get_instance().prefork()
+
+
+@worker_process_init.connect
+def prefork_process_sandbox_pool(sender, **kwargs):
+    # prefork pool: the sandboxes belong to the child process that executes the tasks
+    prefork_sandbox_pool()
+
+
+@worker_ready.connect
+def prefork_worker_sandbox_pool(sender, **kwargs):
+    # solo/threads pool: the tasks are executed by the worker process itself
+    if pixyz_worker.config.pool_type != 'prefork':
+        prefork_sandbox_pool()
+
+
+priority_aging = None
+
+
+@worker_ready.connect
+def start_priority_aging(sender, **kwargs):
+    global priority_aging
+    if PriorityAging.is_enabled():
+        priority_aging = PriorityAging(current_app, [queue.strip() for queue in pixyz_worker.config.queue_name.split(',')])
+        priority_aging.start()
+
+
+host_affinity = None
+
+
+@worker_ready.connect
+def start_host_affinity(sender, **kwargs):
+    global host_affinity
+    if HostAffinity.is_enabled():
+        host_affinity = HostAffinity(current_app)
+        host_affinity.start()
+
+
 @worker_process_shutdown.connect
 def teardown_celery_worker(sender, **kwargs):
     logger = get_logger('pixyz_worker.signals')
@@ -43,20 +98,115 @@ def teardown_celery_worker(sender, **kwargs):
 @worker_shutting_down.connect
 def shutdown_celery_worker(sender, **kwargs):
     logger = get_logger('pixyz_worker.signals')
+    if priority_aging is not None:
+        priority_aging.stop()
+    if host_affinity is not None:
+        host_affinity.stop()
+    logger.info("Shutting down worker, stopping sandbox processes...")
+    SandboxPool.shutdown_instance()
     logger.info("Shutting down worker, releasing PiXYZ session if needed...")
     PiXYZSession.release_at_shutdown_if_needed(license_)
     logger.info("Shutting down worker, released...")
 
 
+def update_job_index(app, task_id, state, queue=None):
+    try:
+        JobIndex(app.backend.client).update(task_id, state=state, queue=queue)
+    except Exception as e:
+        logger = get_logger('pixyz_worker.signals')
+        logger.warning(f"Unable to update the job index of {task_id}: {e}")
+
+
+def cache_job_result(app, task_id, result):
+    try:
+        ResultCache(app.backend.client).store(task_id, result)
+    except Exception as e:
+        logger = get_logger('pixyz_worker.signals')
+        logger.warning(f"Unable to cache the result of {task_id}: {e}")
+
+
+def publish_job_state(app, task_id, state):
+    # The postrun/revoked signals are sent after the backend is written, the subscribers can read the final meta
+    client = getattr(app.backend, 'client', None)
+    if client is not None:
+        JobEvents(client).publish(task_id, state)
+
+
+def get_job_graph_id(task, args):
+    """
+    The job of a stage task of a multi-stage job (see JobGraph), None for the other tasks
+    """
+    if task is None or task.name != 'pixyz_execute' or not args or len(args) < 2 or not isinstance(args[1], dict):
+        return None
+    return (args[1].get('dag') or {}).get('job_id')
+
+
+def update_job_graph(app, job_id):
+    try:
+        state = JobGraph.update(app, job_id)
+    except Exception as e:
+        logger = get_logger('pixyz_worker.signals')
+        logger.warning(f"Unable to update the multi-stage job {job_id}: {e}")
+        return
+    if state is not None:
+        update_job_index(app, job_id, state)
+        publish_job_state(app, job_id, state)
+
+
+# Start time of the tasks running in this process
+task_start_times = {}
+
+
+def record_job_duration(app, task_id, args, duration):
+    """
+    Record the duration of a successful job (not of its subtasks) for the adaptive time limits
+    """
+    if not args or len(args) < 2 or not isinstance(args[1], dict):
+        return
+    pc = args[1]
+    if pc.get('task_id') != task_id or not pc.get('process'):
+        return
+    try:
+        model = DurationModel(app.backend.client)
+        model.record(DurationModel.get_kind(pc['process'], pc.get('data'), pc.get('root_file')), duration)
+    except Exception as e:
+        logger = get_logger('pixyz_worker.signals')
+        logger.warning(f"Unable to record the duration of {task_id}: {e}")
+
+
 @task_prerun.connect
-def before_task_starts(sender=None, task_id=None, task=None, **kwargs):
+def before_task_starts(sender=None, task_id=None, task=None, args=None, **kwargs):
     WatchdogByFileHandler.set_latest_task_info(task)
+    task_start_times[task_id] = time.monotonic()
+    update_job_index(task.app, task_id, 'RUNNING',
+                     get_generic_queue((task.request.delivery_info or {}).get('routing_key')))
+    if job_id := get_job_graph_id(task, args):
+        update_job_graph(task.app, job_id)
 
 
 @task_postrun.connect
-def after_task_completes(sender=None, task_id=None, task=None, **kwargs):
+def after_task_completes(sender=None, task_id=None, task=None, args=None, state=None, retval=None, **kwargs):
     WatchdogByFileHandler.clear_latest_task_id()
+    if state == 'SUCCESS' and task.name == 'pixyz_execute' and ResultCache.is_enabled():
+        # Before the state is published, a job submitted after the end of this one can reuse its result
+        cache_job_result(task.app, task_id, retval)
+    started = task_start_times.pop(task_id, None)
+    if state == 'SUCCESS' and task.name == 'pixyz_execute' and started is not None and DurationModel.is_enabled():
+        record_job_duration(task.app, task_id, args, time.monotonic() - started)
+    if state is not None:
+        update_job_index(task.app, task_id, state)
+        publish_job_state(task.app, task_id, state)
+        if job_id := get_job_graph_id(task, args):
+            update_job_graph(task.app, job_id)
     if TasksWatchdog.is_time_to_shutdown():
         print("You are reached the maximum task acceptable for this worker, goodbye")
         sender.app.control.broadcast('shutdown')
 
+
+
+@task_revoked.connect
+def after_task_revoked(sender=None, request=None, **kwargs):
+    if request is not None:
+        app = sender.app if sender is not None else current_app
+        update_job_index(app, request.id, 'REVOKED')
+        publish_job_state(app, request.id, 'REVOKED')
@@ -7,6 +7,7 @@ from tempfile import TemporaryDirectory
 from .share import *
 from .progress import *
 from .exception import *
+from .extractcache import ExtractionCache
 
 __all__ = ['StorageOutputManager', 'FileInputTemporary', 'StorageSharedManager', 'StorageTemporaryManager',
            'ExecuteIfEnabled']
@@ -143,18 +144,27 @@ class FileInputTemporary(StorageTemporaryManager):
             self.create_directory()
             self.logger.debug(f"Extract archive {self.filename_in} to {self.directory}")
             self.progress_next(f"Extracting archive")
-            shutil.unpack_archive(self.filename_in, self.directory)
+            if ExtractionCache.is_enabled():
+                # Extracted once per worker, the index gives the root file without walking the tree
+                index = ExtractionCache().extract(self.filename_in, self.directory)
+            else:
+                shutil.unpack_archive(self.filename_in, self.directory)
+                index = None
 
             # Try to solve the root file automatically
             if self.root_file is None:
                 self.logger.debug(f"No root file specified, auto-searching ON")
-                targeted_file_name = get_first_3D_files_in_directory(self.directory)
+                if index is not None:
+                    root_file = get_root_3D_file(index['files'])
+                    targeted_file_name = os.path.join(self.directory, root_file) if root_file is not None else None
+                else:
+                    targeted_file_name = get_first_3D_files_in_directory(self.directory)
             else:
                 self.logger.debug(f"root file specified, auto-searching OFF")
                 targeted_file_name = os.path.join(self.directory, self.root_file)
 
-            # Last check if file exist
-            if not os.path.exists(targeted_file_name):
+            # Last check if file exist (None if the archive has no 3D file)
+            if targeted_file_name is None or not os.path.isfile(targeted_file_name):
                 raise PixyzFileNotFound(f"The 3D file was NOT found in {self.filename_in}")
             else:
                 self.logger.debug(f"Found 3D file {targeted_file_name} in {self.filename_in}")
@@ -16,7 +16,7 @@ import sys
 from billiard.exceptions import WorkerLostError, SoftTimeLimitExceeded
 from celery import Celery
 
-from tempfile import NamedTemporaryFile, TemporaryDirectory
+from tempfile import TemporaryDirectory
 
 import pixyz_worker.config
 from pixyz_worker.exception import *
@@ -25,6 +25,9 @@ from pixyz_worker.share import *
 from pixyz_worker.extcode import *
 from pixyz_worker.progress import TaskProgress
 from pixyz_worker.storage import *
+from pixyz_worker.archive import package_directory
+from pixyz_worker.artifacts import ArtifactCache
+from pixyz_worker.locality import HostAffinity, get_generic_queue
 from pixyz_worker.utils import *
 from pixyz_worker.pc import *
 from pixyz_worker.license import *
@@ -162,13 +165,18 @@ def update_state_with_exception(self, exc, **kwargs):
 # You must retry a delete for avoiding an OS file system cache error
     
 @app.task(**task_params(mgmt_task_params, name="cleanup_share_file", queue="clean"))
-def cleanup_share_file(self, file_path, is_directory=False):
+def cleanup_share_file(self, file_path, is_directory=False, blob=None):
     inode_type = "DIRECTORY" if is_directory else "file"
     logger.info(f"Cleanup share {inode_type} {file_path}")
     try:
         if not is_directory:
             logger.info(f"Removing {inode_type} {file_path}")
-            os.remove(file_path)
+            try:
+                os.remove(file_path)
+            finally:
+                # The last job input linked to a blob releases it
+                if blob is not None:
+                    release_blob(blob)
         else:
             # Ultimate sanity check before removing a directory
             if is_path_in_share(file_path) and is_a_valid_job_id_directory(file_path):
@@ -218,12 +226,18 @@ def pixyz_execute(self, params: dict, pc: ProgramContext = None):
         self.update_state(task_id=self.request.id, state='RUNNING', meta={'shadow_name': self.request.shadow})
     except:
         pass
+    # Segfault protection is only available from the worker main process
+    segfault_protection = current_process().name == 'MainProcess' and platform.system() != 'Windows'
+    # With the sandbox pool, the pixyz session is owned by the sandbox process
+    sandboxed = segfault_protection and SandboxPool.is_enabled()
     # Run the task
     try:
-        with PiXYZSession(license_):
-            with TaskProgress(self, self.request.id, 1, time_request=pc['time_request']) as progress:
+        with TaskProgress(self, self.request.id, 1, time_request=pc['time_request']) as progress:
+            with ExecuteIfEnabled(PiXYZSession(license_, progress), not sandboxed):
                 with FileInputTemporary(pc['data'], progress=progress, root_file=pc['root_file']) as tmp:
-                    with ExecuteIfEnabled(StorageOutputManager(self.request.id), not pc['compute_only']) as shared:
+                    # The stages of a multi-stage job share the output directory of the job
+                    output_job_id = pc['dag']['job_id'] if pc.get('dag') else self.request.id
+                    with ExecuteIfEnabled(StorageOutputManager(output_job_id), not pc['compute_only']) as shared:
                         if pc is None:
                             pc = ProgramContext()
                         elif isinstance(pc, dict):
@@ -235,8 +249,11 @@ def pixyz_execute(self, params: dict, pc: ProgramContext = None):
                                   progress=progress,
                                   params=params,
                                   task=self,
-                                  queue=self.request.delivery_info.get('routing_key'),
+                                  queue=get_generic_queue(self.request.delivery_info.get('routing_key')),
                                   retry=self.request.retries)
+                        if pc.get('affinity'):
+                            progress.store(locality=HostAffinity.report(
+                                self.app, pc['affinity'], self.request.delivery_info.get('routing_key')))
 
                         # Update the number of retry in the task state
                         if self.request.retries > 0:
@@ -249,13 +266,21 @@ def pixyz_execute(self, params: dict, pc: ProgramContext = None):
                                 # This is useful for testing purposes
                                 current_queue = "unknown"
                             logger.info(f">>>> Starting PiXYZ execution entrypoint:{str(pc['entrypoint'])} queue:{current_queue} context:{str(pc)}")
-                            if current_process().name == 'MainProcess' and platform.system() != 'Windows':
+                            if segfault_protection:
                                 # enable segfault protection
                                 ret = SignalSafeExecution.run(ExternalPythonCode(pc['script']).execute, pc,
                                                               **get_task_params(self))
+                                if sandboxed:
+                                    progress.store(sandbox=SandboxPool.get_instance().get_stats())
                             else:
+                                PiXYZSession.mark_used()
                                 ret = ExternalPythonCode(pc['script']).execute(pc)
                             logger.info(f"<<<< PiXYZ execution finished OK")
+                            if pc.get('artifacts'):
+                                ArtifactCache().handoff(self, pc['artifacts'])
+                            if HostAffinity.is_enabled() and (locality := HostAffinity.get_stats(self.app,
+                                                                                                  self.request.id)):
+                                progress.store(subtasks_locality=locality)
                         except retrievable_exceptions as exc:
                             logger.info(f"!!!! PiXYZ execution finished with retrievable exception: {exc}, retrying...")
                             logger.error(traceback.format_exc())
@@ -302,23 +327,17 @@ def package(self, job_id, package_type='zip'):
             compression_extension = pixyz_worker.config.supported_archive[package_type]
             archive_path = get_job_archive_file_path(job_id, file_name=f"{job_id}.{compression_extension}")
 
-            # Don't archive in the same directory otherwise the archive will be included in the archive
-            tmp_file = None
-
-            with NamedTemporaryFile(delete=False) as tmp:
-                tmp.close()
-                tmp_file = tmp.name
-                logger.info(f"Packaging {source_directory} to {tmp_file}...")
-                shutil.make_archive(tmp_file, package_type, source_directory)
+            # The archive is written in the archives directory (never in the outputs) with a temporary name and
+            # renamed on the same filesystem, so a download never gets a partial archive
+            tmp_path = f"{archive_path}.{self.request.id}.tmp"
+            try:
+                logger.info(f"Packaging {source_directory} to {archive_path}...")
+                package_directory(source_directory, tmp_path, package_type)
+                os.replace(tmp_path, archive_path)
                 logger.info(f"Packaging done.")
-            if tmp_file is not None:
-                logger.info(f"Move archive from {tmp_file} to output directory {archive_path}")
-                # the make_archive function add the file extension to the archive name
-                # Don't move because you must keep on the same filesystem
-                shutil.copy(f"{tmp_file}.{compression_extension}", archive_path)
-                os.unlink(tmp_file)
-            else:
-                raise PixyzFileNotFound(f"Temporary file {tmp_file} not found")
+            finally:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
 
             # Todo: Update meta with created archive_name ?
 
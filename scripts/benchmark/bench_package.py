@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# python3 scripts/benchmark/bench_package.py [repeat] [size_mb]
+# Compare the legacy make_archive + copy packaging with the streaming parallel package_directory
+# on a synthetic output directory (compressible meshes/metadata and already compressed glb/png/pxz)
+import os
+import sys
+import time
+import shutil
+from tempfile import TemporaryDirectory, NamedTemporaryFile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../'))
+from pixyz_worker.archive import package_directory
+
+
+def build_output_directory(directory, size_mb=256):
+    # Half compressible text, half random (already compressed formats)
+    unit = size_mb * 1024 * 1024 // 8
+    line = b'v 0.125000 -1.500000 3.250000\nvn 0.000000 1.000000 0.000000\n'
+    for i in range(2):
+        with open(os.path.join(directory, f"mesh_{i}.obj"), 'wb') as f:
+            f.write(line * (unit // len(line)))
+    with open(os.path.join(directory, 'metadata.json'), 'wb') as f:
+        f.write(b'{"name": "part", "polygon_count": 123456, "material": "steel"},\n' * (unit // 64))
+    os.makedirs(os.path.join(directory, 'thumbnails'))
+    for i in range(2):
+        with open(os.path.join(directory, 'thumbnails', f"view_{i}.png"), 'wb') as f:
+            f.write(os.urandom(unit // 2))
+    for name in ('scene.glb', 'scene.pxz'):
+        with open(os.path.join(directory, name), 'wb') as f:
+            f.write(os.urandom(unit))
+    with open(os.path.join(directory, 'texture.bin'), 'wb') as f:
+        f.write(os.urandom(unit))
+
+
+def bench_make_archive(source, destination, package_type, extension):
+    start = time.perf_counter()
+    with NamedTemporaryFile(delete=False) as tmp:
+        tmp.close()
+        shutil.make_archive(tmp.name, package_type, source)
+        shutil.copy(f"{tmp.name}.{extension}", destination)
+        os.unlink(tmp.name)
+        os.unlink(f"{tmp.name}.{extension}")
+    return time.perf_counter() - start
+
+
+def bench_package_directory(source, destination, package_type, extension):
+    start = time.perf_counter()
+    package_directory(source, destination, package_type)
+    return time.perf_counter() - start
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    size_mb = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+    with TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'outputs')
+        os.makedirs(source)
+        build_output_directory(source, size_mb)
+        for package_type, extension in (('zip', 'zip'), ('gztar', 'tar.gz')):
+            for bench in (bench_make_archive, bench_package_directory):
+                destination = os.path.join(tmp, f"archive.{extension}")
+                durations = []
+                for _ in range(repeat):
+                    durations.append(bench(source, destination, package_type, extension))
+                size = os.path.getsize(destination)
+                os.unlink(destination)
+                print(f"{package_type:6} {bench.__name__:24} best={min(durations) * 1000:9.1f}ms "
+                      f"avg={sum(durations) / len(durations) * 1000:9.1f}ms size={size / 1024 / 1024:7.1f}MB")
+
+
+if __name__ == '__main__':
+    main()
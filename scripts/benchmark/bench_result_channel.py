@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# python3 scripts/benchmark/bench_result_channel.py [repeat]
+# Compare the legacy Manager().list() proxy with the ResultChannel pipe used by SignalSafeExecution
+import os
+import sys
+import time
+from multiprocessing import Manager, Pipe, Process
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../'))
+from pixyz_worker.extcode import ResultChannel
+
+
+def build_metadata_result(parts=20000):
+    # Looks like a generate_thumbnails/generate_metadata result with per-part info
+    return {'metadata': {f"part_{i}": {'name': f"Part {i}", 'polygon_count': i * 12, 'aabb': [i, i + 1.5, i * 2.0],
+                                       'material': f"material_{i % 50}"} for i in range(parts)},
+            'preview': {'file': 'preview.glb', 'size': '512x512'}}
+
+
+def build_binary_result(size=64 * 1024 * 1024):
+    return {'thumbnail': os.urandom(size)}
+
+
+def _manager_child(shared, result):
+    shared.append(result)
+
+
+def _channel_child(conn, result):
+    ResultChannel.send(conn, result)
+
+
+def bench_manager(result):
+    start = time.perf_counter()
+    with Manager() as manager:
+        shared = manager.list()
+        process = Process(target=_manager_child, args=(shared, result))
+        process.start()
+        process.join()
+        ret = shared[0]
+    return time.perf_counter() - start, ret
+
+
+def bench_channel(result):
+    start = time.perf_counter()
+    reader, writer = Pipe(duplex=False)
+    process = Process(target=_channel_child, args=(writer, result))
+    process.start()
+    writer.close()
+    ret = ResultChannel.recv(reader)
+    process.join()
+    reader.close()
+    return time.perf_counter() - start, ret
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    for name, result in (('metadata dict', build_metadata_result()), ('64MB bytes', build_binary_result())):
+        for bench in (bench_manager, bench_channel):
+            durations = []
+            for _ in range(repeat):
+                duration, ret = bench(result)
+                assert ret == result
+                durations.append(duration)
+            print(f"{name:15} {bench.__name__:15} best={min(durations) * 1000:9.1f}ms "
+                  f"avg={sum(durations) / len(durations) * 1000:9.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -109,8 +109,7 @@ def prepare_model(pc: ProgramContext, params: dict):
     # get the start time
     start_time = datetime.now()
 
-    # Import the files in a scene
-    pxz.core.resetSession()
+    # Import the files in a scene (the scheduler starts each task with a clean scene)
     progress.next(f"Importing file {pc['queue']}")
     pxz.io.importFiles([filepath])
 